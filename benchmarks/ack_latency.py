@@ -0,0 +1,113 @@
+# coding=utf-8
+"""
+How long Github waits for ``/github/pr`` to acknowledge a burst of
+"opened" events, with the work queued (as it is now) or done inline (as it
+was before the job queue).
+
+Deliveries arrive at ``--rate`` a second, and ``--workers`` threads stand
+in for the gunicorn workers. A delivery's ack latency counts the time it
+waits for a free worker, like it would behind gunicorn. Every Github and
+JIRA call takes ``--latency`` seconds, see ``fakes.py``.
+
+    $ DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/ack_latency.py 2>/dev/null
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from Queue import Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes
+from openedx_webhooks import app
+from openedx_webhooks.models import db
+import openedx_webhooks.views.github as github_views
+
+
+class InlineJob(object):
+    id = 0
+
+
+def run_inline(func, *args, **kwargs):
+    """
+    Stands in for `enqueue`: do the work right away, like before the queue.
+    """
+    func(*args, **kwargs)
+    return InlineJob()
+
+
+def deliver(client, number):
+    event = {"action": "opened", "pull_request": fakes.pull_request(number)}
+    resp = client.post(
+        "/github/pr", data=json.dumps(event), content_type="application/json",
+        headers={"X-Forwarded-Proto": "https", "X-GitHub-Delivery": str(uuid.uuid4())},
+    )
+    assert resp.status_code in (200, 202), resp.data
+
+
+def run(mode, deliveries, rate, workers):
+    github_views.enqueue = run_inline if mode == "inline" else real_enqueue
+    arrivals = Queue()
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        while True:
+            item = arrivals.get()
+            if item is None:
+                return
+            number, arrived_at = item
+            deliver(client, number)
+            with lock:
+                latencies.append(time.time() - arrived_at)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    start = time.time()
+    for i in range(deliveries):
+        # send on schedule, however far behind the workers are
+        time.sleep(max(0, start + i / rate - time.time()))
+        arrivals.put((int(start * 1000) % 10 ** 6 * 1000 + i, time.time()))
+    for _ in threads:
+        arrivals.put(None)
+    for thread in threads:
+        thread.join()
+    print("{mode:>7}: p50 {p50:6.3f}s  p95 {p95:6.3f}s  p99 {p99:6.3f}s  max {max:6.3f}s".format(
+        mode=mode,
+        p50=fakes.percentile(latencies, 50), p95=fakes.percentile(latencies, 95),
+        p99=fakes.percentile(latencies, 99), max=max(latencies),
+    ))
+
+
+real_enqueue = github_views.enqueue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--deliveries", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="deliveries a second")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=fakes.LATENCY)
+    parser.add_argument("--mode", choices=("inline", "queued", "both"), default="both")
+    args = parser.parse_args()
+
+    fakes.install(args.latency)
+    with app.app_context():
+        db.create_all()
+    print("{num} deliveries at {rate}/s, {workers} workers, {latency}s per upstream call".format(
+        num=args.deliveries, rate=args.rate, workers=args.workers, latency=args.latency,
+    ))
+    for mode in ("inline", "queued") if args.mode == "both" else (args.mode,):
+        run(mode, args.deliveries, args.rate, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# coding=utf-8
+"""
+Time what a process starting up pays to read people.yaml: parsing it with
+PyYAML's pure-Python loader, with libyaml, and loading the snapshot that
+``load_yaml`` saves, for a synthetic file.
+
+    $ python benchmarks/config_parse.py --people 20000
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from people_index import people_yaml
+from openedx_webhooks import remote_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--people", type=int, default=20000)
+    args = parser.parse_args()
+
+    text = people_yaml(args.people)
+    print("people.yaml: {num} people, {kb} KB".format(num=args.people, kb=len(text) // 1024))
+
+    loaders = [yaml.SafeLoader]
+    if hasattr(yaml, "CSafeLoader"):
+        loaders.append(yaml.CSafeLoader)
+    else:
+        print("  libyaml isn't installed, so CSafeLoader can't be timed")
+    for loader in loaders:
+        start = time.time()
+        people = yaml.load(text, Loader=loader)
+        print("  {loader:>12}: {secs:.2f}s".format(loader=loader.__name__, secs=time.time() - start))
+
+    snapshot_dir = tempfile.mkdtemp()
+    remote_files.CONFIG_SNAPSHOT_DIR = os.path.join(snapshot_dir, "snapshots")
+    try:
+        # the first process parses it and saves the snapshot
+        remote_files.load_yaml(text, name="people")
+        remote_files.load_yaml.uncache(text, name="people")
+        start = time.time()
+        loaded = remote_files.load_yaml(text, name="people")
+        secs = time.time() - start
+    finally:
+        shutil.rmtree(snapshot_dir)
+    assert loaded == people
+    print("  {loader:>12}: {secs:.2f}s".format(loader="snapshot", secs=secs))
+
+
+if __name__ == "__main__":
+    main()
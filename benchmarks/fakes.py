@@ -0,0 +1,121 @@
+# coding=utf-8
+"""
+Fake Github and JIRA sessions for the benchmarks, so that they measure our
+own code plus a fixed, known latency per upstream call, without touching
+the real services. Run the benchmarks from the repository root with a
+throwaway ``DATABASE_URL``, like ``sqlite:////tmp/bench.db``.
+"""
+from __future__ import unicode_literals, print_function
+
+import json
+import time
+import itertools
+
+# seconds that each fake upstream call takes
+LATENCY = 0.1
+
+_issue_numbers = itertools.count(1)
+
+
+class FakeResponse(object):
+    def __init__(self, data, text=None, status_code=200):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._data = data
+        self.text = text if text is not None else json.dumps(data)
+        self.content = self.text.encode("utf-8")
+        self.links = {}
+        self.url = ""
+        self.headers = {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession(object):
+    """
+    Answers the calls that ``pr_opened`` and ``pr_closed`` make, each after
+    ``latency`` seconds.
+    """
+    def __init__(self, latency=LATENCY):
+        self.latency = latency
+
+    def get(self, url, **kwargs):
+        time.sleep(self.latency)
+        if url.endswith("/field"):
+            names = ["URL", "PR Number", "Repo", "Contributor Name", "Customer"]
+            return FakeResponse([
+                {"id": "customfield_{}".format(i), "name": name, "custom": True}
+                for i, name in enumerate(names)
+            ])
+        if "AUTHORS" in url:
+            return FakeResponse(None, text="Jane Doe <jdoe@example.com>\n")
+        if "/comments" in url:
+            return FakeResponse([])
+        if url.endswith("/user"):
+            return FakeResponse({"login": "bot"})
+        if "/search" in url:
+            return FakeResponse({"issues": []})
+        if "/transitions" in url:
+            return FakeResponse({"transitions": [
+                {"id": "1", "name": "Merge", "to": {"name": "Merged"}},
+                {"id": "2", "name": "Reject", "to": {"name": "Rejected"}},
+            ]})
+        if "/rest/api/2/issue/" in url:
+            return FakeResponse({"fields": {
+                "project": {"key": "OSPR"},
+                "issuetype": {"name": "Pull Request Review"},
+                "status": {"name": "Needs Triage"},
+            }})
+        return FakeResponse({"name": "Some One"})
+
+    def post(self, url, **kwargs):
+        time.sleep(self.latency)
+        return FakeResponse({"key": "OSPR-{}".format(next(_issue_numbers))}, status_code=201)
+
+    def patch(self, url, **kwargs):
+        time.sleep(self.latency)
+        return FakeResponse({})
+
+    put = patch
+
+
+def install(latency=LATENCY):
+    """
+    Replace the Github and JIRA sessions that the views use with fakes, and
+    preload people.yaml.
+    """
+    import openedx_webhooks.views.github as github_views
+    import openedx_webhooks.views.jira as jira_views
+    from openedx_webhooks.remote_files import people_file
+
+    session = FakeSession(latency)
+    github_views.github = session
+    github_views.jira = session
+    jira_views.jira = session
+    people_file.value = {"jdoe": {"name": "Jane Doe", "institution": "Example"}}
+    # don't refresh it during the benchmark
+    people_file.fetched_at = time.time() + 24 * 60 * 60
+
+
+def pull_request(number, login="stranger"):
+    return {
+        "user": {"login": login, "url": "https://api.github.com/users/" + login},
+        "base": {"repo": {"full_name": "edx/edx-platform"}},
+        "head": {"repo": {"full_name": login + "/edx-platform"}, "ref": "patch-1"},
+        "number": number,
+        "title": "Fix a bug",
+        "body": "This fixes a bug.",
+        "html_url": "https://github.com/edx/edx-platform/pull/{}".format(number),
+        "created_at": "2015-01-01T00:00:00Z",
+        "merged": False,
+    }
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
@@ -0,0 +1,108 @@
+# coding=utf-8
+"""
+Time ``paginated_get`` over a local fake Github listing, fetching pages
+concurrently and sequentially, and count how many pages each mode fetches
+when the caller stops after the first two pages. By default it runs a few
+listings, including one with fast pages, where the cost of running pages
+concurrently shows up; ``--pages`` and ``--latency`` run just one.
+
+    $ python benchmarks/paginated_get.py
+    $ python benchmarks/paginated_get.py --pages 30 --latency 0.1
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import argparse
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openedx_webhooks.utils import paginated_get
+
+
+class Listing(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    pages = 8
+    latency = 0.1
+    fetched = 0
+
+
+class ListingHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.fetched += 1
+        query = parse_qs(urlparse(self.path).query)
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["30"])[0])
+        time.sleep(server.latency)
+        base = "http://127.0.0.1:{port}/items?per_page={per_page}&page=".format(
+            port=server.server_port, per_page=per_page,
+        )
+        links = []
+        if page < server.pages:
+            links.append('<{base}{next}>; rel="next"'.format(base=base, next=page + 1))
+            links.append('<{base}{last}>; rel="last"'.format(base=base, last=server.pages))
+        first = (page - 1) * per_page
+        body = "[" + ",".join('{{"id": {}}}'.format(first + i) for i in range(per_page)) + "]"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if links:
+            self.send_header("Link", ", ".join(links))
+        self.end_headers()
+        self.wfile.write(body.encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+# (pages, seconds per page) for the listings that are timed by default
+CASES = [(8, 0.1), (30, 0.1), (10, 0.02), (10, 0.0)]
+
+
+def time_listing(server, url, concurrency):
+    print("{pages} pages, {latency}s each".format(pages=server.pages, latency=server.latency))
+    for sequential in (True, False):
+        mode = "sequential" if sequential else "concurrent"
+        start = time.time()
+        items = list(paginated_get(url, concurrency=concurrency, sequential=sequential))
+        secs = time.time() - start
+        assert [item["id"] for item in items] == list(range(len(items)))
+
+        server.fetched = 0
+        for i, item in enumerate(paginated_get(url, concurrency=concurrency, sequential=sequential)):
+            if i == 199:
+                break
+        print("{mode:>10}: {num} items in {secs:.2f}s; stopping after 2 pages fetched {fetched}".format(
+            mode=mode, num=len(items), secs=secs, fetched=server.fetched,
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int)
+    parser.add_argument("--latency", type=float, help="seconds per page")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+    cases = CASES
+    if args.pages or args.latency is not None:
+        cases = [(args.pages or 8, 0.1 if args.latency is None else args.latency)]
+
+    server = Listing(("127.0.0.1", 0), ListingHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = "http://127.0.0.1:{port}/items".format(port=server.server_port)
+
+    for pages, latency in cases:
+        server.pages, server.latency = pages, latency
+        time_listing(server, url, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
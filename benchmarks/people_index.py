@@ -0,0 +1,132 @@
+# coding=utf-8
+"""
+Time classifying pull request authors against a synthetic people.yaml, the
+way the views did it before ``PeopleIndex`` (straight from the parsed YAML,
+with a lowercased copy of it for the community comment), and with the index.
+
+    $ python benchmarks/people_index.py --people 50000
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import date
+
+import yaml
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+from iso8601 import parse_date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openedx_webhooks.people import (
+    PeopleIndex, pull_request_date, INTERNAL_INSTITUTIONS, CONTRACTOR_INSTITUTIONS,
+)
+
+INSTITUTIONS = sorted(INTERNAL_INSTITUTIONS | CONTRACTOR_INSTITUTIONS) + [
+    "University {}".format(num) for num in range(200)
+]
+
+
+def people_yaml(num_people, seed=0):
+    """
+    The text of a people.yaml with ``num_people`` people, some of them with
+    an agreement that has expired.
+    """
+    rand = random.Random(seed)
+    people = {}
+    for num in range(num_people):
+        person = {"name": "Person {}".format(num), "institution": rand.choice(INSTITUTIONS)}
+        if rand.random() < 0.2:
+            person["expires_on"] = date(rand.randint(2012, 2020), rand.randint(1, 12), 1)
+        people["User{}".format(num)] = person
+    return yaml.safe_dump(people, default_flow_style=False)
+
+
+def pull_requests(num_people, num_prs, seed=1):
+    rand = random.Random(seed)
+    prs = []
+    for _ in range(num_prs):
+        # some authors aren't in people.yaml, and logins come in any case
+        login = rand.choice(["User{}", "user{}"]).format(rand.randint(0, num_people * 5 // 4))
+        prs.append({
+            "user": {"login": login.encode("utf-8")},
+            "created_at": "{year}-06-15T12:00:00Z".format(year=rand.randint(2013, 2019)),
+        })
+    return prs
+
+
+def classify_from_yaml(people, pull_request):
+    """
+    What `is_internal_pull_request`, `is_contractor_pull_request` and
+    `github_community_pr_comment` did for each pull request before the index.
+    """
+    author = pull_request["user"]["login"].decode('utf-8')
+    created_at = parse_date(pull_request["created_at"]).replace(tzinfo=None)
+    internal = (
+        author in people and
+        people[author].get("institution") in set(("edX", "Arbisoft")) and
+        people[author].get("expires_on", date.max) > created_at.date()
+    )
+    created_at = parse_date(pull_request["created_at"]).replace(tzinfo=None)
+    contractor = (
+        author in people and
+        people[author].get("institution") in set(("BNOTIONS", "OpenCraft", "ExtensionEngine")) and
+        people[author].get("expires_on", date.max) > created_at.date()
+    )
+    lowered = {user.lower(): values for user, values in people.items()}
+    created_at = parse_date(pull_request["created_at"]).replace(tzinfo=None)
+    signed = (
+        author.lower() in lowered and
+        lowered[author.lower()].get("expires_on", date.max) > created_at.date()
+    )
+    return internal, contractor, signed
+
+
+def classify_from_index(index, pull_request):
+    author = pull_request["user"]["login"].decode('utf-8')
+    on_date = pull_request_date(pull_request)
+    return index.classify(author, on_date), index.has_agreement(author, on_date)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--people", type=int, default=50000)
+    parser.add_argument("--prs", type=int, default=1000)
+    parser.add_argument("--yaml-prs", type=int, default=20,
+                        help="pull requests to time the old way, which is much slower")
+    args = parser.parse_args()
+
+    text = people_yaml(args.people)
+    start = time.time()
+    people = yaml.load(text, Loader=SafeLoader)
+    print("people.yaml: {num} people, {kb} KB, parsed with {loader} in {secs:.2f}s".format(
+        num=len(people), kb=len(text) // 1024, loader=SafeLoader.__name__, secs=time.time() - start,
+    ))
+    prs = pull_requests(args.people, args.prs)
+
+    start = time.time()
+    for pull_request in prs[:args.yaml_prs]:
+        classify_from_yaml(people, pull_request)
+    per_pr = (time.time() - start) / args.yaml_prs
+    print("  from the YAML: {ms:10.3f}ms per pull request".format(ms=per_pr * 1000))
+
+    start = time.time()
+    index = PeopleIndex(people)
+    print("  building the index: {secs:.3f}s, once per people.yaml revision".format(
+        secs=time.time() - start,
+    ))
+    start = time.time()
+    for pull_request in prs:
+        classify_from_index(index, pull_request)
+    per_pr = (time.time() - start) / len(prs)
+    print("  from the index: {ms:10.3f}ms per pull request".format(ms=per_pr * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# coding=utf-8
+"""
+Time ``pr_opened`` against the fake Github and JIRA in ``fakes.py``, with
+its independent upstream calls overlapped (as they are now) or made one
+after another (as they were before ``run_async``).
+
+Every upstream call takes ``--latency`` seconds, and the JIRA custom fields
+are fetched for each pull request, as they are when the cache is cold.
+Pull requests alternate between an author in people.yaml, who is looked up
+in the AUTHORS file, and one who isn't, whose name is looked up on Github.
+
+    $ DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/pr_opened.py 2>/dev/null
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakes
+from openedx_webhooks import app
+from openedx_webhooks.models import db
+from openedx_webhooks.jobs import request_context
+import openedx_webhooks.views.github as github_views
+import openedx_webhooks.views.jira as jira_views
+
+
+class Finished(object):
+    """
+    What `run_inline` returns: like the result of `run_async`, but the call
+    has already been made.
+    """
+    def __init__(self, func, args, kwargs):
+        self.error = None
+        try:
+            self.value = func(*args, **kwargs)
+        except Exception as err:
+            self.error = err
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def run_inline(func, *args, **kwargs):
+    """
+    Stands in for `run_async`: make the call right away, like before.
+    """
+    return Finished(func, args, kwargs)
+
+
+real_run_async = github_views.run_async
+
+
+def run(mode, pull_requests, first_number):
+    github_views.run_async = run_inline if mode == "sequential" else real_run_async
+    latencies = []
+    with request_context():
+        for i in range(pull_requests):
+            jira_views.get_jira_custom_fields.uncache()
+            login = "jdoe" if i % 2 else "stranger"
+            start = time.time()
+            github_views.pr_opened(fakes.pull_request(first_number + i, login))
+            latencies.append(time.time() - start)
+    print("{mode:>10}: p50 {p50:6.3f}s  max {max:6.3f}s".format(
+        mode=mode, p50=fakes.percentile(latencies, 50), max=max(latencies),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pull-requests", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=fakes.LATENCY)
+    args = parser.parse_args()
+
+    fakes.install(args.latency)
+    with app.app_context():
+        db.create_all()
+    with request_context():
+        github_views.github_whoami()
+    print("{num} pull requests, {latency}s per upstream call".format(
+        num=args.pull_requests, latency=args.latency,
+    ))
+    # pull request numbers that this database hasn't seen yet
+    first_number = int(time.time()) % 10 ** 6 * 1000
+    for mode in ("sequential", "concurrent"):
+        run(mode, args.pull_requests, first_number)
+        first_number += args.pull_requests
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# coding=utf-8
+"""
+Gunicorn settings, used by the Procfile.
+
+The app is loaded once in the master process, which fills the caches before
+forking the workers, so that the first webhooks after a deploy don't have to.
+"""
+from __future__ import unicode_literals
+
+preload_app = True
+
+
+def when_ready(server):
+    from openedx_webhooks.warmup import warm_up
+    warm_up()
+
+
+def post_fork(server, worker):
+    # in case the master opened any connections after the warm-up
+    from openedx_webhooks.warmup import close_http_connections
+    close_http_connections()
@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+from __future__ import print_function
+import os
 from flask.ext.script import Manager, prompt_bool
 from openedx_webhooks import app
 from openedx_webhooks.models import db
@@ -21,5 +23,29 @@ def dbdrop():
         db.session.commit()
 
 
+@manager.option("-c", "--concurrency", dest="concurrency", type=int,
+                default=int(os.environ.get("WORKER_CONCURRENCY", 4)))
+@manager.option("-b", "--burst", dest="burst", action="store_true", default=False)
+def worker(concurrency, burst):
+    "Processes queued webhook events"
+    from openedx_webhooks.jobs import work
+    work(concurrency=concurrency, burst=burst)
+
+
+@manager.option("-r", "--repo", dest="repos", action="append",
+                help="Repo to index (default: every repo in repos.yaml)")
+@manager.option("-s", "--state", dest="state", default="all",
+                help="Which pull requests to index: open, closed, or all")
+def backfill_issue_index(repos, state):
+    "Indexes the JIRA issues of existing pull requests by searching their comments"
+    from openedx_webhooks.jobs import request_context
+    from openedx_webhooks.ratelimit import background_priority
+    from openedx_webhooks.views.github import backfill_jira_issue_keys, get_repos_file
+    with request_context(), background_priority():
+        for repo in repos or get_repos_file().keys():
+            found = backfill_jira_issue_keys(repo, state=state)
+            print("{repo}: indexed {num} pull requests".format(repo=repo, num=len(found)))
+
+
 if __name__ == "__main__":
     manager.run()
@@ -15,15 +15,40 @@ from flask import Flask
 from flask_sslify import SSLify
 from .oauth import jira_bp, github_bp
 from .models import db
+from .upstream import start_request, end_request
+from .metrics import start_request_timer, record_request, record_failed_request
+from .tracing import start_request_trace, tag_response, end_request_trace
+from . import profiling
 from bugsnag.flask import handle_exceptions
 
 app = Flask(__name__)
 handle_exceptions(app)
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+if (app.config["SQLALCHEMY_DATABASE_URI"] or "").startswith("postgres"):
+    # a thread working on a pull request or JIRA issue uses two connections:
+    # its session's, and the one that holds its `keyed_lock`
+    app.config["SQLALCHEMY_POOL_SIZE"] = int(os.environ.get(
+        "DATABASE_POOL_SIZE", 2 * int(os.environ.get("WORKER_CONCURRENCY", 4)) + 1,
+    ))
+    # for the threads of a rescan
+    app.config["SQLALCHEMY_MAX_OVERFLOW"] = int(os.environ.get(
+        "DATABASE_MAX_OVERFLOW", 2 * int(os.environ.get("RESCAN_CONCURRENCY", 8)),
+    ))
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "secrettoeveryone")
 app.register_blueprint(jira_bp, url_prefix="/login")
 app.register_blueprint(github_bp, url_prefix="/login")
 db.init_app(app)
+app.before_request(start_request)
+app.teardown_request(end_request)
+app.before_request(start_request_timer)
+app.after_request(record_request)
+app.teardown_request(record_failed_request)
+app.before_request(start_request_trace)
+app.after_request(tag_response)
+app.teardown_request(end_request_trace)
+app.before_request(profiling.start_profile)
+app.after_request(profiling.tag_response)
+app.teardown_request(profiling.end_profile)
 if not app.debug:
     sslify = SSLify(app)
 
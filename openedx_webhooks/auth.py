@@ -0,0 +1,41 @@
+# coding=utf-8
+"""
+Access to the views that show what the bot has been doing, or change what
+it does, like ``/jobs/dead`` and ``/debug/traces``.
+
+These views don't exist unless ``ADMIN_TOKEN`` is set, and then they need
+the token, in an ``X-Admin-Token`` header or an ``admin_token`` query
+parameter.
+"""
+from __future__ import unicode_literals
+
+import os
+import hmac
+
+from flask import request, abort
+
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+
+def has_admin_token():
+    """
+    Whether the current request carries the admin token.
+    """
+    if not ADMIN_TOKEN:
+        return False
+    given = request.headers.get("X-Admin-Token") or request.args.get("admin_token")
+    if not given:
+        return False
+    # compare in constant time, so the token can't be guessed bit by bit
+    return hmac.compare_digest(given.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+
+def check_admin_token():
+    """
+    Abort the request unless it carries the admin token.
+    """
+    if not ADMIN_TOKEN:
+        abort(404)
+    if not has_admin_token():
+        abort(403)
@@ -0,0 +1,306 @@
+# coding=utf-8
+"""
+Caches that are shared between processes: for use with CacheControl, and as
+the shared tier behind :func:`openedx_webhooks.utils.cached`.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import stat
+import errno
+import hashlib
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from cachecontrol.cache import BaseCache, DictCache
+from sqlalchemy import func
+from openedx_webhooks.models import db, CacheEntry
+
+
+HTTP_CACHE_BACKEND = os.environ.get("HTTP_CACHE_BACKEND", "file")
+HTTP_CACHE_DIR = os.environ.get(
+    "HTTP_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "openedx_webhooks", "http-cache"),
+)
+# the most bytes to keep in each cache
+HTTP_CACHE_MAX_SIZE = int(os.environ.get("HTTP_CACHE_MAX_SIZE", 100 * 1024 * 1024))
+SHARED_CACHE_BACKEND = os.environ.get("SHARED_CACHE_BACKEND", "database")
+SHARED_CACHE_DIR = os.environ.get(
+    "SHARED_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "openedx_webhooks", "shared-cache"),
+)
+SHARED_CACHE_MAX_SIZE = int(os.environ.get("SHARED_CACHE_MAX_SIZE", 10 * 1024 * 1024))
+
+
+def private_directory(directory):
+    """
+    Make ``directory`` if it doesn't exist, and tell whether it's safe to
+    load pickles from it: loading a pickle can run any code, so the
+    directory must be ours and closed to other users.
+    """
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:
+            # another process made it first
+            if not os.path.isdir(directory):
+                raise
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        return False
+    if info.st_mode & 0o077:
+        # ours, but made by an older version with the default permissions
+        os.chmod(directory, 0o700)
+    return True
+
+
+def is_ours(f):
+    """
+    Whether we own this open file, rather than someone who managed to put
+    it in one of our directories before we made it private.
+    """
+    return os.fstat(f.fileno()).st_uid == os.getuid()
+
+
+def hash_key(key):
+    if not isinstance(key, bytes):
+        key = key.encode('utf-8')
+    return hashlib.sha1(key).hexdigest()
+
+
+class FileCache(BaseCache):
+    """
+    Keeps each entry in a file, so that every process on this machine can
+    use it. When there is more than ``max_size`` bytes in the directory,
+    the least recently used files are removed.
+
+    CacheControl keeps pickles in the cache, so the directory must be
+    private (see :func:`private_directory`), and files we don't own are
+    ignored. Use :func:`file_cache` to make one.
+    """
+    # check the size of the directory after this many writes
+    evict_every = 50
+
+    def __init__(self, directory, max_size=HTTP_CACHE_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, hash_key(key))
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                if not is_ours(f):
+                    return None
+                value = f.read()
+            # the modification time is used as the last access time
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return value
+
+    def set(self, key, value):
+        # write to a temporary file and rename it, so other processes never
+        # see a half-written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(value)
+        os.rename(tmp_path, self.path(key))
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is 10% under
+        ``max_size``.
+        """
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename.startswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def file_cache(directory, max_size):
+    """
+    A :class:`FileCache` in ``directory``, or None if the directory can't be
+    made private to us.
+    """
+    try:
+        private = private_directory(directory)
+    except (IOError, OSError) as err:
+        print("Can't use {dir} for a cache: {err}".format(dir=directory, err=err), file=sys.stderr)
+        return None
+    if not private:
+        print(
+            "Not using {dir} for a cache: it isn't private to us".format(dir=directory),
+            file=sys.stderr,
+        )
+        return None
+    return FileCache(directory, max_size=max_size)
+
+
+class DatabaseCache(BaseCache):
+    """
+    Keeps entries in the database, so that every process on every machine
+    can use them. When there is more than ``max_size`` bytes in this
+    cache's ``namespace``, the least recently used entries are removed.
+
+    This needs an app context. Without one, or if the database is having
+    trouble, it acts as an empty cache rather than raising errors.
+    """
+    evict_every = 50
+    # don't bother recording accesses that are closer together than this
+    touch_interval = timedelta(minutes=1)
+
+    def __init__(self, namespace, max_size=HTTP_CACHE_MAX_SIZE):
+        self.namespace = namespace
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def where(self, key):
+        table = CacheEntry.__table__
+        return (table.c.namespace == self.namespace) & (table.c.key == hash_key(key))
+
+    def get(self, key):
+        table = CacheEntry.__table__
+        try:
+            with db.engine.begin() as conn:
+                row = conn.execute(
+                    table.select().where(self.where(key))
+                ).first()
+                if not row:
+                    return None
+                now = datetime.utcnow()
+                if now - row.accessed_at > self.touch_interval:
+                    conn.execute(table.update().where(self.where(key)).values(accessed_at=now))
+                return bytes(row.value)
+        except Exception as err:
+            print("{namespace} cache get failed: {err}".format(namespace=self.namespace, err=err), file=sys.stderr)
+            return None
+
+    def set(self, key, value):
+        table = CacheEntry.__table__
+        values = {"value": value, "size": len(value), "accessed_at": datetime.utcnow()}
+        try:
+            with db.engine.begin() as conn:
+                updated = conn.execute(table.update().where(self.where(key)).values(**values))
+                if not updated.rowcount:
+                    conn.execute(table.insert().values(
+                        namespace=self.namespace, key=hash_key(key), **values
+                    ))
+        except Exception as err:
+            # including someone else inserting the same key at the same time
+            print("{namespace} cache set failed: {err}".format(namespace=self.namespace, err=err), file=sys.stderr)
+            return
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def delete(self, key):
+        table = CacheEntry.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(self.where(key)))
+        except Exception as err:
+            print("{namespace} cache delete failed: {err}".format(namespace=self.namespace, err=err), file=sys.stderr)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache is 10% under
+        ``max_size``.
+        """
+        table = CacheEntry.__table__
+        in_namespace = table.c.namespace == self.namespace
+        try:
+            with db.engine.begin() as conn:
+                total = conn.execute(
+                    db.select([func.coalesce(func.sum(table.c.size), 0)]).where(in_namespace)
+                ).scalar()
+                if total <= self.max_size:
+                    return
+                rows = conn.execute(
+                    db.select([table.c.key, table.c.size])
+                    .where(in_namespace)
+                    .order_by(table.c.accessed_at)
+                )
+                stale = []
+                for row in rows:
+                    if total <= self.max_size * 0.9:
+                        break
+                    stale.append(row.key)
+                    total -= row.size
+                rows.close()
+                if stale:
+                    conn.execute(table.delete().where(in_namespace & table.c.key.in_(stale)))
+        except Exception as err:
+            print("{namespace} cache eviction failed: {err}".format(namespace=self.namespace, err=err), file=sys.stderr)
+
+
+def make_http_cache(namespace, backend=HTTP_CACHE_BACKEND):
+    """
+    Return the HTTP cache for an upstream API, as configured by the
+    ``HTTP_CACHE_BACKEND`` environment variable: "file" (the default),
+    "database", or "memory" (not shared). If the directory for "file"
+    isn't private to us, the cache is kept in memory.
+    """
+    if backend == "file":
+        return file_cache(os.path.join(HTTP_CACHE_DIR, namespace), HTTP_CACHE_MAX_SIZE) or DictCache()
+    if backend == "database":
+        return DatabaseCache("http-" + namespace)
+    if backend == "memory":
+        return DictCache()
+    raise ValueError("Unknown HTTP_CACHE_BACKEND {backend!r}".format(backend=backend))
+
+
+def make_shared_cache(namespace, backend=SHARED_CACHE_BACKEND):
+    """
+    Return the cache that processes share values in, as configured by the
+    ``SHARED_CACHE_BACKEND`` environment variable: "database" (the default,
+    shared by every dyno), "file" (shared by the processes on one machine),
+    or "none". Returns None for "none", and for "file" if the directory
+    isn't private to us: then each process only has its in-memory cache.
+    """
+    if backend == "database":
+        return DatabaseCache("shared-" + namespace, max_size=SHARED_CACHE_MAX_SIZE)
+    if backend == "file":
+        return file_cache(os.path.join(SHARED_CACHE_DIR, namespace), SHARED_CACHE_MAX_SIZE)
+    if backend == "none":
+        return None
+    raise ValueError("Unknown SHARED_CACHE_BACKEND {backend!r}".format(backend=backend))
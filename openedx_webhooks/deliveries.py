@@ -0,0 +1,71 @@
+# coding=utf-8
+"""
+Github and JIRA sometimes deliver the same webhook more than once. We keep
+track of the deliveries we've received, so that we only process each one once.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import request
+from sqlalchemy.exc import IntegrityError
+from openedx_webhooks.models import db, WebhookDelivery
+
+
+# how long to remember deliveries
+DELIVERY_RETENTION = timedelta(days=int(os.environ.get("WEBHOOK_DELIVERY_RETENTION_DAYS", 7)))
+
+# the header that identifies a delivery, for each source
+DELIVERY_HEADERS = {
+    "github": "X-GitHub-Delivery",
+    "jira": "X-Atlassian-Webhook-Identifier",
+}
+
+
+def get_delivery_id(source):
+    """
+    Return the ID of the webhook delivery in the current request. If the
+    sender doesn't identify its deliveries, a hash of the request body is used.
+    """
+    delivery_id = request.headers.get(DELIVERY_HEADERS[source])
+    if delivery_id:
+        return delivery_id[:64]
+    return "sha1:" + hashlib.sha1(request.get_data()).hexdigest()
+
+
+def is_duplicate_delivery(source):
+    """
+    Return True if we've received the webhook delivery in the current
+    request before. Otherwise, add it to the session, so that it is
+    recorded when the session is committed -- for example, when a job is
+    queued for it.
+    """
+    delivery_id = get_delivery_id(source)
+    db.session.add(WebhookDelivery(source=source, delivery_id=delivery_id))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        print(
+            "Ignoring duplicate {source} delivery {id}".format(source=source, id=delivery_id),
+            file=sys.stderr,
+        )
+        return True
+    return False
+
+
+def duplicate_response(source):
+    return "Already received this delivery from {source}".format(source=source), 200
+
+
+def purge_deliveries():
+    """
+    Forget deliveries older than DELIVERY_RETENTION.
+    """
+    cutoff = datetime.utcnow() - DELIVERY_RETENTION
+    deleted = WebhookDelivery.query.filter(WebhookDelivery.received_at < cutoff).delete()
+    db.session.commit()
+    return deleted
@@ -0,0 +1,513 @@
+# coding=utf-8
+"""
+A small job queue, stored in the database.
+
+Webhook handlers only validate the incoming event, queue a job for it, and
+return right away, so that Github and JIRA get their response within their
+delivery timeouts. The slow part -- talking to Github and JIRA -- happens in
+a separate process, started with ``python manage.py worker``.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import random
+import functools
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import bugsnag
+import requests
+from flask import request, has_request_context, _app_ctx_stack
+from sqlalchemy import text
+from openedx_webhooks import app, metrics, profiling
+from openedx_webhooks.deliveries import purge_deliveries
+from openedx_webhooks.locks import keyed_lock
+from openedx_webhooks.models import db, Job, DeadJob
+from openedx_webhooks.tracing import traced, current_trace, purge_traces, BACKGROUND_ENVIRON_KEY
+from openedx_webhooks.upstream import deadline, CircuitOpen, JOB_DEADLINE
+from openedx_webhooks.utils import register_context_propagator, retry_budget
+
+
+# task name -> function
+TASKS = {}
+
+# jobs that fail because of a Github or JIRA error are retried this many
+# times in all, with growing delays in between; then they are dead
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 5))
+# the first delay before retrying a job, in seconds; it doubles each time
+JOB_RETRY_DELAY = float(os.environ.get("JOB_RETRY_DELAY", 60))
+JOB_MAX_RETRY_DELAY = float(os.environ.get("JOB_MAX_RETRY_DELAY", 60 * 60))
+# a job that has been running for longer than its deadline plus this many
+# seconds belongs to a worker that was killed (by a deploy, say), and is
+# queued again
+JOB_LEASE_GRACE = float(os.environ.get("JOB_LEASE_GRACE", 5 * 60))
+
+
+def task(func=None, key=None, pass_attempt=False):
+    """
+    Register a function so that it can be queued with :func:`enqueue`.
+    The function's arguments must be JSON-serializable.
+
+    ``key`` is an optional function that is called with the same arguments,
+    and returns a string: jobs with the same key are run one at a time, in
+    the order they were queued, and while holding :func:`keyed_lock` for
+    that key. Use it like this::
+
+        @task(key=lambda pr, **kwargs: pull_request_key(pr))
+        def pr_opened(pr, ...):
+
+    If ``pass_attempt`` is set, the function also gets an ``attempt``
+    keyword argument: 1 the first time the job runs, 2 for the first retry,
+    and so on.
+    """
+    if func is None:
+        return functools.partial(task, key=key, pass_attempt=pass_attempt)
+    func.job_key = key
+    func.pass_attempt = pass_attempt
+    TASKS[func.__name__] = func
+    return func
+
+
+def enqueue(func, *args, **kwargs):
+    """
+    Queue a call to the given task, and return the new :class:`Job`.
+    """
+    name = func.__name__
+    if TASKS.get(name) is not func:
+        raise ValueError("{name} is not a registered task".format(name=name))
+    job = Job(
+        task=name,
+        key=func.job_key(*args, **kwargs) if func.job_key else None,
+        payload={"args": args, "kwargs": kwargs},
+        base_url=request.url_root if has_request_context() else None,
+    )
+    trace = current_trace()
+    if trace is not None:
+        job.trace_id = trace.trace_id
+    if profiling.was_requested():
+        job.profile = True
+    db.session.add(job)
+    db.session.commit()
+    if trace is not None:
+        trace.attributes.setdefault("queued_jobs", []).append(job.id)
+    return job
+
+
+def accepted(job):
+    """
+    The response for a webhook handler that has queued a job.
+    """
+    return "Queued job {id}".format(id=job.id), 202
+
+
+@contextmanager
+def request_context(base_url=None):
+    """
+    Run code outside of a web request as if it were handling one, so that
+    ``url_for`` and the Flask-Dance ``github`` and ``jira`` sessions work.
+    The Flask-Dance sessions are attached in ``before_request`` handlers,
+    so we need to run those, too.
+    """
+    # we're not really behind a proxy, but this keeps SSLify from
+    # short-circuiting the ``before_request`` handlers with a redirect
+    headers = {"X-Forwarded-Proto": "https"}
+    environ = {BACKGROUND_ENVIRON_KEY: True}
+    with app.test_request_context(base_url=base_url, headers=headers, environ_base=environ):
+        app.preprocess_request()
+        yield
+
+
+# where the Flask-Dance ``github`` and ``jira`` proxies find their sessions
+OAUTH_SESSION_ATTRS = ("github_oauth", "jira_oauth")
+
+
+@contextmanager
+def thread_request_context(base_url, sessions):
+    """
+    A request context for a thread started by `pool_map` or `run_async`,
+    with the Flask-Dance sessions of the thread that started it.
+    """
+    environ = {BACKGROUND_ENVIRON_KEY: True}
+    with app.test_request_context(base_url=base_url, environ_base=environ):
+        for attr, session in sessions.items():
+            setattr(_app_ctx_stack.top, attr, session)
+        yield
+
+
+@register_context_propagator
+def capture_request_context():
+    """
+    Threads started while handling a request get a request context, too, so
+    that ``url_for`` and the ``github`` and ``jira`` sessions work. Unlike
+    `request_context`, this doesn't run the ``before_request`` handlers
+    again: they would load the OAuth tokens from the database once more, and
+    the sessions that they set up are shared by the whole process anyway.
+    """
+    if not has_request_context():
+        return None
+    base_url = request.url_root
+    app_ctx = _app_ctx_stack.top
+    sessions = {
+        attr: getattr(app_ctx, attr)
+        for attr in OAUTH_SESSION_ATTRS
+        if hasattr(app_ctx, attr)
+    }
+    return lambda: thread_request_context(base_url, sessions)
+
+
+CLAIM_JOB_SQL = """
+    UPDATE {table} SET status = 'running', started_at = :now, attempts = attempts + 1
+    WHERE id = (
+        SELECT id FROM {table} AS job
+        WHERE status = 'queued' AND run_at <= :now
+        AND (key IS NULL OR NOT EXISTS (
+            SELECT 1 FROM {table} AS earlier
+            WHERE earlier.key = job.key AND earlier.id < job.id
+            AND (earlier.status = 'queued' OR (
+                earlier.status = 'running' AND earlier.started_at >= :stale_before
+            ))
+        ))
+        ORDER BY run_at, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+""".format(table=Job.__tablename__)
+
+
+def lease_expired_before():
+    """
+    Jobs that started running before this time have outlived their lease.
+    """
+    return datetime.utcnow() - timedelta(seconds=JOB_DEADLINE + JOB_LEASE_GRACE)
+
+
+STALE_JOBS_SQL = """
+    UPDATE {table} SET status = :status, run_at = :now, error = :error
+    WHERE status = 'running' AND started_at < :stale_before
+    AND attempts {comparison} :max_attempts
+    RETURNING id, task
+""".format(table=Job.__tablename__, comparison="{comparison}")
+LOST_JOB_ERROR = "The worker running this job went away"
+
+
+def requeue_stale_jobs():
+    """
+    Queue again the jobs whose worker died while running them, or move them
+    to the dead jobs if that was their last attempt. Each UPDATE takes the
+    jobs away from other workers doing the same thing. Returns how many
+    jobs were found.
+    """
+    params = {
+        "now": datetime.utcnow(), "stale_before": lease_expired_before(),
+        "error": LOST_JOB_ERROR, "max_attempts": JOB_MAX_ATTEMPTS,
+    }
+    requeued = db.session.execute(
+        text(STALE_JOBS_SQL.format(comparison="<")), dict(params, status="queued"),
+    ).fetchall()
+    lost = db.session.execute(
+        text(STALE_JOBS_SQL.format(comparison=">=")), dict(params, status="lost"),
+    ).fetchall()
+    db.session.commit()
+    for job_id, task_name in requeued:
+        print("Job {id} ({task}) requeued: {error}".format(
+            id=job_id, task=task_name, error=LOST_JOB_ERROR,
+        ), file=sys.stderr)
+    for job_id, task_name in lost:
+        print("Job {id} ({task}) is dead: {error}".format(
+            id=job_id, task=task_name, error=LOST_JOB_ERROR,
+        ), file=sys.stderr)
+        kill_job(job_id, LOST_JOB_ERROR)
+        metrics.jobs.inc(task=task_name, outcome="dead")
+    return len(requeued) + len(lost)
+
+
+def claim_job():
+    """
+    Mark the oldest runnable job as running, and return its ID, or None if
+    there's nothing to do. ``SKIP LOCKED`` allows several workers to claim
+    jobs at the same time without waiting on each other. A job can't be
+    claimed while an earlier job with the same key is still waiting or
+    running, unless that one has outlived its lease.
+    """
+    result = db.session.execute(text(CLAIM_JOB_SQL), {
+        "now": datetime.utcnow(), "stale_before": lease_expired_before(),
+    })
+    row = result.first()
+    db.session.commit()
+    return row[0] if row else None
+
+
+def finish_job(job_id, **values):
+    values["finished_at"] = datetime.utcnow()
+    db.session.query(Job).filter_by(id=job_id).update(values)
+    db.session.commit()
+
+
+def requeue_job(job_id, delay, error, count_attempt=False):
+    """
+    Put a job back in the queue, to run again in ``delay`` seconds. Unless
+    ``count_attempt`` is set, the attempt that is being retried doesn't
+    count towards ``JOB_MAX_ATTEMPTS``. Later jobs with the same key wait
+    for this one.
+    """
+    values = {
+        "status": "queued",
+        "run_at": datetime.utcnow() + timedelta(seconds=delay),
+        "error": error,
+    }
+    if not count_attempt:
+        values["attempts"] = Job.attempts - 1
+    db.session.query(Job).filter_by(id=job_id).update(values)
+    db.session.commit()
+
+
+def retry_delay(attempts):
+    """
+    How long to wait before retrying a job that has failed ``attempts``
+    times, in seconds: somewhere between half and all of a delay that
+    doubles with every attempt.
+    """
+    delay = min(JOB_RETRY_DELAY * 2 ** (attempts - 1), JOB_MAX_RETRY_DELAY)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def kill_job(job_id, error):
+    """
+    Move a job that failed for good to the :class:`DeadJob` table.
+    """
+    job = Job.query.get(job_id)
+    db.session.add(DeadJob(
+        job_id=job.id, task=job.task, key=job.key, payload=job.payload,
+        base_url=job.base_url, trace_id=job.trace_id, attempts=job.attempts, error=error,
+        created_at=job.created_at,
+    ))
+    db.session.delete(job)
+    db.session.commit()
+
+
+def replay_dead_job(dead_job):
+    """
+    Queue a dead job again, and return the new :class:`Job`.
+    """
+    job = Job(
+        task=dead_job.task, key=dead_job.key, payload=dead_job.payload,
+        base_url=dead_job.base_url, trace_id=dead_job.trace_id,
+    )
+    db.session.add(job)
+    db.session.flush()
+    dead_job.replay_job_id = job.id
+    dead_job.replayed_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def profiled(call, job_id, task_name, attempt):
+    def profiled_call():
+        with profiling.profile_job(job_id, task_name, attempt):
+            return call()
+    return profiled_call
+
+
+def run_job(job_id):
+    """
+    Run the job with the given ID, and record the outcome.
+    """
+    job = Job.query.get(job_id)
+    task_name, key, payload, base_url = job.task, job.key, job.payload, job.base_url
+    trace_id = job.trace_id
+    attempts = job.attempts
+    profile = job.profile
+    db.session.commit()
+
+    bugsnag_context = {"job": {"id": job_id, "task": task_name, "payload": payload}}
+    func = TASKS.get(task_name)
+    if not func:
+        msg = "Unknown task {name}".format(name=task_name)
+        print("Job {id}: {msg}".format(id=job_id, msg=msg), file=sys.stderr)
+        kill_job(job_id, msg)
+        metrics.jobs.inc(task=task_name, outcome="dead")
+        return
+
+    start = time.time()
+    outcome = "done"
+    try:
+        with deadline(JOB_DEADLINE), retry_budget(), \
+                traced("job " + task_name, trace_id=trace_id, job_id=job_id, attempt=attempts), \
+                request_context(base_url):
+            bugsnag.configure_request(meta_data=bugsnag_context)
+            kwargs = dict(payload["kwargs"])
+            if func.pass_attempt:
+                kwargs["attempt"] = attempts
+            call = functools.partial(func, *payload["args"], **kwargs)
+            if profile:
+                call = profiled(call, job_id, task_name, attempts)
+            if key:
+                # also keeps out rescans working on the same thing
+                with keyed_lock(key):
+                    result = call()
+            else:
+                result = call()
+    except CircuitOpen as err:
+        # don't fail because of an upstream that is down, try again later
+        print(
+            "Job {id} ({task}) deferred: {err}".format(id=job_id, task=task_name, err=err),
+            file=sys.stderr,
+        )
+        outcome = "deferred"
+        requeue_job(job_id, err.retry_after, "{}".format(err))
+        return
+    except requests.exceptions.RequestException as err:
+        if attempts < JOB_MAX_ATTEMPTS:
+            outcome = "retried"
+            delay = retry_delay(attempts)
+            print(
+                "Job {id} ({task}) failed, retrying in {secs:.0f}s: {err}".format(
+                    id=job_id, task=task_name, secs=delay, err=err,
+                ),
+                file=sys.stderr,
+            )
+            requeue_job(job_id, delay, traceback.format_exc(), count_attempt=True)
+            return
+        outcome = "dead"
+        print(
+            "Job {id} ({task}) failed {num} times: {err}".format(
+                id=job_id, task=task_name, num=attempts, err=err,
+            ),
+            file=sys.stderr,
+        )
+        bugsnag.notify(err, meta_data=bugsnag_context)
+        kill_job(job_id, traceback.format_exc())
+        return
+    except Exception as err:
+        # a bug, most likely: trying again won't help
+        outcome = "dead"
+        print(
+            "Job {id} ({task}) failed: {err}".format(id=job_id, task=task_name, err=err),
+            file=sys.stderr,
+        )
+        bugsnag.notify(err, meta_data=bugsnag_context)
+        kill_job(job_id, traceback.format_exc())
+        return
+    finally:
+        metrics.jobs.inc(task=task_name, outcome=outcome)
+        metrics.job_duration.observe(time.time() - start, task=task_name)
+
+    print(
+        "Job {id} ({task}) finished in {secs:.2f}s: {result}".format(
+            id=job_id, task=task_name, secs=time.time() - start, result=result,
+        ),
+        file=sys.stderr,
+    )
+    finish_job(job_id, status="done", result="{}".format(result))
+
+
+def work_loop(poll_interval=1, burst=False):
+    with app.app_context():
+        while True:
+            try:
+                job_id = claim_job()
+            except Exception as err:
+                db.session.rollback()
+                print("Couldn't claim a job: {err}".format(err=err), file=sys.stderr)
+                time.sleep(poll_interval)
+                continue
+            if job_id is None:
+                if burst:
+                    return
+                time.sleep(poll_interval)
+                continue
+            try:
+                run_job(job_id)
+            except Exception as err:
+                # most likely the database, while recording the outcome; the
+                # job is picked up again when its lease runs out
+                db.session.rollback()
+                print(
+                    "Job {id}: couldn't run it or record the outcome: {err}".format(id=job_id, err=err),
+                    file=sys.stderr,
+                )
+                bugsnag.notify(err, meta_data={"job": {"id": job_id}})
+                time.sleep(poll_interval)
+
+
+def work(concurrency=1, poll_interval=1, burst=False):
+    """
+    Process queued jobs in ``concurrency`` threads, until interrupted.
+    If ``burst`` is set, return once the queue is empty instead.
+    """
+    # before the threads start, so that a burst doesn't miss lost jobs
+    recover_stale_jobs()
+    requeued_at = time.time()
+    threads = [
+        threading.Thread(
+            target=work_loop, args=(poll_interval, burst),
+            name="worker-{num}".format(num=num),
+        )
+        for num in range(concurrency)
+    ]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    print("Started {num} worker threads".format(num=concurrency), file=sys.stderr)
+    cleaned_up_at = 0
+    # join with a timeout, so that KeyboardInterrupt still gets through
+    while any(thread.is_alive() for thread in threads):
+        if time.time() - cleaned_up_at > CLEANUP_INTERVAL:
+            cleanup()
+            cleaned_up_at = time.time()
+        if time.time() - requeued_at > STALE_JOBS_INTERVAL:
+            recover_stale_jobs()
+            requeued_at = time.time()
+        with app.app_context():
+            metrics.flush()
+        for thread in threads:
+            thread.join(1)
+
+
+# how often the worker cleans up old data, in seconds
+CLEANUP_INTERVAL = 60 * 60
+# how often the worker looks for jobs that have outlived their lease, in
+# seconds; they can't turn up more often than leases run out
+STALE_JOBS_INTERVAL = JOB_LEASE_GRACE
+
+
+def recover_stale_jobs():
+    with app.app_context():
+        try:
+            requeue_stale_jobs()
+        except Exception as err:
+            db.session.rollback()
+            print("Couldn't requeue stale jobs: {err}".format(err=err), file=sys.stderr)
+
+
+def cleanup():
+    with app.app_context():
+        try:
+            deleted = purge_deliveries()
+        except Exception as err:
+            db.session.rollback()
+            print("Couldn't purge old deliveries: {err}".format(err=err), file=sys.stderr)
+        else:
+            if deleted:
+                print("Purged {num} old deliveries".format(num=deleted), file=sys.stderr)
+        try:
+            deleted = purge_traces()
+        except Exception as err:
+            db.session.rollback()
+            print("Couldn't purge old traces: {err}".format(err=err), file=sys.stderr)
+        else:
+            if deleted:
+                print("Purged {num} old traces".format(num=deleted), file=sys.stderr)
+        try:
+            deleted = metrics.purge_snapshots()
+        except Exception as err:
+            db.session.rollback()
+            print("Couldn't purge old metrics: {err}".format(err=err), file=sys.stderr)
+        else:
+            if deleted:
+                print("Purged metrics of {num} old processes".format(num=deleted), file=sys.stderr)
@@ -0,0 +1,106 @@
+# coding=utf-8
+"""
+Locks that make sure that only one process at a time works on a given pull
+request or JIRA issue, while unrelated events are processed in parallel.
+"""
+from __future__ import unicode_literals, print_function
+
+import sys
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from openedx_webhooks.models import db
+
+
+def pull_request_key(pull_request):
+    return "github-pr:{repo}#{num}".format(
+        repo=pull_request["base"]["repo"]["full_name"].decode('utf-8'),
+        num=pull_request["number"],
+    )
+
+
+def jira_issue_key(issue):
+    return "jira-issue:{key}".format(key=issue["key"].decode('utf-8'))
+
+
+def advisory_lock_id(key):
+    """
+    Postgres advisory locks are identified by a 64-bit integer.
+    """
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return struct.unpack(b"!q", digest[:8])[0]
+
+
+def release_advisory_lock(conn, lock_id):
+    """
+    Release a Postgres advisory lock, or if that fails, throw the connection
+    away: closing it is the only other way to release the lock, and putting
+    it back in the pool would leave the lock held by whoever gets it next.
+    """
+    try:
+        conn.execute(text("SELECT pg_advisory_unlock(:id)"), id=lock_id)
+    except Exception as err:
+        print(
+            "Couldn't release lock {id}, dropping its connection: {err}".format(id=lock_id, err=err),
+            file=sys.stderr,
+        )
+        conn.invalidate()
+
+
+# keys locked by the current thread
+_held = threading.local()
+# for databases without advisory locks: locks for this process only
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+
+
+@contextmanager
+def keyed_lock(key):
+    """
+    Wait until no other thread or process holds the lock for ``key``, and
+    hold it while the block runs. On Postgres, this is an advisory lock, so
+    it works across processes and machines; on other databases, it only
+    works within this process.
+
+    The lock is reentrant: a thread that already holds it can take it again.
+
+    The Postgres lock is held by a connection of its own, so while the block
+    runs, the thread uses two connections from the pool: see
+    ``DATABASE_POOL_SIZE``.
+    """
+    held = getattr(_held, "keys", None)
+    if held is None:
+        held = _held.keys = set()
+    if key in held:
+        yield
+        return
+
+    held.add(key)
+    try:
+        if db.engine.dialect.name == "postgresql":
+            lock_id = advisory_lock_id(key)
+            conn = db.engine.connect()
+            try:
+                try:
+                    conn.execute(text("SELECT pg_advisory_lock(:id)"), id=lock_id)
+                except Exception:
+                    # we can't tell whether we got the lock, so nobody else
+                    # should get this connection
+                    conn.invalidate()
+                    raise
+                try:
+                    yield
+                finally:
+                    release_advisory_lock(conn, lock_id)
+            finally:
+                conn.close()
+        else:
+            with _local_locks_lock:
+                lock = _local_locks.setdefault(key, threading.Lock())
+            with lock:
+                yield
+    finally:
+        held.discard(key)
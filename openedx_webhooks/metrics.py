@@ -0,0 +1,386 @@
+# coding=utf-8
+"""
+Counters and latency histograms, exposed at ``/metrics`` in the Prometheus
+text format.
+
+Each process keeps its own metrics, and every few seconds saves a snapshot
+of them where the other processes can see it: in the database (the default,
+so that the worker dyno's metrics are included too), or in a directory
+(``METRICS_BACKEND=file``). ``/metrics`` adds up the snapshots of every
+process.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from flask import g, request
+from openedx_webhooks.models import db, MetricsSnapshot
+from openedx_webhooks.tracing import is_background_request
+
+
+METRICS_BACKEND = os.environ.get("METRICS_BACKEND", "database")
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR",
+    os.path.join(tempfile.gettempdir(), "openedx_webhooks", "metrics"),
+)
+# how often each process saves its metrics, in seconds
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+# snapshots from processes that haven't saved one for this long are deleted
+METRICS_RETENTION = timedelta(days=int(os.environ.get("METRICS_RETENTION_DAYS", 7)))
+
+# latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> metric
+registry = {}
+# functions that return extra samples, see `register_collector`
+collectors = []
+_lock = threading.Lock()
+
+
+class Counter(object):
+    """
+    A number that only goes up, for each combination of label values.
+    """
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # tuple of label values -> count
+        self.values = {}
+        registry[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = tuple("{}".format(labels.get(label, "")) for label in self.labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+
+class Histogram(object):
+    """
+    Counts of observations (like durations) in ``buckets``, and their sum,
+    for each combination of label values.
+    """
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # tuple of label values -> [count per bucket..., count, sum]
+        self.values = {}
+        registry[name] = self
+
+    def observe(self, value, **labels):
+        key = tuple("{}".format(labels.get(label, "")) for label in self.labels)
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        return [[list(key), list(counts)] for key, counts in self.values.items()]
+
+    @staticmethod
+    def merge(total, counts):
+        if total is None:
+            return list(counts)
+        return [a + b for a, b in zip(total, counts)]
+
+
+def register_collector(collect):
+    """
+    Register a function that returns samples of counters that are kept
+    somewhere else, like the cache statistics. It returns a list of
+    ``(name, help, labels dict, value)``.
+    """
+    collectors.append(collect)
+    return collect
+
+
+def snapshot():
+    """
+    This process's metrics, as something that can be saved as JSON.
+    """
+    with _lock:
+        result = {
+            name: {
+                "type": metric.type,
+                "help": metric.help,
+                "labels": list(metric.labels),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "values": metric.snapshot(),
+            }
+            for name, metric in registry.items()
+        }
+    for collect in collectors:
+        try:
+            samples = collect()
+        except Exception as err:
+            print("Couldn't collect metrics from {func}: {err}".format(func=collect, err=err), file=sys.stderr)
+            continue
+        for name, help, labels, value in samples:
+            names = sorted(labels)
+            metric = result.setdefault(name, {
+                "type": "counter", "help": help, "labels": names, "buckets": [], "values": [],
+            })
+            metric["values"].append([[labels[label] for label in names], value])
+    return result
+
+
+def process_name():
+    return "{host}-{pid}".format(host=socket.gethostname(), pid=os.getpid())
+
+
+_flushed_at = [0]
+
+
+def flush(force=False):
+    """
+    Save this process's metrics, if they haven't been saved in the last
+    ``METRICS_FLUSH_INTERVAL`` seconds. The database backend needs an app
+    context.
+    """
+    now = time.time()
+    with _lock:
+        if not force and now - _flushed_at[0] < METRICS_FLUSH_INTERVAL:
+            return
+        _flushed_at[0] = now
+    data = json.dumps(snapshot())
+    try:
+        if METRICS_BACKEND == "file":
+            save_file(data)
+        else:
+            save_row(data)
+    except Exception as err:
+        print("Couldn't save metrics: {err}".format(err=err), file=sys.stderr)
+
+
+def save_file(data):
+    if not os.path.isdir(METRICS_DIR):
+        try:
+            os.makedirs(METRICS_DIR)
+        except OSError:
+            # another process made it first
+            if not os.path.isdir(METRICS_DIR):
+                raise
+    # write to a temporary file and rename it, so other processes never
+    # see a half-written snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=METRICS_DIR, prefix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(data)
+    os.rename(tmp_path, os.path.join(METRICS_DIR, process_name() + ".json"))
+
+
+def save_row(data):
+    table = MetricsSnapshot.__table__
+    where = table.c.process == process_name()
+    values = {"data": data, "updated_at": datetime.utcnow()}
+    with db.engine.begin() as conn:
+        updated = conn.execute(table.update().where(where).values(**values))
+        if not updated.rowcount:
+            conn.execute(table.insert().values(process=process_name(), **values))
+
+
+def load_snapshots():
+    """
+    The saved snapshots of every process.
+    """
+    if METRICS_BACKEND == "file":
+        snapshots = []
+        if not os.path.isdir(METRICS_DIR):
+            return snapshots
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, filename)) as f:
+                    snapshots.append(json.load(f))
+            except (IOError, OSError, ValueError):
+                continue
+        return snapshots
+    table = MetricsSnapshot.__table__
+    with db.engine.begin() as conn:
+        return [json.loads(row.data) for row in conn.execute(db.select([table.c.data]))]
+
+
+def purge_snapshots():
+    """
+    Delete snapshots of processes that are long gone. Returns how many were
+    deleted.
+    """
+    cutoff = datetime.utcnow() - METRICS_RETENTION
+    if METRICS_BACKEND == "file":
+        deleted = 0
+        if not os.path.isdir(METRICS_DIR):
+            return deleted
+        for filename in os.listdir(METRICS_DIR):
+            path = os.path.join(METRICS_DIR, filename)
+            try:
+                if datetime.utcfromtimestamp(os.path.getmtime(path)) < cutoff:
+                    os.remove(path)
+                    deleted += 1
+            except OSError:
+                continue
+        return deleted
+    deleted = MetricsSnapshot.query.filter(MetricsSnapshot.updated_at < cutoff).delete()
+    db.session.commit()
+    return deleted
+
+
+def start_request_timer():
+    """
+    A ``before_request`` handler. The request contexts that jobs run in
+    aren't web requests, so they aren't counted.
+    """
+    g.metrics_started_at = None if is_background_request() else time.time()
+
+
+def record_request(response):
+    """
+    An ``after_request`` handler that records the request.
+    """
+    observe_request(response.status_code)
+    return response
+
+
+def record_failed_request(exc=None):
+    """
+    A ``teardown_request`` handler that records requests that raised an
+    exception, which don't get to the ``after_request`` handlers.
+    """
+    if exc is not None:
+        observe_request(500)
+
+
+def observe_request(status):
+    started_at = getattr(g, "metrics_started_at", None)
+    if started_at is None:
+        return
+    g.metrics_started_at = None
+    endpoint = request.url_rule.rule if request.url_rule else "unknown"
+    http_requests.inc(endpoint=endpoint, method=request.method, status=status)
+    http_request_duration.observe(time.time() - started_at, endpoint=endpoint, method=request.method)
+    flush()
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{name}="{value}"'.format(
+            name=name,
+            value="{}".format(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    ) + "}"
+
+
+def format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else "{}".format(value)
+
+
+def exposition(snapshots):
+    """
+    Add up the snapshots, and format them in the Prometheus text format.
+    """
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            total = merged.setdefault(name, dict(metric, values={}))
+            merge = Histogram.merge if metric["type"] == "histogram" else Counter.merge
+            for labels, value in metric["values"]:
+                key = tuple(labels)
+                total["values"][key] = merge(total["values"].get(key), value)
+
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        lines.append("# HELP {name} {help}".format(name=name, help=metric["help"]))
+        lines.append("# TYPE {name} {type}".format(name=name, type=metric["type"]))
+        for key in sorted(metric["values"]):
+            value = metric["values"][key]
+            if metric["type"] != "histogram":
+                lines.append("{name}{labels} {value}".format(
+                    name=name, labels=format_labels(metric["labels"], key), value=format_number(value),
+                ))
+                continue
+            bounds = list(metric["buckets"]) + [float("inf")]
+            bucket_counts = value[:-2] + [value[-2]]
+            for bound, bucket_count in zip(bounds, bucket_counts):
+                lines.append("{name}_bucket{labels} {value}".format(
+                    name=name, value=bucket_count,
+                    labels=format_labels(metric["labels"], key, [("le", format_number(bound))]),
+                ))
+            labels = format_labels(metric["labels"], key)
+            lines.append("{name}_sum{labels} {value}".format(name=name, labels=labels, value=format_number(value[-1])))
+            lines.append("{name}_count{labels} {value}".format(name=name, labels=labels, value=value[-2]))
+    return "\n".join(lines) + "\n"
+
+
+## METRICS ##
+
+http_requests = Counter(
+    "webhooks_http_requests_total", "Requests handled, by view and status code.",
+    labels=("endpoint", "method", "status"),
+)
+http_request_duration = Histogram(
+    "webhooks_http_request_duration_seconds", "How long requests took to handle, by view.",
+    labels=("endpoint", "method"),
+)
+upstream_requests = Counter(
+    "webhooks_upstream_requests_total",
+    "Requests to Github and JIRA, by URL template and status code. "
+    "Status is \"error\" if there was no response.",
+    labels=("upstream", "method", "endpoint", "status"),
+)
+upstream_request_duration = Histogram(
+    "webhooks_upstream_request_duration_seconds",
+    "How long requests to Github and JIRA took, by URL template.",
+    labels=("upstream", "method", "endpoint"),
+)
+upstream_cache = Counter(
+    "webhooks_upstream_cache_total",
+    "Requests to Github and JIRA answered by the HTTP cache (\"hit\"), by the "
+    "cache after a 304 (\"revalidated\"), or not (\"miss\").",
+    labels=("upstream", "endpoint", "result"),
+)
+upstream_events = Counter(
+    "webhooks_upstream_events_total",
+    "Timeouts, missed deadlines and circuit breaker events, by upstream.",
+    labels=("upstream", "event"),
+)
+retries = Counter("webhooks_retries_total", "Requests that were retried after a failure.")
+jobs = Counter(
+    "webhooks_jobs_total", "Jobs run by the worker, by task and outcome.",
+    labels=("task", "outcome"),
+)
+job_duration = Histogram(
+    "webhooks_job_duration_seconds", "How long jobs took to run, by task.",
+    labels=("task",), buckets=DEFAULT_BUCKETS + (120, 300, 600),
+)
@@ -1,9 +1,244 @@
 # coding=utf-8
 from __future__ import unicode_literals
+from datetime import datetime
 from flask.ext.sqlalchemy import SQLAlchemy
 from flask_dance.models import OAuthConsumerMixin
+from sqlalchemy_utils import JSONType
 
 db = SQLAlchemy()
 
 class OAuth(db.Model, OAuthConsumerMixin):
     pass
+
+
+class Job(db.Model):
+    """
+    A piece of work queued by a webhook handler, to be run later by
+    ``manage.py worker``.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(128), nullable=False)
+    # jobs with the same key are run one at a time, in the order they were queued
+    key = db.Column(db.String(256), index=True)
+    # {"args": [...], "kwargs": {...}}
+    payload = db.Column(JSONType, nullable=False)
+    # the URL root of the request that queued this job, so that ``url_for``
+    # builds the same URLs in the worker as it would have in the web process
+    base_url = db.Column(db.String(256))
+    # the trace of the webhook that queued this job, see
+    # :mod:`openedx_webhooks.tracing`
+    trace_id = db.Column(db.String(32))
+    # run the job under cProfile, because the webhook that queued it asked
+    # to be profiled, see :mod:`openedx_webhooks.profiling`
+    profile = db.Column(db.Boolean, nullable=False, default=False)
+    # queued, running, or done; "lost" while a job whose worker went away
+    # is moved to the dead jobs
+    status = db.Column(db.String(16), nullable=False, default="queued")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index("ix_job_status_run_at", "status", "run_at"),
+    )
+
+    def __repr__(self):
+        return "<Job {id} {task} ({status})>".format(
+            id=self.id, task=self.task, status=self.status,
+        )
+
+
+class PullRequestIssue(db.Model):
+    """
+    The JIRA issue that tracks a pull request, so that we don't have to
+    search the pull request's comments to find it.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    repo = db.Column(db.String(256), nullable=False)
+    number = db.Column(db.Integer, nullable=False)
+    issue_key = db.Column(db.String(32), nullable=False)
+    # whether the bot's comment and the "needs triage" label have been added
+    # to the pull request, so that a retried ``pr_opened`` can finish the job
+    commented = db.Column(db.Boolean, nullable=False, default=True)
+    labeled = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint("repo", "number"),
+    )
+
+    def __repr__(self):
+        return "<PullRequestIssue {repo}#{num} {key}>".format(
+            repo=self.repo, num=self.number, key=self.issue_key,
+        )
+
+
+class RescanWatermark(db.Model):
+    """
+    How far a rescan has gotten: everything updated before ``updated_at``
+    has already been looked at, so the next rescan can skip it. ``source``
+    is "github" or "jira", and ``key`` is the repo or the JQL query.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(16), nullable=False)
+    key = db.Column(db.String(1024), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint("source", "key"),
+    )
+
+    @classmethod
+    def get(cls, source, key):
+        """
+        Return the watermark for this rescan, or None if it has never run.
+        """
+        watermark = cls.query.filter_by(source=source, key=key).first()
+        return watermark.updated_at if watermark else None
+
+    @classmethod
+    def set(cls, source, key, updated_at):
+        watermark = cls.query.filter_by(source=source, key=key).first()
+        if watermark:
+            watermark.updated_at = updated_at
+        else:
+            db.session.add(cls(source=source, key=key, updated_at=updated_at))
+        db.session.commit()
+
+    @classmethod
+    def clear(cls, source):
+        """
+        Forget the watermarks of every ``source`` rescan, so that they all
+        look at everything next time.
+        """
+        cls.query.filter_by(source=source).delete()
+        db.session.commit()
+
+    def __repr__(self):
+        return "<RescanWatermark {source} {key} {updated_at}>".format(
+            source=self.source, key=self.key, updated_at=self.updated_at,
+        )
+
+
+class RateLimit(db.Model):
+    """
+    The last rate limit status that any process got from an API, so that
+    all processes can budget their requests together.
+    """
+    name = db.Column(db.String(32), primary_key=True)
+    limit = db.Column(db.Integer, nullable=False)
+    remaining = db.Column(db.Integer, nullable=False)
+    # when the limit resets, in seconds since the epoch
+    reset = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return "<RateLimit {name} {remaining}/{limit}>".format(
+            name=self.name, remaining=self.remaining, limit=self.limit,
+        )
+
+
+class CacheEntry(db.Model):
+    """
+    An entry in a cache that is shared by every process, see
+    :class:`openedx_webhooks.cache.DatabaseCache`.
+    """
+    namespace = db.Column(db.String(64), primary_key=True)
+    # SHA-1 of the real key, which can be too long to index
+    key = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    accessed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_cache_entry_namespace_accessed_at", "namespace", "accessed_at"),
+    )
+
+    def __repr__(self):
+        return "<CacheEntry {namespace} {key}>".format(
+            namespace=self.namespace, key=self.key,
+        )
+
+
+class WebhookDelivery(db.Model):
+    """
+    A webhook delivery that we've already received, so that we can ignore
+    it if it is delivered again.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(16), nullable=False)
+    delivery_id = db.Column(db.String(64), nullable=False)
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        db.UniqueConstraint("source", "delivery_id"),
+    )
+
+    def __repr__(self):
+        return "<WebhookDelivery {source} {delivery_id}>".format(
+            source=self.source, delivery_id=self.delivery_id,
+        )
+
+
+class DeadJob(db.Model):
+    """
+    A job that failed for good: it raised an error that isn't worth retrying,
+    or it failed ``JOB_MAX_ATTEMPTS`` times. It can be replayed from
+    ``/jobs/dead``.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    # the ID the job had in the queue
+    job_id = db.Column(db.Integer, nullable=False)
+    task = db.Column(db.String(128), nullable=False)
+    key = db.Column(db.String(256))
+    payload = db.Column(JSONType, nullable=False)
+    base_url = db.Column(db.String(256))
+    trace_id = db.Column(db.String(32))
+    attempts = db.Column(db.Integer, nullable=False)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False)
+    failed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    # the job that replays this one, if it has been replayed
+    replay_job_id = db.Column(db.Integer)
+    replayed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return "<DeadJob {id} {task} (job {job_id})>".format(
+            id=self.id, task=self.task, job_id=self.job_id,
+        )
+
+
+class MetricsSnapshot(db.Model):
+    """
+    The metrics of one process, so that ``/metrics`` can add up the metrics
+    of all of them. See :mod:`openedx_webhooks.metrics`.
+    """
+    # hostname and process ID
+    process = db.Column(db.String(128), primary_key=True)
+    # JSON
+    data = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return "<MetricsSnapshot {process}>".format(process=self.process)
+
+
+class TraceRecord(db.Model):
+    """
+    A finished trace of a web request or a job, with the calls it made to
+    Github and JIRA. A webhook and the job it queued share a ``trace_id``.
+    See :mod:`openedx_webhooks.tracing`.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    trace_id = db.Column(db.String(32), nullable=False, index=True)
+    name = db.Column(db.String(256), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+    duration = db.Column(db.Float, nullable=False)
+    # JSON: the trace, with its spans
+    data = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return "<TraceRecord {trace_id} {name}>".format(trace_id=self.trace_id, name=self.name)
@@ -8,8 +8,11 @@ from flask import request, flash
 from flask_dance.contrib.github import make_github_blueprint
 from flask_dance.contrib.jira import make_jira_blueprint
 from flask_dance.consumer import oauth_authorized
-from cachecontrol import CacheControlAdapter
 from .models import db, OAuth
+from .cache import make_http_cache
+from .ratelimit import RateLimitedAdapter, github_rate_limit
+from .upstream import CachingUpstreamAdapter, UpstreamAdapter
+from .utils import backoff
 
 
 # Check for required environment variables
@@ -37,6 +40,13 @@ jira_bp = make_jira_blueprint(
 jira_bp.set_token_storage_sqlalchemy(OAuth, db.session)
 
 
+# install CacheControl for the JIRA session too, and JIRA's timeouts
+jira_bp.session.mount(
+    jira_bp.session.base_url,
+    CachingUpstreamAdapter(upstream="jira", cache=make_http_cache("jira")),
+)
+
+
 @oauth_authorized.connect_via(jira_bp)
 def jira_logged_in(blueprint, token):
     if token:
@@ -69,8 +79,15 @@ def github_logged_in(blueprint, token):
         flash("Successfully signed in with Github")
 
 
-# install CacheControl for github session, so we don't eat up API usage unnecessarily
-github_bp.session.mount(github_bp.session.base_url, CacheControlAdapter())
+# install CacheControl for github session, so we don't eat up API usage unnecessarily,
+# and keep track of how much API usage we have left
+# The cache is shared by all the processes on this machine, see HTTP_CACHE_BACKEND.
+github_bp.session.mount(
+    github_bp.session.base_url,
+    RateLimitedAdapter(github_rate_limit, cache=make_http_cache("github")),
+)
+# files in repos, like AUTHORS, are fetched from another host
+github_bp.session.mount("https://raw.githubusercontent.com/", UpstreamAdapter("github-raw"))
 
 
 ## UTILITY FUNCTIONS ##
@@ -78,10 +95,11 @@ github_bp.session.mount(github_bp.session.base_url, CacheControlAdapter())
 def jira_get(*args, **kwargs):
     """
     JIRA sometimes returns an empty response to a perfectly valid GET request,
-    so this will retry it a few times if that happens.
+    so this will retry it a few times if that happens, backing off in between.
     """
-    for _ in range(3):
+    resp = jira_bp.session.get(*args, **kwargs)
+    for attempt in range(3):
+        if resp.content or not backoff(attempt):
+            break
         resp = jira_bp.session.get(*args, **kwargs)
-        if resp.content:
-            return resp
-    return jira_bp.session.get(*args, **kwargs)
+    return resp
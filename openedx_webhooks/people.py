@@ -0,0 +1,124 @@
+# coding=utf-8
+"""
+Who is who, according to people.yaml.
+"""
+from __future__ import unicode_literals
+
+from collections import namedtuple
+from datetime import date
+
+from iso8601 import parse_date
+from openedx_webhooks.remote_files import people_file
+
+
+# Arbisoft doesn't do any Open edX work that is not paid for by edX,
+# so we can just treat them as "internal" rather than as a contractor.
+# This may change in the future.
+INTERNAL_INSTITUTIONS = frozenset(("edX", "Arbisoft"))
+# organizations that do paid contracting work for edX
+CONTRACTOR_INSTITUTIONS = frozenset(("BNOTIONS", "OpenCraft", "ExtensionEngine"))
+
+INTERNAL = "internal"
+CONTRACTOR = "contractor"
+COMMUNITY = "community"
+
+
+Person = namedtuple("Person", "name institution expires_on category")
+
+
+class PeopleIndex(object):
+    """
+    The contents of people.yaml, indexed by Github username. Everything that
+    doesn't depend on the date is worked out up front, so that looking someone
+    up is a single dict lookup.
+
+    Usernames must match exactly, except when checking for a contributor
+    agreement, or whether someone is listed at all, which ignore case, as the
+    community comment and the contributors check always have.
+    """
+    def __init__(self, people):
+        self.people = {}
+        for login, values in people.items():
+            institution = values.get("institution")
+            if institution in INTERNAL_INSTITUTIONS:
+                category = INTERNAL
+            elif institution in CONTRACTOR_INSTITUTIONS:
+                category = CONTRACTOR
+            else:
+                category = COMMUNITY
+            self.people[login] = Person(
+                name=values.get("name", ""),
+                institution=institution,
+                expires_on=values.get("expires_on", date.max),
+                category=category,
+            )
+        self.lowered = {login.lower(): person for login, person in self.people.items()}
+
+    def __contains__(self, login):
+        return login in self.people
+
+    def lists(self, login):
+        """
+        Is this Github username in people.yaml at all? The username's case
+        doesn't matter.
+        """
+        return login.lower() in self.lowered
+
+    def get(self, login):
+        """
+        Return the :class:`Person` with this Github username, or None.
+        """
+        return self.people.get(login)
+
+    def has_agreement(self, login, on_date):
+        """
+        Did this person have a valid contributor agreement on this date?
+        The username's case doesn't matter.
+        """
+        person = self.lowered.get(login.lower())
+        return bool(person) and person.expires_on > on_date
+
+    def classify(self, login, on_date):
+        """
+        Was this person working for edX (INTERNAL), for a company that does
+        contract work for edX (CONTRACTOR), or neither (COMMUNITY) on this
+        date?
+        """
+        person = self.people.get(login)
+        if person and person.expires_on > on_date:
+            return person.category
+        return COMMUNITY
+
+
+# the parsed people.yaml that the index was built from, and the index
+_people_index = (None, None)
+
+
+def get_people_index():
+    """
+    Return a :class:`PeopleIndex` for the current people.yaml. The index is
+    only rebuilt when people.yaml changes.
+    """
+    global _people_index
+    people = people_file.get()
+    indexed_people, index = _people_index
+    if people is not indexed_people:
+        index = PeopleIndex(people)
+        _people_index = (people, index)
+    return index
+
+
+def pull_request_date(pull_request):
+    """
+    The date that this pull request was created.
+    """
+    return parse_date(pull_request["created_at"]).replace(tzinfo=None).date()
+
+
+def classify_pull_request(pull_request):
+    """
+    Classify the author of this pull request when they created it:
+    INTERNAL, CONTRACTOR, or COMMUNITY.
+    """
+    author = pull_request["user"]["login"].decode('utf-8')
+    return get_people_index().classify(author, pull_request_date(pull_request))
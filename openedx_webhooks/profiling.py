@@ -0,0 +1,312 @@
+# coding=utf-8
+"""
+Opt-in profiling of single web requests with cProfile.
+
+Profiling is off unless ``PROFILING_TOKEN`` is set. Then a request is
+profiled if it carries the token in an ``X-Profile-Token`` header or a
+``profile_token`` query parameter, or if it is picked at random, with
+probability ``PROFILING_SAMPLE_RATE`` (0 by default). To keep this safe in
+production, each process profiles one request at a time, and at most
+``PROFILING_MAX_PER_MINUTE`` a minute; other requests just run normally.
+
+Each profile is saved in ``PROFILING_DIR`` as a pstats file, with a JSON
+file next to it that records the route, the status code, and the wall
+clock and CPU time the request took: if the CPU time is much lower, the
+request was mostly waiting for Github or JIRA. Only the newest
+``PROFILING_MAX_FILES`` profiles are kept. ``/debug/profiles`` lists and
+serves them.
+
+Webhooks only queue a job for the real work, so the jobs queued by a request
+that asked to be profiled are profiled too, by the worker: see
+:func:`profile_job`.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import random
+import cProfile
+import tempfile
+import binascii
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import request, abort, has_request_context
+from openedx_webhooks.tracing import is_background_request, current_trace
+
+
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN")
+PROFILING_DIR = os.environ.get(
+    "PROFILING_DIR",
+    os.path.join(tempfile.gettempdir(), "openedx_webhooks", "profiles"),
+)
+# the fraction of requests to profile without being asked to
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+PROFILING_MAX_PER_MINUTE = int(os.environ.get("PROFILING_MAX_PER_MINUTE", 6))
+PROFILING_MAX_FILES = int(os.environ.get("PROFILING_MAX_FILES", 100))
+
+# names of saved profiles, so that they can be served safely
+PROFILE_NAME_RE = re.compile(r"^[\w.-]+\.prof$")
+
+# only one profile at a time: cProfile only sees the thread it was enabled
+# in, and a second profiler would slow the process down even more
+_slot = threading.Semaphore(1)
+# when the profiles of the last minute were started
+_started = deque()
+_lock = threading.Lock()
+_profile = threading.local()
+
+
+def enabled():
+    return bool(PROFILING_TOKEN)
+
+
+def has_token():
+    """
+    Whether the current request carries the profiling token.
+    """
+    if not PROFILING_TOKEN:
+        return False
+    given = request.headers.get("X-Profile-Token") or request.args.get("profile_token")
+    if not given:
+        return False
+    # compare in constant time, so the token can't be guessed bit by bit
+    return hmac.compare_digest(given.encode("utf-8"), PROFILING_TOKEN.encode("utf-8"))
+
+
+def check_token():
+    """
+    For the views that serve profiles: they aren't there at all without
+    ``PROFILING_TOKEN``, and need the token.
+    """
+    if not enabled():
+        abort(404)
+    if not has_token():
+        abort(403)
+
+
+def take_slot():
+    """
+    Reserve the right to profile a request, if no other request is being
+    profiled and ``PROFILING_MAX_PER_MINUTE`` hasn't been reached. If this
+    returns True, the caller must call ``_slot.release()`` when done.
+    """
+    if not _slot.acquire(False):
+        return False
+    now = time.time()
+    with _lock:
+        while _started and _started[0] < now - 60:
+            _started.popleft()
+        if len(_started) >= PROFILING_MAX_PER_MINUTE:
+            _slot.release()
+            return False
+        _started.append(now)
+    return True
+
+
+def was_requested():
+    """
+    Whether the current web request asked to be profiled.
+    """
+    if not has_request_context() or is_background_request():
+        return False
+    return getattr(_profile, "requested", False)
+
+
+def cpu_time():
+    # for the whole process: Python 2 can't tell us about one thread
+    times = os.times()
+    return times[0] + times[1]
+
+
+def start_profile():
+    """
+    A ``before_request`` handler that starts profiling the request, if it
+    asked for it or was sampled.
+    """
+    _profile.current = None
+    _profile.requested = False
+    if not enabled() or is_background_request():
+        return
+    if request.path.startswith("/debug/profiles"):
+        return
+    _profile.requested = has_token()
+    if not _profile.requested and random.random() >= PROFILING_SAMPLE_RATE:
+        return
+    if not take_slot():
+        return
+    profiler = cProfile.Profile()
+    _profile.current = {
+        "profiler": profiler,
+        "started_at": time.time(),
+        "cpu": cpu_time(),
+    }
+    profiler.enable()
+
+
+def stop_profile(status):
+    """
+    Stop the profiler, if the request is being profiled, and save the
+    profile. Returns the name of the saved profile.
+    """
+    current = getattr(_profile, "current", None)
+    if current is None:
+        return None
+    _profile.current = None
+    try:
+        current["profiler"].disable()
+        wall = time.time() - current["started_at"]
+        cpu = cpu_time() - current["cpu"]
+        return save_profile(current["profiler"], {
+            "method": request.method,
+            "route": request.url_rule.rule if request.url_rule else request.path,
+            "path": request.path,
+            "status": status,
+            "requested": _profile.requested,
+            "trace_id": current_trace().trace_id if current_trace() else None,
+            "created_at": datetime.utcnow().isoformat(),
+            "wall_time": wall,
+            "cpu_time": cpu,
+        })
+    except Exception as err:
+        print("Couldn't save profile: {err}".format(err=err), file=sys.stderr)
+        return None
+    finally:
+        _slot.release()
+
+
+def tag_response(response):
+    """
+    An ``after_request`` handler that saves the profile, and tells the
+    client its name. A request that asked to be profiled but wasn't, because
+    another request was, gets "skipped".
+    """
+    name = stop_profile(response.status_code)
+    if name:
+        response.headers["X-Profile"] = name
+    elif getattr(_profile, "requested", False):
+        response.headers["X-Profile"] = "skipped"
+    return response
+
+
+def end_profile(exc=None):
+    """
+    A ``teardown_request`` handler, for requests that raised an exception
+    before getting to the ``after_request`` handlers.
+    """
+    if exc is not None:
+        stop_profile(500)
+
+
+@contextmanager
+def profile_job(job_id, task_name, attempt):
+    """
+    Run a job under cProfile, and save the profile like that of a request.
+    The same limits apply, so a job may not get profiled.
+    """
+    if not take_slot():
+        print("Not profiling job {id}: another profile is running".format(id=job_id), file=sys.stderr)
+        yield
+        return
+    profiler = cProfile.Profile()
+    started_at = time.time()
+    cpu = cpu_time()
+    status = "done"
+    profiler.enable()
+    try:
+        yield
+    except Exception as err:
+        status = err.__class__.__name__
+        raise
+    finally:
+        profiler.disable()
+        try:
+            save_profile(profiler, {
+                "method": "JOB",
+                "route": task_name,
+                "path": "job {id}".format(id=job_id),
+                "job_id": job_id,
+                "attempt": attempt,
+                "status": status,
+                "requested": True,
+                "trace_id": current_trace().trace_id if current_trace() else None,
+                "created_at": datetime.utcnow().isoformat(),
+                "wall_time": time.time() - started_at,
+                # for the whole worker process, so other jobs count too
+                "cpu_time": cpu_time() - cpu,
+            })
+        except Exception as err:
+            print("Couldn't save profile: {err}".format(err=err), file=sys.stderr)
+        finally:
+            _slot.release()
+
+
+def profile_path(name):
+    return os.path.join(PROFILING_DIR, name)
+
+
+def save_profile(profiler, info):
+    if not os.path.isdir(PROFILING_DIR):
+        try:
+            os.makedirs(PROFILING_DIR)
+        except OSError:
+            # another process made it first
+            if not os.path.isdir(PROFILING_DIR):
+                raise
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", info["route"]).strip("_") or "root"
+    name = "{time}-{method}-{slug}-{rand}.prof".format(
+        time=datetime.utcnow().strftime("%Y%m%dT%H%M%S"), method=info["method"],
+        slug=slug[:64], rand=binascii.hexlify(os.urandom(3)).decode("ascii"),
+    )
+    profiler.dump_stats(profile_path(name))
+    with open(profile_path(name) + ".json", "w") as f:
+        json.dump(dict(info, name=name), f)
+    prune_profiles()
+    print(
+        "Profiled {method} {path} in {wall:.3f}s ({cpu:.3f}s CPU): {name}".format(
+            name=name, method=info["method"], path=info["path"],
+            wall=info["wall_time"], cpu=info["cpu_time"],
+        ),
+        file=sys.stderr,
+    )
+    return name
+
+
+def list_profiles():
+    """
+    The saved profiles' information, newest first.
+    """
+    if not os.path.isdir(PROFILING_DIR):
+        return []
+    profiles = []
+    for filename in sorted(os.listdir(PROFILING_DIR), reverse=True):
+        if not PROFILE_NAME_RE.match(filename):
+            continue
+        try:
+            with open(profile_path(filename) + ".json") as f:
+                profiles.append(json.load(f))
+        except (IOError, OSError, ValueError):
+            profiles.append({"name": filename})
+    return profiles
+
+
+def prune_profiles():
+    """
+    Delete all but the newest ``PROFILING_MAX_FILES`` profiles.
+    """
+    names = sorted(
+        (filename for filename in os.listdir(PROFILING_DIR) if PROFILE_NAME_RE.match(filename)),
+        reverse=True,
+    )
+    for name in names[PROFILING_MAX_FILES:]:
+        for path in (profile_path(name), profile_path(name) + ".json"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
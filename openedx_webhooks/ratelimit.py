@@ -0,0 +1,210 @@
+# coding=utf-8
+"""
+Keep track of Github's API rate limit, so that big background jobs like
+rescans don't use up the requests that live webhooks need.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+
+import requests
+from openedx_webhooks.models import db, RateLimit
+from openedx_webhooks.upstream import CachingUpstreamAdapter, time_left
+from openedx_webhooks.utils import register_context_propagator
+
+
+class RateLimitExceeded(requests.exceptions.RequestException):
+    pass
+
+
+class RateLimitBudget(object):
+    """
+    The rate limit status of an API, updated from the ``X-RateLimit-*``
+    headers of every response, and shared with other processes through
+    the database.
+
+    Requests made with :func:`background_priority` may only use the
+    part of the budget above ``reserve`` (a fraction of the limit): the
+    rest is kept for live webhooks. Once less than ``spread`` of the
+    background share is left, background requests are spread out over the
+    rest of the rate limit window, and once it is gone they pause until the
+    window resets.
+    """
+    def __init__(self, name, reserve=0.2, spread=0.25, max_pause=900, sync_interval=5):
+        self.name = name
+        self.reserve = reserve
+        self.spread = spread
+        self.max_pause = max_pause
+        # how often to share our status with other processes, in seconds
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.synced_at = 0
+        self.paused = 0.0
+
+    def update(self, limit, remaining, reset):
+        """
+        Take a rate limit status into account. Within one rate limit window,
+        the lowest ``remaining`` is the most recent one.
+        """
+        with self.lock:
+            if self.reset is None or reset > self.reset:
+                self.limit, self.remaining, self.reset = limit, remaining, reset
+            elif reset == self.reset:
+                self.limit = limit
+                self.remaining = min(self.remaining, remaining)
+
+    def record(self, response):
+        """
+        Update the rate limit status from a response.
+        """
+        try:
+            limit = int(response.headers["X-RateLimit-Limit"])
+            remaining = int(response.headers["X-RateLimit-Remaining"])
+            reset = int(response.headers["X-RateLimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        self.update(limit, remaining, reset)
+        self.sync()
+
+    def sync(self, force=False):
+        """
+        Merge our rate limit status with the one in the database.
+        """
+        if not force and time.time() - self.synced_at < self.sync_interval:
+            return
+        self.synced_at = time.time()
+        table = RateLimit.__table__
+        try:
+            with db.engine.begin() as conn:
+                row = conn.execute(table.select().where(table.c.name == self.name)).first()
+                if row:
+                    self.update(row.limit, row.remaining, row.reset)
+                if self.remaining is None:
+                    return
+                values = {"limit": self.limit, "remaining": self.remaining, "reset": self.reset}
+                if row:
+                    conn.execute(table.update().where(table.c.name == self.name).values(**values))
+                else:
+                    conn.execute(table.insert().values(name=self.name, **values))
+        except Exception as err:
+            # outside of an app context, or the database is unavailable:
+            # we can still budget this process's requests on our own
+            print(
+                "Couldn't share {name} rate limit status: {err}".format(name=self.name, err=err),
+                file=sys.stderr,
+            )
+
+    def throttle(self):
+        """
+        Called before making a background request. Waits if the background
+        share of the budget is running low, or raises
+        :class:`RateLimitExceeded` if that would take more than ``max_pause``
+        seconds, or run past the deadline.
+        """
+        self.sync()
+        with self.lock:
+            limit, remaining, reset = self.limit, self.remaining, self.reset
+        now = time.time()
+        if remaining is None or reset <= now:
+            return
+        reserved = self.reserve * limit
+        # what's left of the background share
+        available = remaining - reserved
+        until_reset = reset - now
+        if available <= 0:
+            delay = until_reset + 1
+        elif available >= self.spread * (limit - reserved):
+            return
+        else:
+            # spread the rest of the background share over the window
+            delay = until_reset / available
+        left = time_left()
+        if delay > self.max_pause or (left is not None and delay > left):
+            raise RateLimitExceeded(
+                "{name} rate limit: {remaining}/{limit} requests left, "
+                "resets in {secs:.0f}s".format(
+                    name=self.name, remaining=remaining, limit=limit, secs=until_reset,
+                )
+            )
+        if delay > 1:
+            print(
+                "{name} rate limit: {remaining}/{limit} requests left, "
+                "pausing background work for {secs:.0f}s".format(
+                    name=self.name, remaining=remaining, limit=limit, secs=delay,
+                ),
+                file=sys.stderr,
+            )
+        self.paused += delay
+        time.sleep(delay)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "reset": self.reset,
+            "paused": self.paused,
+        }
+
+
+_priority = threading.local()
+
+
+def is_background():
+    return getattr(_priority, "background", False)
+
+
+@contextmanager
+def background_priority():
+    """
+    Requests made in this block are background work, and are subject to
+    :meth:`RateLimitBudget.throttle`.
+    """
+    previous = is_background()
+    _priority.background = True
+    try:
+        yield
+    finally:
+        _priority.background = previous
+
+
+@register_context_propagator
+def capture_priority():
+    if is_background():
+        return background_priority
+    return None
+
+
+class RateLimitedAdapter(CachingUpstreamAdapter):
+    """
+    A CacheControl adapter that keeps a :class:`RateLimitBudget` up to date,
+    and throttles background requests. Responses from the HTTP cache don't
+    use up the rate limit, so they aren't throttled.
+    """
+    def __init__(self, budget, *args, **kwargs):
+        kwargs.setdefault("upstream", budget.name)
+        super(RateLimitedAdapter, self).__init__(*args, **kwargs)
+        self.budget = budget
+
+    def before_send(self, request):
+        if is_background():
+            self.budget.throttle()
+
+    def send(self, request, **kwargs):
+        resp = super(RateLimitedAdapter, self).send(request, **kwargs)
+        if not getattr(resp, "from_cache", False):
+            self.budget.record(resp)
+        return resp
+
+
+github_rate_limit = RateLimitBudget(
+    "github",
+    reserve=float(os.environ.get("GITHUB_RATE_LIMIT_RESERVE", 0.2)),
+    max_pause=int(os.environ.get("GITHUB_RATE_LIMIT_MAX_PAUSE", 900)),
+)
@@ -0,0 +1,310 @@
+# coding=utf-8
+"""
+Configuration files that live in other repos, like people.yaml and repos.yaml.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import bugsnag
+import requests
+import yaml
+try:
+    # libyaml is much faster than the pure-Python loader, if it's installed
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+from openedx_webhooks.cache import make_shared_cache, private_directory, is_ours
+from openedx_webhooks.upstream import upstream_session
+from openedx_webhooks.utils import cached, propagate_context, truthy
+
+
+# how long to use a file before checking if it has changed, in seconds
+CONFIG_FILE_TTL = int(os.environ.get("CONFIG_FILE_TTL", 300))
+CONFIG_FILE_STALE_WHILE_REVALIDATE = truthy(
+    os.environ.get("CONFIG_FILE_STALE_WHILE_REVALIDATE", "true")
+)
+# how long to keep using the old copy after failing to fetch a file, before
+# trying again, in seconds
+CONFIG_FILE_RETRY_DELAY = int(os.environ.get("CONFIG_FILE_RETRY_DELAY", 60))
+# where to keep parsed copies of the files, so we don't have to parse them
+# again; only used if it belongs to us, and nobody else can write to it
+CONFIG_SNAPSHOT_DIR = os.environ.get(
+    "CONFIG_SNAPSHOT_DIR",
+    os.path.join(tempfile.gettempdir(), "openedx_webhooks", "snapshots"),
+)
+
+
+def text_digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def load_snapshot(path):
+    """
+    Load a snapshot, or return None if there isn't one. Files that someone
+    else managed to put there are ignored.
+    """
+    try:
+        snapshot = open(path, "rb")
+    except IOError:
+        return None
+    with snapshot:
+        if not is_ours(snapshot):
+            print("Ignoring snapshot {path}: not ours".format(path=path), file=sys.stderr)
+            return None
+        return pickle.load(snapshot)
+
+
+@cached(maxsize=4, key=lambda text, name="yaml": (name, text_digest(text)))
+def load_yaml(text, name="yaml"):
+    """
+    Parse YAML text. Parsing a big file like people.yaml takes a while, so
+    the result is also saved in a pickled snapshot in CONFIG_SNAPSHOT_DIR,
+    named after a hash of the text. If a snapshot for this exact text
+    exists already, it is loaded instead of parsing the text again. If the
+    directory isn't private to us, snapshots aren't used at all.
+
+    The last few results are also kept in memory, so a file that is fetched
+    again without having changed comes back as the very same object.
+    Callers must not modify it.
+    """
+    start = time.time()
+    digest = text_digest(text)
+    prefix = "{name}-".format(name=name)
+    path = os.path.join(CONFIG_SNAPSHOT_DIR, prefix + digest + ".pickle")
+    try:
+        use_snapshots = private_directory(CONFIG_SNAPSHOT_DIR)
+    except (IOError, OSError) as err:
+        print("Can't use {dir} for snapshots: {err}".format(dir=CONFIG_SNAPSHOT_DIR, err=err), file=sys.stderr)
+        use_snapshots = False
+    else:
+        if not use_snapshots:
+            print(
+                "Not using {dir} for snapshots: it isn't private to us".format(dir=CONFIG_SNAPSHOT_DIR),
+                file=sys.stderr,
+            )
+    value = None
+    if use_snapshots:
+        try:
+            value = load_snapshot(path)
+        except Exception:
+            # unreadable: just parse it
+            pass
+    if value is not None:
+        print(
+            "Loaded {name} snapshot in {secs:.3f}s".format(name=name, secs=time.time() - start),
+            file=sys.stderr,
+        )
+        return value
+
+    value = yaml.load(text, Loader=SafeLoader)
+    print(
+        "Parsed {name} with {loader} in {secs:.3f}s".format(
+            name=name, loader=SafeLoader.__name__, secs=time.time() - start,
+        ),
+        file=sys.stderr,
+    )
+    if not use_snapshots:
+        return value
+    try:
+        save_snapshot(value, path, prefix)
+    except (IOError, OSError) as err:
+        print("Couldn't save snapshot {path}: {err}".format(path=path, err=err), file=sys.stderr)
+    return value
+
+
+def save_snapshot(value, path, prefix):
+    directory = os.path.dirname(path)
+    # write to a temporary file and rename it, so other processes never
+    # see a half-written snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as snapshot:
+        pickle.dump(value, snapshot, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp_path, path)
+    # snapshots of older versions of this file aren't needed anymore
+    for filename in os.listdir(directory):
+        old_path = os.path.join(directory, filename)
+        if filename.startswith(prefix) and old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+# with timeouts, see `openedx_webhooks.upstream`
+session = upstream_session("github-raw")
+
+
+class RemoteYAMLFile(object):
+    """
+    A YAML file that is fetched over HTTP.
+
+    The parsed contents are kept for ``ttl`` seconds. After that, the file
+    is fetched again with an ``If-None-Match`` header, so that if it hasn't
+    changed, the server answers "304 Not Modified" and we don't need to
+    parse it again.
+
+    If ``stale_while_revalidate`` is set, expired contents are returned
+    right away while the file is fetched again in a background thread,
+    rather than making the caller wait for it.
+
+    If there is a ``shared`` cache, the text of the file is kept there, so
+    that a process that needs the file can use the copy another process
+    fetched less than ``ttl`` seconds ago instead of fetching it again.
+
+    If fetching the file fails, the old copy is used for another
+    ``retry_delay`` seconds before trying again.
+    """
+    def __init__(self, url, ttl=CONFIG_FILE_TTL,
+                 stale_while_revalidate=CONFIG_FILE_STALE_WHILE_REVALIDATE,
+                 shared=None, retry_delay=CONFIG_FILE_RETRY_DELAY):
+        self.url = url
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self.stale_while_revalidate = stale_while_revalidate
+        self.shared = shared
+        self.value = None
+        self.text = None
+        self.etag = None
+        self.fetched_at = None
+        # when fetching the file last failed, if it hasn't worked since
+        self.failed_at = None
+        # held while the file is being fetched
+        self.lock = threading.Lock()
+
+    def is_fresh(self):
+        if self.fetched_at is None:
+            return False
+        if time.time() - self.fetched_at < self.ttl:
+            return True
+        # don't try again right after failing
+        return self.failed_at is not None and time.time() - self.failed_at < self.retry_delay
+
+    def get(self):
+        """
+        Return the parsed contents of the file.
+        """
+        if self.is_fresh():
+            return self.value
+        if self.fetched_at is not None and self.stale_while_revalidate:
+            self.refresh_in_background()
+            return self.value
+        with self.lock:
+            # someone else might have refreshed it while we were waiting
+            if not self.is_fresh():
+                try:
+                    self.refresh()
+                except requests.exceptions.RequestException as err:
+                    self.failed_at = time.time()
+                    if self.fetched_at is None:
+                        raise
+                    print(
+                        "Couldn't refresh {url}, using old copy: {err}".format(
+                            url=self.url, err=err,
+                        ),
+                        file=sys.stderr,
+                    )
+        return self.value
+
+    def refresh(self):
+        """
+        Fetch the file again, if it has changed. The caller must hold ``lock``.
+        """
+        if self.refresh_from_shared():
+            return
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        resp = session.get(self.url, headers=headers)
+        if resp.status_code == 304:
+            self.fetched_at = time.time()
+            self.failed_at = None
+            self.share()
+            return
+        if not resp.ok:
+            raise requests.exceptions.RequestException(resp.text)
+        self.value = self.parse(resp.text)
+        self.text = resp.text
+        self.etag = resp.headers.get("ETag")
+        self.fetched_at = time.time()
+        self.failed_at = None
+        self.share()
+
+    def refresh_from_shared(self):
+        """
+        Use the copy in the shared cache, if another process fetched it
+        recently enough. Returns True if it did.
+        """
+        if self.shared is None:
+            return False
+        data = self.shared.get(self.url)
+        if data is None:
+            return False
+        try:
+            text, etag, fetched_at = json.loads(data.decode("utf-8"))
+        except Exception:
+            return False
+        if time.time() - fetched_at >= self.ttl:
+            return False
+        if text != self.text:
+            self.value = self.parse(text)
+            self.text = text
+        self.etag = etag
+        self.fetched_at = fetched_at
+        self.failed_at = None
+        return True
+
+    def share(self):
+        if self.shared is None:
+            return
+        data = json.dumps([self.text, self.etag, self.fetched_at]).encode("utf-8")
+        self.shared.set(self.url, data)
+
+    def refresh_in_background(self):
+        if not self.lock.acquire(False):
+            # already being refreshed
+            return
+
+        # the shared cache might need the request context
+        refresh_file = propagate_context(self.refresh)
+
+        def refresh():
+            try:
+                refresh_file()
+            except Exception as err:
+                self.failed_at = time.time()
+                print(
+                    "Couldn't refresh {url}: {err}".format(url=self.url, err=err),
+                    file=sys.stderr,
+                )
+                bugsnag.notify(err, meta_data={"url": self.url})
+            finally:
+                self.lock.release()
+
+        thread = threading.Thread(target=refresh, name="refresh " + self.url)
+        thread.daemon = True
+        thread.start()
+
+    def parse(self, text):
+        return load_yaml(text, name=self.url.rsplit("/", 1)[-1])
+
+
+people_file = RemoteYAMLFile(
+    "https://raw.githubusercontent.com/edx/repo-tools/master/people.yaml",
+    shared=make_shared_cache("config-files"),
+)
+repos_file = RemoteYAMLFile(
+    "https://raw.githubusercontent.com/edx/repo-tools/master/repos.yaml",
+    shared=make_shared_cache("config-files"),
+)
@@ -0,0 +1,352 @@
+# coding=utf-8
+"""
+Lightweight tracing of the calls we make to Github and JIRA.
+
+Every web request, and every job the worker runs, gets a trace, and every
+request made through :class:`~openedx_webhooks.upstream.UpstreamAdapter`
+while it runs is recorded as a span: method, URL template, duration, sizes,
+status and cache status. A job gets the trace ID of the webhook that queued
+it, so ``/debug/traces/<trace_id>`` shows both.
+
+Finished traces are kept in a ring buffer in each process, and also saved in
+the database (``TRACE_BACKEND=database``, the default) so that the traces of
+the worker can be seen from the web dynos. They can be exported as
+OpenTelemetry (OTLP) JSON.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import json
+import time
+import binascii
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import request, has_request_context
+from openedx_webhooks.models import db, TraceRecord
+
+
+TRACE_BACKEND = os.environ.get("TRACE_BACKEND", "database")
+# how many finished traces each process keeps in memory
+TRACE_BUFFER_SIZE = int(os.environ.get("TRACE_BUFFER_SIZE", 200))
+# the most spans to keep in one trace, so that a rescan doesn't use up memory
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", 500))
+# saved traces are deleted after this long
+TRACE_RETENTION = timedelta(days=int(os.environ.get("TRACE_RETENTION_DAYS", 2)))
+
+# set in the WSGI environ of the request contexts that jobs, the warm-up and
+# management commands run in, see `openedx_webhooks.jobs.request_context`
+BACKGROUND_ENVIRON_KEY = "openedx_webhooks.background"
+
+# the most recently finished traces of this process
+recent_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+
+_trace = threading.local()
+
+
+def new_id(num_bytes):
+    return binascii.hexlify(os.urandom(num_bytes)).decode("ascii")
+
+
+def is_background_request():
+    """
+    Whether the current request context was made to run background work,
+    rather than for a real web request.
+    """
+    return has_request_context() and bool(request.environ.get(BACKGROUND_ENVIRON_KEY))
+
+
+class Trace(object):
+    """
+    The spans recorded while handling one web request or running one job.
+    ``kind`` is "server" for a web request, and "internal" for a job.
+    """
+    def __init__(self, name, trace_id=None, kind="internal", attributes=None):
+        self.trace_id = trace_id or new_id(16)
+        self.span_id = new_id(8)
+        self.name = name
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.started_at = time.time()
+        self.duration = None
+        self.error = None
+        self.spans = []
+        self.dropped_spans = 0
+        self.lock = threading.Lock()
+
+    def add_span(self, span):
+        with self.lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped_spans += 1
+                return
+            self.spans.append(span)
+
+    def finish(self, error=None):
+        self.duration = time.time() - self.started_at
+        if error is not None:
+            self.error = "{}".format(error) or error.__class__.__name__
+
+    def worth_saving(self):
+        """
+        Traces without spans are only kept if they queued a job, so that
+        ``/metrics`` and the like don't push out the interesting ones.
+        """
+        return bool(self.spans or self.attributes.get("queued_jobs"))
+
+    def to_json(self):
+        with self.lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "error": self.error,
+            "dropped_spans": self.dropped_spans,
+            "spans": spans,
+        }
+
+
+def current_trace():
+    return getattr(_trace, "current", None)
+
+
+def current_trace_id():
+    trace = current_trace()
+    return trace.trace_id if trace else None
+
+
+@contextmanager
+def traced(name, trace_id=None, kind="internal", **attributes):
+    """
+    Record a trace of the calls made in this block. ``trace_id`` continues
+    an earlier trace, like that of the webhook that queued a job.
+    """
+    previous = current_trace()
+    trace = _trace.current = Trace(name, trace_id=trace_id, kind=kind, attributes=attributes)
+    try:
+        yield trace
+    except Exception as err:
+        trace.finish(error=err)
+        raise
+    else:
+        trace.finish()
+    finally:
+        _trace.current = previous
+        save_trace(trace)
+
+
+@contextmanager
+def restore_trace(trace):
+    previous = current_trace()
+    _trace.current = trace
+    try:
+        yield
+    finally:
+        _trace.current = previous
+
+
+def capture_trace():
+    """
+    Threads started by `pool_map` and `run_async` add their spans to the
+    trace of the thread that started them. Registered as a context
+    propagator in :mod:`openedx_webhooks.upstream`.
+    """
+    trace = current_trace()
+    if trace is None:
+        return None
+    return lambda: restore_trace(trace)
+
+
+def record_span(name, start, duration, kind="client", error=None, **attributes):
+    """
+    Add a span to the current trace, if there is one, and return it. The
+    span is a dict, so the caller can add attributes to it afterwards.
+    """
+    trace = current_trace()
+    if trace is None:
+        return None
+    span = {
+        "span_id": new_id(8),
+        "name": name,
+        "kind": kind,
+        "started_at": start,
+        "duration": duration,
+        "error": error,
+        "attributes": {
+            key: value for key, value in attributes.items() if value is not None
+        },
+    }
+    trace.add_span(span)
+    return span
+
+
+def start_request_trace():
+    """
+    A ``before_request`` handler that starts a trace for the request. The
+    request contexts that jobs run in keep the job's trace.
+    """
+    _trace.request_trace = None
+    if is_background_request() or current_trace() is not None:
+        return
+    rule = request.url_rule.rule if request.url_rule else request.path
+    attributes = {
+        "http.request.method": request.method,
+        "http.route": rule,
+    }
+    # Github's ID for the webhook delivery, to match it up with Github's logs
+    delivery = request.headers.get("X-GitHub-Delivery")
+    if delivery:
+        attributes["github.delivery"] = delivery
+    trace = Trace(
+        "{method} {rule}".format(method=request.method, rule=rule),
+        kind="server", attributes=attributes,
+    )
+    _trace.current = _trace.request_trace = trace
+
+
+def tag_response(response):
+    """
+    An ``after_request`` handler that records the status code, and tells
+    the client the trace ID.
+    """
+    trace = getattr(_trace, "request_trace", None)
+    if trace is not None:
+        trace.attributes["http.response.status_code"] = response.status_code
+        response.headers["X-Trace-Id"] = trace.trace_id
+    return response
+
+
+def end_request_trace(exc=None):
+    trace = getattr(_trace, "request_trace", None)
+    if trace is None:
+        return
+    _trace.current = _trace.request_trace = None
+    trace.finish(error=exc)
+    save_trace(trace)
+
+
+def save_trace(trace):
+    if not trace.worth_saving():
+        return
+    data = trace.to_json()
+    recent_traces.append(data)
+    if TRACE_BACKEND != "database":
+        return
+    table = TraceRecord.__table__
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.insert().values(
+                trace_id=trace.trace_id,
+                name=trace.name[:256],
+                started_at=datetime.utcfromtimestamp(trace.started_at),
+                duration=trace.duration,
+                data=json.dumps(data),
+            ))
+    except Exception as err:
+        print("Couldn't save trace {id}: {err}".format(id=trace.trace_id, err=err), file=sys.stderr)
+
+
+def load_traces(trace_id=None, limit=50):
+    """
+    The most recent traces, or those with the given trace ID, most recent
+    first.
+    """
+    if TRACE_BACKEND != "database":
+        traces = [t for t in reversed(recent_traces) if trace_id in (None, t["trace_id"])]
+        return traces[:limit]
+    query = TraceRecord.query
+    if trace_id:
+        query = query.filter_by(trace_id=trace_id)
+    records = query.order_by(TraceRecord.started_at.desc()).limit(limit)
+    return [json.loads(record.data) for record in records]
+
+
+def purge_traces():
+    """
+    Delete saved traces older than ``TRACE_RETENTION``. Returns how many
+    were deleted.
+    """
+    if TRACE_BACKEND != "database":
+        return 0
+    cutoff = datetime.utcnow() - TRACE_RETENTION
+    deleted = TraceRecord.query.filter(TraceRecord.started_at < cutoff).delete()
+    db.session.commit()
+    return deleted
+
+
+## OpenTelemetry export ##
+
+# https://github.com/open-telemetry/opentelemetry-proto/blob/main/opentelemetry/proto/trace/v1/trace.proto
+OTEL_SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+OTEL_STATUS_OK = 1
+OTEL_STATUS_ERROR = 2
+
+
+def otel_attributes(attributes):
+    result = []
+    for key in sorted(attributes):
+        value = attributes[key]
+        if isinstance(value, bool):
+            otel_value = {"boolValue": value}
+        elif isinstance(value, (int, long)):
+            otel_value = {"intValue": "{}".format(value)}
+        elif isinstance(value, float):
+            otel_value = {"doubleValue": value}
+        elif isinstance(value, (list, tuple)):
+            otel_value = {"arrayValue": {"values": [
+                item["value"] for item in otel_attributes(dict(enumerate(value)))
+            ]}}
+        else:
+            otel_value = {"stringValue": "{}".format(value)}
+        result.append({"key": "{}".format(key), "value": otel_value})
+    return result
+
+
+def otel_span(trace_id, span, parent_span_id=None):
+    start = int(span["started_at"] * 1e9)
+    otel = {
+        "traceId": trace_id,
+        "spanId": span["span_id"],
+        "name": span["name"],
+        "kind": OTEL_SPAN_KINDS.get(span["kind"], 1),
+        "startTimeUnixNano": "{}".format(start),
+        "endTimeUnixNano": "{}".format(start + int((span["duration"] or 0) * 1e9)),
+        "attributes": otel_attributes(span["attributes"]),
+        "status": (
+            {"code": OTEL_STATUS_ERROR, "message": span["error"]}
+            if span["error"] else {"code": OTEL_STATUS_OK}
+        ),
+    }
+    if parent_span_id:
+        otel["parentSpanId"] = parent_span_id
+    return otel
+
+
+def otel_json(traces):
+    """
+    Traces (as from `load_traces`) in the OTLP JSON format, which
+    OpenTelemetry collectors accept at ``/v1/traces``.
+    """
+    spans = []
+    for trace in traces:
+        spans.append(otel_span(trace["trace_id"], trace))
+        for span in trace["spans"]:
+            spans.append(otel_span(trace["trace_id"], span, parent_span_id=trace["span_id"]))
+    return {
+        "resourceSpans": [{
+            "resource": {
+                "attributes": otel_attributes({"service.name": "openedx-webhooks"}),
+            },
+            "scopeSpans": [{
+                "scope": {"name": __name__},
+                "spans": spans,
+            }],
+        }],
+    }
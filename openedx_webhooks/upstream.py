@@ -0,0 +1,480 @@
+# coding=utf-8
+"""
+Rules for all of our requests to other services ("upstreams"), like Github
+and JIRA, applied by the requests adapters that the sessions use.
+
+Every request has a connect timeout and a read timeout for its upstream, and
+no request may run past the deadline of the work it is done for: a web
+request gets ``REQUEST_DEADLINE`` seconds, and a job gets ``JOB_DEADLINE``
+seconds. A request that would run past its deadline fails with
+:class:`DeadlineExceeded`, so that one hung connection can't hold a worker
+forever.
+
+Each upstream also has a :class:`CircuitBreaker`: while an upstream keeps
+failing, requests to it fail right away with :class:`CircuitOpen`, rather
+than adding to its load and tying up our workers.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import re
+import sys
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+from cachecontrol import CacheControlAdapter
+from urlobject import URLObject
+from openedx_webhooks import metrics
+from openedx_webhooks.tracing import record_span, capture_trace, is_background_request
+from openedx_webhooks.utils import (
+    register_context_propagator, get_retry_budget, set_retry_budget, RETRY_BUDGET,
+)
+
+
+def upstream_timeouts(name, connect, read):
+    """
+    The (connect, read) timeouts for an upstream, in seconds. They can be
+    set with environment variables like ``JIRA_CONNECT_TIMEOUT`` and
+    ``JIRA_READ_TIMEOUT``.
+    """
+    prefix = name.upper().replace("-", "_")
+    return (
+        float(os.environ.get(prefix + "_CONNECT_TIMEOUT", connect)),
+        float(os.environ.get(prefix + "_READ_TIMEOUT", read)),
+    )
+
+
+# upstream name -> (connect timeout, read timeout)
+TIMEOUTS = {
+    "github": upstream_timeouts("github", 3.05, 15),
+    # raw files from Github, like people.yaml and AUTHORS files
+    "github-raw": upstream_timeouts("github-raw", 3.05, 30),
+    "jira": upstream_timeouts("jira", 3.05, 30),
+    "default": upstream_timeouts("upstream", 3.05, 30),
+}
+# how long a web request may spend waiting for upstreams, in seconds; 0 for no limit
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 25))
+# how long a queued job may run, in seconds; 0 for no limit
+JOB_DEADLINE = float(os.environ.get("JOB_DEADLINE", 600))
+# how many failures in a row open an upstream's circuit breaker
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+# how long an open circuit breaker stays open, in seconds
+CIRCUIT_RECOVERY_TIME = float(os.environ.get("CIRCUIT_RECOVERY_TIME", 30))
+
+
+class DeadlineExceeded(requests.exceptions.RequestException):
+    pass
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """
+    An upstream's circuit breaker is open, so the request wasn't made. It's
+    worth trying again in ``retry_after`` seconds.
+    """
+    def __init__(self, upstream, retry_after):
+        super(CircuitOpen, self).__init__(
+            "{upstream} is failing, not calling it for {secs:.0f}s".format(
+                upstream=upstream, secs=retry_after,
+            )
+        )
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+# upstream name -> counter name -> count, in this process
+counters = defaultdict(lambda: defaultdict(int))
+_counters_lock = threading.Lock()
+
+
+def count(upstream, counter):
+    with _counters_lock:
+        counters[upstream][counter] += 1
+    metrics.upstream_events.inc(upstream=upstream, event=counter)
+
+
+# (pattern, replacement) for the parts of URL paths that name a particular
+# thing, so that metrics can be grouped by the kind of request
+URL_TEMPLATES = [
+    (re.compile(r"^/repos/[^/]+/[^/]+"), "/repos/{owner}/{repo}"),
+    (re.compile(r"^/users/[^/]+"), "/users/{user}"),
+    (re.compile(r"/[A-Z][A-Z0-9]+-\d+(?=/|$)"), "/{key}"),
+    # but not the API version in JIRA's /rest/api/2/
+    (re.compile(r"(?<!/api)/\d+(?=/|$)"), "/{num}"),
+]
+# raw.githubusercontent.com/{owner}/{repo}/{ref}/{path}
+RAW_URL_TEMPLATE = (re.compile(r"^/[^/]+/[^/]+/[^/]+/"), "/{owner}/{repo}/{ref}/")
+
+
+def url_template(url):
+    """
+    The path of a URL, with the names of particular repos, issues, etc.
+    replaced by placeholders, like ``/repos/{owner}/{repo}/issues/{num}``.
+    """
+    url = URLObject(url)
+    path = url.path
+    templates = [RAW_URL_TEMPLATE] if url.hostname == "raw.githubusercontent.com" else URL_TEMPLATES
+    for pattern, replacement in templates:
+        path = pattern.sub(replacement, path)
+    return path
+
+
+def stats():
+    with _counters_lock:
+        result = {
+            upstream: dict(upstream_counters)
+            for upstream, upstream_counters in counters.items()
+        }
+    for upstream, breaker in list(circuit_breakers.items()):
+        result.setdefault(upstream, {})["circuit"] = breaker.state()
+    return result
+
+
+_deadline = threading.local()
+
+
+def get_deadline():
+    """
+    The time (as from ``time.time()``) by which the current work must be
+    done, or None if there is no deadline.
+    """
+    return getattr(_deadline, "at", None)
+
+
+def time_left():
+    """
+    How many seconds are left until the deadline, or None if there is no
+    deadline.
+    """
+    at = get_deadline()
+    if at is None:
+        return None
+    return at - time.time()
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    Requests made in this block must finish in ``seconds`` seconds, or
+    before the deadline that was already in place, whichever is sooner.
+    A falsy ``seconds`` doesn't add a deadline.
+    """
+    previous = get_deadline()
+    if seconds:
+        at = time.time() + seconds
+        _deadline.at = min(at, previous) if previous else at
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+@contextmanager
+def restore_deadline(at):
+    previous = get_deadline()
+    _deadline.at = at
+    try:
+        yield
+    finally:
+        _deadline.at = previous
+
+
+@register_context_propagator
+def capture_deadline():
+    at = get_deadline()
+    if at is None:
+        return None
+    return lambda: restore_deadline(at)
+
+
+register_context_propagator(capture_trace)
+
+
+# what `start_request` set up, so `end_request` can undo it
+_request = threading.local()
+
+
+def start_request():
+    """
+    A ``before_request`` handler that gives web requests a deadline and a
+    retry budget. The request contexts made for background work don't get
+    them: a job brings its own, and management commands and the warm-up
+    are only limited by the per-call timeouts.
+    """
+    if is_background_request():
+        _request.set_deadline = _request.set_retry_budget = False
+        return
+    _request.set_deadline = get_deadline() is None and bool(REQUEST_DEADLINE)
+    if _request.set_deadline:
+        _deadline.at = time.time() + REQUEST_DEADLINE
+    _request.set_retry_budget = get_retry_budget() is None
+    if _request.set_retry_budget:
+        set_retry_budget([RETRY_BUDGET])
+
+
+def end_request(exc=None):
+    if getattr(_request, "set_deadline", False):
+        _deadline.at = None
+        _request.set_deadline = False
+    if getattr(_request, "set_retry_budget", False):
+        set_retry_budget(None)
+        _request.set_retry_budget = False
+
+
+class CircuitBreaker(object):
+    """
+    Keeps track of whether an upstream is healthy. After ``threshold``
+    failures in a row (connection errors, timeouts, and 5xx responses), the
+    circuit "opens": requests fail with :class:`CircuitOpen` without being
+    made. After ``recovery_time`` seconds, one request is let through to see
+    if the upstream is back. If it works, the circuit closes again; if not,
+    it stays open for another ``recovery_time``.
+
+    Each process keeps its own circuit breakers.
+    """
+    def __init__(self, upstream, threshold=CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_time=CIRCUIT_RECOVERY_TIME):
+        self.upstream = upstream
+        self.threshold = threshold
+        self.recovery_time = recovery_time
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        # a request is seeing if the upstream is back
+        self.testing = False
+
+    def before_request(self):
+        """
+        Raise :class:`CircuitOpen` if a request shouldn't be made now.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+            retry_after = self.opened_at + self.recovery_time - time.time()
+            if retry_after > 0 or self.testing:
+                count(self.upstream, "short_circuited")
+                raise CircuitOpen(self.upstream, max(retry_after, 1))
+            self.testing = True
+
+    def record(self, healthy):
+        """
+        Record the outcome of a request: True if the upstream looked healthy,
+        False if it didn't, or None if we can't tell.
+        """
+        with self.lock:
+            was_testing, self.testing = self.testing, False
+            if healthy:
+                if self.opened_at is not None:
+                    print("{upstream} is back, closing circuit".format(upstream=self.upstream), file=sys.stderr)
+                self.failures = 0
+                self.opened_at = None
+            elif healthy is False:
+                self.failures += 1
+                if was_testing or (self.opened_at is None and self.failures >= self.threshold):
+                    self.opened_at = time.time()
+                    count(self.upstream, "circuit_opened")
+                    print(
+                        "{upstream} failed {num} times in a row, opening circuit for {secs:.0f}s".format(
+                            upstream=self.upstream, num=self.failures, secs=self.recovery_time,
+                        ),
+                        file=sys.stderr,
+                    )
+
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half-open" if self.testing else "open"
+
+
+# upstream name -> CircuitBreaker
+circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(upstream):
+    with _circuit_breakers_lock:
+        if upstream not in circuit_breakers:
+            circuit_breakers[upstream] = CircuitBreaker(upstream)
+        return circuit_breakers[upstream]
+
+
+def timeouts_for(upstream):
+    """
+    The (connect, read) timeouts for a request to this upstream, cut short
+    if the deadline is closer than that. Raises :class:`DeadlineExceeded`
+    if the deadline has passed.
+    """
+    connect, read = TIMEOUTS.get(upstream) or TIMEOUTS["default"]
+    left = time_left()
+    if left is None:
+        return connect, read
+    if left <= 0:
+        count(upstream, "deadline_exceeded")
+        raise DeadlineExceeded(
+            "Deadline passed {secs:.1f}s ago, not calling {upstream}".format(
+                secs=-left, upstream=upstream,
+            )
+        )
+    return min(connect, left), min(read, left)
+
+
+class UpstreamAdapter(HTTPAdapter):
+    """
+    A requests adapter that applies the timeouts for ``upstream``, and the
+    current deadline, to every request, and keeps the upstream's
+    :class:`CircuitBreaker` up to date.
+    """
+    def __init__(self, upstream="default", *args, **kwargs):
+        super(UpstreamAdapter, self).__init__(*args, **kwargs)
+        self.upstream = upstream
+
+    def before_send(self, request):
+        """
+        Called before a request goes out to the upstream, as opposed to
+        being answered from the HTTP cache, and before its timeouts are set.
+        """
+        pass
+
+    def send(self, request, **kwargs):
+        self.before_send(request)
+        kwargs["timeout"] = timeouts_for(self.upstream)
+        breaker = circuit_breaker(self.upstream)
+        breaker.before_request()
+        endpoint = url_template(request.url)
+        labels = {"upstream": self.upstream, "method": request.method, "endpoint": endpoint}
+        start = time.time()
+        try:
+            resp = super(UpstreamAdapter, self).send(request, **kwargs)
+            if not kwargs.get("stream"):
+                # the session would read it straight away anyway; reading it
+                # here counts the download in the duration, and gives its size
+                resp.content
+        except requests.exceptions.Timeout as err:
+            self.record(request, labels, start, error=err)
+            count(self.upstream, "timeouts")
+            left = time_left()
+            if left is not None and left <= 0:
+                # we cut it short, so it doesn't say much about the upstream
+                breaker.record(None)
+                count(self.upstream, "deadline_exceeded")
+                print(
+                    "Deadline exceeded waiting for {url}: {err}".format(url=request.url, err=err),
+                    file=sys.stderr,
+                )
+                raise DeadlineExceeded(err, request=request)
+            breaker.record(False)
+            raise
+        except requests.exceptions.ConnectionError as err:
+            self.record(request, labels, start, error=err)
+            breaker.record(False)
+            raise
+        except Exception as err:
+            self.record(request, labels, start, error=err)
+            breaker.record(None)
+            raise
+        breaker.record(resp.status_code < 500)
+        resp.span = self.record(request, labels, start, resp=resp)
+        # as opposed to a response that came straight from the HTTP cache
+        resp.from_network = True
+        return resp
+
+    def record(self, request, labels, start, resp=None, error=None):
+        """
+        Record the request in the metrics, and as a span of the current
+        trace. Returns the span, if there is a trace.
+        """
+        duration = time.time() - start
+        status = resp.status_code if resp is not None else "error"
+        metrics.upstream_requests.inc(status=status, **labels)
+        metrics.upstream_request_duration.observe(duration, **labels)
+        return record_span(
+            "{method} {endpoint}".format(**labels), start, duration,
+            error="{}".format(error) if error is not None else None,
+            **span_attributes(request, labels, resp)
+        )
+
+
+def span_attributes(request, labels, resp=None):
+    try:
+        request_bytes = len(request.body) if request.body else 0
+    except TypeError:
+        # a generator or a file
+        request_bytes = None
+    attributes = {
+        "upstream": labels["upstream"],
+        "http.request.method": labels["method"],
+        "url.template": labels["endpoint"],
+        "http.request.body.size": request_bytes,
+    }
+    if resp is not None:
+        attributes["http.response.status_code"] = resp.status_code
+        if resp._content_consumed:
+            size = len(resp.content or b"")
+        else:
+            # streamed, so the body hasn't been read yet, and this is all we know
+            length = resp.headers.get("Content-Length")
+            size = int(length) if length and length.isdigit() else None
+        attributes["http.response.body.size"] = size
+    return attributes
+
+
+class CachingUpstreamAdapter(CacheControlAdapter, UpstreamAdapter):
+    """
+    An :class:`UpstreamAdapter` with CacheControl. Responses served from the
+    cache don't count against the deadline.
+    """
+    def send(self, request, **kwargs):
+        start = time.time()
+        resp = super(CachingUpstreamAdapter, self).send(request, **kwargs)
+        if request.method == "GET":
+            endpoint = url_template(request.url)
+            if not getattr(resp, "from_network", False):
+                result = "hit"
+                if not kwargs.get("stream"):
+                    resp.content
+                labels = {"upstream": self.upstream, "method": request.method, "endpoint": endpoint}
+                resp.span = record_span(
+                    "{method} {endpoint}".format(**labels), start, time.time() - start,
+                    **span_attributes(request, labels, resp)
+                )
+            elif resp.from_cache:
+                # the upstream said 304 Not Modified
+                result = "revalidated"
+            else:
+                result = "miss"
+            if resp.span is not None:
+                resp.span["attributes"]["cache"] = result
+            metrics.upstream_cache.inc(upstream=self.upstream, endpoint=endpoint, result=result)
+        return resp
+
+
+# the sessions made by `upstream_session`
+sessions = []
+
+
+def upstream_session(upstream):
+    """
+    A plain requests session, for calls that don't go through one of the
+    Flask-Dance sessions.
+    """
+    session = requests.Session()
+    adapter = UpstreamAdapter(upstream)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    sessions.append(session)
+    return session
+
+
+def close_connections(*extra_sessions):
+    """
+    Close the kept-alive connections of the `upstream_session` sessions and
+    of ``extra_sessions``. The sessions stay usable, and open new
+    connections when they need them.
+    """
+    for session in list(sessions) + list(extra_sessions):
+        for adapter in session.adapters.values():
+            adapter.close()
@@ -3,10 +3,20 @@ from __future__ import print_function, unicode_literals
 
 import sys
 import os
+import json
+import math
+import time
+import random
 import functools
+import threading
+import Queue
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 import requests
 import bugsnag
 from urlobject import URLObject
+from openedx_webhooks import metrics
 
 
 def pop_dict_id(d):
@@ -15,7 +25,23 @@ def pop_dict_id(d):
     return (id, d)
 
 
-def paginated_get(url, session=None, limit=None, per_page=100, debug=False, **kwargs):
+# how many pages to fetch at once, when we know how many there are
+PAGINATION_CONCURRENCY = int(os.environ.get("PAGINATION_CONCURRENCY", 4))
+
+
+def real_session(session):
+    """
+    The Flask-Dance sessions are proxies for an object that belongs to the
+    current request. Threads that work for this request need the object
+    itself.
+    """
+    if hasattr(session, "_get_current_object"):
+        return session._get_current_object()
+    return session
+
+
+def paginated_get(url, session=None, limit=None, per_page=100, debug=False,
+                  concurrency=PAGINATION_CONCURRENCY, sequential=False, **kwargs):
     """
     Retrieve all objects from a paginated API.
 
@@ -27,59 +53,129 @@ def paginated_get(url, session=None, limit=None, per_page=100, debug=False, **kw
     limit has been exceeded.  For example, paginating by 100, if you set a
     limit of 250, three requests will be made, and you'll get 300 objects.
 
+    If the first page links to the "last" page, the URLs of all the other
+    pages are known, so they are fetched `concurrency` at a time. The objects
+    are still returned in order. A page is only fetched once the caller has
+    consumed one, so a caller that stops early wastes at most `concurrency`
+    pages. Set `sequential` to follow the "next" links one at a
+    time instead, which callers that usually stop early should do.
+
     """
     url = URLObject(url).set_query_param('per_page', str(per_page))
     limit = limit or 999999999
-    session = session or requests.Session()
-    returned = 0
-    while url:
-        resp = session.get(url, **kwargs)
+    session = real_session(session or requests.Session())
+
+    def get_page(page_url):
+        resp = session.get(page_url, **kwargs)
         if debug:
             print(resp.url, file=sys.stderr)
         result = resp.json()
         if not resp.ok:
             raise requests.exceptions.RequestException(result["message"])
+        return resp, result
+
+    returned = 0
+    while url:
+        resp, result = get_page(url)
         for item in result:
             yield item
             returned += 1
         url = None
         if resp.links and returned < limit:
             url = resp.links.get("next", {}).get("url", "")
+            page_urls = None
+            if url and result and not sequential and concurrency > 1:
+                page_urls = remaining_page_urls(
+                    url, resp.links.get("last", {}).get("url"),
+                    pages_needed=int(math.ceil((limit - returned) / float(len(result)))),
+                )
+            if page_urls:
+                pages = pool_map(
+                    lambda page_url: get_page(page_url)[1], page_urls,
+                    concurrency=concurrency,
+                )
+                for page in pages:
+                    for item in page:
+                        yield item
+                return
+
+
+def remaining_page_urls(next_url, last_url, pages_needed):
+    """
+    Work out the URLs of the pages from `next_url` to `last_url`, but no more
+    than `pages_needed` of them. Returns None if they aren't numbered pages.
+    """
+    if not last_url:
+        return None
+    next_url = URLObject(next_url)
+    last_url = URLObject(last_url)
+    try:
+        next_page = int(next_url.query.dict["page"])
+        last_page = int(last_url.query.dict["page"])
+    except (KeyError, ValueError):
+        return None
+    last_page = min(last_page, next_page + pages_needed - 1)
+    return [
+        next_url.set_query_param("page", str(page))
+        for page in range(next_page, last_page + 1)
+    ]
+
+
+def jira_get_json(session, url, retries=3, debug=False):
+    """
+    Get JSON from the JIRA API. JIRA sometimes sends back an empty response,
+    so that is tried up to `retries` times, with `backoff` in between.
+    """
+    for attempt in xrange(retries):
+        try:
+            if debug:
+                print(url, file=sys.stderr)
+            resp = session.get(url)
+            resp.json()
+            break
+        except ValueError:
+            if attempt + 1 < retries and not backoff(attempt):
+                break
+    if not resp.ok:
+        raise requests.exceptions.RequestException(resp.text)
+    return resp.json()
 
 
 def jira_paginated_get(url, session=None,
                        start=0, start_param="startAt", obj_name=None,
-                       retries=3, debug=False, **fields):
+                       retries=3, debug=False,
+                       concurrency=PAGINATION_CONCURRENCY, ordered=True, **fields):
     """
     Like ``paginated_get``, but uses JIRA's conventions for a paginated API, which
     are different from Github's conventions.
+
+    If the first response says how many results there are in total, the rest
+    are fetched `concurrency` windows at a time. Set `ordered` to False to get
+    each window's results as soon as they arrive, rather than in order.
     """
-    session = session or requests.Session()
+    session = real_session(session or requests.Session())
     url = URLObject(url)
-    more_results = True
-    while more_results:
+
+    def get_window(start):
         result_url = (
             url.set_query_param(start_param, str(start))
                .set_query_params(**fields)
         )
-        for _ in xrange(retries):
-            try:
-                if debug:
-                    print(result_url, file=sys.stderr)
-                result_resp = session.get(result_url)
-                result = result_resp.json()
-                break
-            except ValueError:
-                continue
-        if not result_resp.ok:
-            raise requests.exceptions.RequestException(result_resp.text)
-        result = result_resp.json()
+        return jira_get_json(session, result_url, retries=retries, debug=debug)
+
+    def window_objs(result):
         if not result:
-            break
+            return []
         if obj_name:
-            objs = result[obj_name]
-        else:
-            objs = result
+            return result[obj_name]
+        return result
+
+    more_results = True
+    while more_results:
+        result = get_window(start)
+        if not result:
+            break
+        objs = window_objs(result)
         for obj in objs:
             yield obj
         # are we done yet?
@@ -90,35 +186,44 @@ def jira_paginated_get(url, session=None,
                 start += returned
             else:
                 more_results = False
+            if more_results and returned and concurrency > 1:
+                starts = range(start, total, returned)
+                windows = pool_map(
+                    lambda start: window_objs(get_window(start)), starts,
+                    concurrency=concurrency, ordered=ordered,
+                )
+                for objs in windows:
+                    for obj in objs:
+                        yield obj
+                more_results = False
         else:
             # `result` is a list
             start += len(result)
             more_results = True  # just keep going until there are no more results.
 
 
-def jira_group_members(groupname, session=None, start=0, retries=3, debug=False):
+def jira_group_members(groupname, session=None, start=0, retries=3, debug=False,
+                       concurrency=PAGINATION_CONCURRENCY, ordered=True):
     """
     JIRA's group members API is horrible. This makes it easier to use.
+
+    Once the first response says how big the group is, the rest of the
+    members are fetched `concurrency` windows at a time. Set `ordered` to
+    False to get each window's members as soon as they arrive.
     """
-    session = session or requests.Session()
+    session = real_session(session or requests.Session())
     url = URLObject("/rest/api/2/group").set_query_param("groupname", groupname)
-    more_results = True
-    while more_results:
-        end = start + 49  # max 50 users per page
+    page_size = 50  # max 50 users per page
+
+    def get_window(start):
+        end = start + page_size - 1
         expand = "users[{start}:{end}]".format(start=start, end=end)
         result_url = url.set_query_param("expand", expand)
-        for _ in xrange(retries):
-            try:
-                if debug:
-                    print(result_url, file=sys.stderr)
-                result_resp = session.get(result_url)
-                result = result_resp.json()
-                break
-            except ValueError:
-                continue
-        if not result_resp.ok:
-            raise requests.exceptions.RequestException(result_resp.text)
-        result = result_resp.json()
+        return jira_get_json(session, result_url, retries=retries, debug=debug)
+
+    more_results = True
+    while more_results:
+        result = get_window(start)
         if not result:
             break
         users = result["users"]["items"]
@@ -130,6 +235,16 @@ def jira_group_members(groupname, session=None, start=0, retries=3, debug=False)
             start += returned
         else:
             more_results = False
+        if more_results and returned and concurrency > 1:
+            windows = pool_map(
+                lambda start: (get_window(start) or {}).get("users", {}).get("items", []),
+                range(start, total, page_size),
+                concurrency=concurrency, ordered=ordered,
+            )
+            for users in windows:
+                for user in users:
+                    yield user
+            more_results = False
 
 
 def jira_users(filter=None, session=None, debug=False):
@@ -152,34 +267,285 @@ def jira_users(filter=None, session=None, debug=False):
         yield user
 
 
-def memoize(func):
-    cache = {}
+# name -> cache, for reporting statistics
+caches = {}
 
-    def mk_key(*args, **kwargs):
-        return (tuple(args), tuple(sorted(kwargs.items())))
 
-    @functools.wraps(func)
-    def memoized(*args, **kwargs):
-        key = memoized.mk_key(*args, **kwargs)
-        try:
-            return cache[key]
-        except KeyError:
-            cache[key] = func(*args, **kwargs)
-            return cache[key]
-
-    memoized.mk_key = mk_key
-
-    def uncache(*args, **kwargs):
-        key = memoized.mk_key(*args, **kwargs)
-        if key in cache:
-            del cache[key]
-            return True
-        else:
-            return False
+class TTLCache(object):
+    """
+    A thread-safe dict whose entries expire ``ttl`` seconds after they are
+    set, or never if ``ttl`` is None. If ``maxsize`` is set, the least
+    recently used entries are evicted to make room for new ones. It counts
+    hits, misses and evictions, so we can tell if the sizes and TTLs are any
+    good. If it has a ``name``, it is listed in ``caches``.
+    """
+    def __init__(self, ttl=None, maxsize=None, name=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # key -> (value, expiry time or None), least recently used first
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # callers that waited for someone else's call, and values found in
+        # the shared tier, see `cached`
+        self.coalesced = 0
+        self.shared_hits = 0
+        if name:
+            caches[name] = self
+
+    def lookup(self, key, count=True):
+        """
+        Return ``(value, True)`` if ``key`` is in the cache, or
+        ``(None, False)`` if it isn't. This tells a cached None apart from
+        a missing entry.
+        """
+        with self.lock:
+            try:
+                value, expires = self.data.pop(key)
+            except KeyError:
+                if count:
+                    self.misses += 1
+                return None, False
+            if expires is not None and expires <= time.time():
+                self.expirations += 1
+                if count:
+                    self.misses += 1
+                return None, False
+            # put it back at the most recently used end
+            self.data[key] = (value, expires)
+            if count:
+                self.hits += 1
+            return value, True
+
+    def get(self, key, default=None):
+        value, found = self.lookup(key)
+        return value if found else default
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value. ``ttl`` overrides the cache's TTL for this entry.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (value, expires)
+            if self.maxsize:
+                while len(self.data) > self.maxsize:
+                    self.data.popitem(last=False)
+                    self.evictions += 1
+
+    def delete(self, key):
+        with self.lock:
+            return self.data.pop(key, None) is not None
+
+    def count(self, counter):
+        """
+        Add one to a counter that callers keep up to date, like
+        ``shared_hits``, holding the lock like the cache's own counters.
+        """
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "ttl": self.ttl,
+                "maxsize": self.maxsize,
+                "size": len(self.data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "coalesced": self.coalesced,
+                "shared_hits": self.shared_hits,
+            }
+
+
+# TTLCache.stats() counters that are exported as metrics
+CACHE_METRICS = ("hits", "misses", "evictions", "expirations", "coalesced", "shared_hits")
+
+
+@metrics.register_collector
+def collect_cache_metrics():
+    samples = []
+    for name, cache in caches.items():
+        stats = cache.stats()
+        for counter in CACHE_METRICS:
+            samples.append((
+                "webhooks_cache_{counter}_total".format(counter=counter),
+                "In-process cache {counter}, by cache.".format(counter=counter.replace("_", " ")),
+                {"cache": name},
+                stats[counter],
+            ))
+    return samples
+
+
+def make_key(*args, **kwargs):
+    return (tuple(args), tuple(sorted(kwargs.items())))
+
+
+def shared_get(shared, key):
+    """
+    Look up a value that `shared_set` put in a shared cache. Returns
+    ``(value, seconds until it expires or None, True)``, or
+    ``(None, None, False)`` if it isn't there or has expired.
+    """
+    data = shared.get(repr(key))
+    if data is None:
+        return None, None, False
+    try:
+        value, expires = json.loads(data.decode("utf-8"))
+    except Exception:
+        # including entries from before they were JSON
+        return None, None, False
+    if expires is None:
+        return value, None, True
+    remaining = expires - time.time()
+    if remaining <= 0:
+        return None, None, False
+    return value, remaining, True
+
+
+def shared_set(shared, key, value, ttl=None):
+    expires = time.time() + ttl if ttl is not None else None
+    try:
+        # JSON rather than pickles: loading a pickle can run any code, so
+        # it's only as safe as whatever the cache is kept in
+        data = json.dumps([value, expires]).encode("utf-8")
+    except Exception as err:
+        print("Can't share cached value for {key!r}: {err}".format(key=key, err=err), file=sys.stderr)
+        return
+    shared.set(repr(key), data)
+
+
+class _Flight(object):
+    """
+    A call that is in progress, for other threads to wait on.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def cached(maxsize=128, ttl=None, negative=(), negative_ttl=0, key=None, name=None,
+           shared=None):
+    """
+    Cache the results of a function in a :class:`TTLCache` with this
+    ``maxsize`` and ``ttl``.
+
+    ``shared`` is an optional cache that other processes can see, like the
+    ones from :func:`openedx_webhooks.cache.make_shared_cache`. When a value
+    isn't cached in this process, it is looked up there before calling the
+    function, and new values are stored there as JSON with the same
+    ``ttl``, so they must be JSON-serializable. Negative values are only cached in this process.
+
+    Return values that are in ``negative`` (like None, for "not found") are
+    only cached for ``negative_ttl`` seconds; by default, they aren't cached
+    at all. Exceptions are never cached.
+
+    If several threads call the function with the same arguments while the
+    value isn't cached, only the first one calls it; the others wait for its
+    result.
+
+    ``key`` is an optional function that turns the arguments into the cache
+    key; by default it's the arguments themselves. The cache is listed in
+    ``caches`` under ``name``, which defaults to the function's full name.
+    The decorated function gets ``cache`` and ``uncache(*args, **kwargs)``
+    attributes.
+    """
+    if not isinstance(negative, (list, tuple)):
+        negative = (negative,)
+    mk_key = key or make_key
 
-    memoized.uncache = uncache
+    def decorator(func):
+        cache = TTLCache(
+            ttl=ttl, maxsize=maxsize,
+            name=name or "{mod}.{func}".format(mod=func.__module__, func=func.__name__),
+        )
+        flights = {}
+        flights_lock = threading.Lock()
 
-    return memoized
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = mk_key(*args, **kwargs)
+            value, found = cache.lookup(cache_key)
+            if found:
+                return value
+
+            with flights_lock:
+                # someone might have just finished calling it
+                value, found = cache.lookup(cache_key, count=False)
+                if found:
+                    return value
+                flight = flights.get(cache_key)
+                leader = flight is None
+                if leader:
+                    flight = flights[cache_key] = _Flight()
+                else:
+                    cache.count("coalesced")
+
+            if not leader:
+                flight.done.wait()
+                if flight.error:
+                    raise flight.error
+                return flight.value
+
+            try:
+                if shared is not None:
+                    value, remaining, found = shared_get(shared, cache_key)
+                    if found:
+                        cache.count("shared_hits")
+                        cache.set(cache_key, value, ttl=remaining)
+                        flight.value = value
+                        return value
+                value = func(*args, **kwargs)
+            except Exception as err:
+                flight.error = err
+                raise
+            else:
+                flight.value = value
+                if value not in negative:
+                    cache.set(cache_key, value)
+                    if shared is not None:
+                        shared_set(shared, cache_key, value, ttl=ttl)
+                elif negative_ttl:
+                    cache.set(cache_key, value, ttl=negative_ttl)
+                return value
+            finally:
+                with flights_lock:
+                    del flights[cache_key]
+                flight.done.set()
+
+        def uncache(*args, **kwargs):
+            cache_key = mk_key(*args, **kwargs)
+            if shared is not None:
+                shared.delete(repr(cache_key))
+            return cache.delete(cache_key)
+
+        wrapper.cache = cache
+        wrapper.mk_key = mk_key
+        wrapper.uncache = uncache
+        return wrapper
+
+    return decorator
+
+
+def memoize(func):
+    """
+    Cache the results of a function. The 128 most recently used results are
+    kept; see `cached` for more control.
+    """
+    return cached()(func)
 
 
 def memoize_except(values):
@@ -188,41 +554,270 @@ def memoize_except(values):
     certain values. For example, you could use this to make a function not
     cache `None`.
     """
-    if not isinstance(values, (list, tuple)):
-        values = (values,)
+    return cached(negative=values)
 
-    def decorator(func):
-        cache = {}
 
-        def mk_key(*args, **kwargs):
-            return (tuple(args), tuple(sorted(kwargs.items())))
+# functions that capture some thread-local state, see `propagate_context`
+context_propagators = []
 
-        @functools.wraps(func)
-        def memoized(*args, **kwargs):
-            key = memoized.mk_key(*args, **kwargs)
-            try:
-                return cache[key]
-            except KeyError:
-                value = func(*args, **kwargs)
-                if value not in values:
-                    cache[key] = value
-                return value
 
-        memoized.mk_key = mk_key
+def register_context_propagator(capture):
+    """
+    Register a function that captures some thread-local state, so that it is
+    carried over into the threads used by `pool_map`. The function is called
+    in the calling thread, and should return either None, or a function that
+    returns a context manager that restores the state in another thread.
+    """
+    context_propagators.append(capture)
+    return capture
 
-        def uncache(*args, **kwargs):
-            key = memoized.mk_key(*args, **kwargs)
-            if key in cache:
-                del cache[key]
-                return True
+
+def propagate_context(func):
+    """
+    Wrap `func` so that when it is called from another thread, it runs with
+    the thread-local state that the current thread has right now.
+    """
+    restorers = [capture() for capture in context_propagators]
+    restorers = [restorer for restorer in restorers if restorer]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        managers = [restorer() for restorer in restorers]
+        entered = []
+        try:
+            for manager in managers:
+                manager.__enter__()
+                entered.append(manager)
+            return func(*args, **kwargs)
+        finally:
+            for manager in reversed(entered):
+                manager.__exit__(None, None, None)
+
+    return wrapper
+
+
+class SharedThreads(object):
+    """
+    Threads that are shared by every `pool_map` call in a process, so that
+    each call doesn't pay for starting and stopping a pool of its own. When
+    no thread is idle, another one is started, so a call that waits for
+    another `pool_map` (a rescan listing pull requests a page at a time, for
+    instance) can't use up the threads and wait forever. Idle threads are
+    kept for the next call.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.tasks = deque()
+        self.idle = 0
+
+    def submit(self, task):
+        with self.condition:
+            self.tasks.append(task)
+            if self.idle >= len(self.tasks):
+                self.condition.notify()
+                return
+        thread = threading.Thread(target=self.work)
+        thread.daemon = True
+        thread.start()
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.tasks:
+                    self.idle += 1
+                    self.condition.wait()
+                    self.idle -= 1
+                task = self.tasks.popleft()
+            task()
+
+
+# (process ID, threads), so that a forked process makes its own threads
+_shared_threads = (None, None)
+_shared_threads_lock = threading.Lock()
+
+
+def get_shared_threads():
+    global _shared_threads
+    with _shared_threads_lock:
+        pid, threads = _shared_threads
+        if pid != os.getpid():
+            threads = SharedThreads()
+            _shared_threads = (os.getpid(), threads)
+    return threads
+
+
+def pool_map(func, items, concurrency=4, ordered=True):
+    """
+    Call `func` on each of `items`, with up to `concurrency` calls running
+    at once, and yield the results. Results are yielded in the same order as
+    `items`, unless `ordered` is False, in which case they are yielded as
+    soon as they are ready. If a call raises an exception, it is re-raised
+    here.
+
+    The calls run in threads shared by the whole process. An item is only
+    started when a result has been taken to make room for it, so a caller
+    that stops early wastes at most `concurrency` calls.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+    threads = get_shared_threads()
+    wrapped = propagate_context(func)
+    # (index, error, result) for each call that has finished
+    finished = Queue.Queue()
+
+    def submit(index, item):
+        def call():
+            try:
+                result = wrapped(item)
+            except Exception as err:
+                finished.put((index, err, None))
             else:
-                return False
+                finished.put((index, None, result))
+        threads.submit(call)
+
+    items = iter(enumerate(items))
+    running = 0
+    # results that came back before the ones before them, by index
+    waiting = {}
+    next_index = 0
+    while True:
+        # start calls until there are `concurrency` that haven't been yielded
+        while running + len(waiting) < concurrency:
+            try:
+                index, item = next(items)
+            except StopIteration:
+                break
+            submit(index, item)
+            running += 1
+        if not running:
+            return
+        index, error, result = finished.get()
+        running -= 1
+        if error is not None:
+            raise error
+        if not ordered:
+            yield result
+            continue
+        waiting[index] = result
+        while next_index in waiting:
+            yield waiting.pop(next_index)
+            next_index += 1
+
+
+# how many `run_async` calls can run at once, in each process
+ASYNC_CONCURRENCY = int(os.environ.get("ASYNC_CONCURRENCY", 16))
+# (process ID, pool), so that a forked process makes its own pool
+_async_pool = (None, None)
+_async_pool_lock = threading.Lock()
+
+
+def run_async(func, *args, **kwargs):
+    """
+    Start calling `func` in another thread, with the same thread-local state
+    as the current thread (see `propagate_context`), and return right away.
+    Call ``.get()`` on the return value to wait for the result; if the call
+    raised an exception, ``.get()`` raises it.
 
-        memoized.uncache = uncache
+    The threads are shared by the whole process, so a function that is run
+    this way must not wait for other `run_async` calls itself.
+    """
+    global _async_pool
+    with _async_pool_lock:
+        pid, pool = _async_pool
+        if pid != os.getpid():
+            pool = ThreadPool(ASYNC_CONCURRENCY)
+            _async_pool = (os.getpid(), pool)
+    return pool.apply_async(propagate_context(func), args, kwargs)
 
-        return memoized
 
-    return decorator
+# the first delay before retrying, in seconds; it doubles with each attempt
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", 8))
+# how many retries a web request or a job can make in total
+RETRY_BUDGET = int(os.environ.get("RETRY_BUDGET", 10))
+
+_retries = threading.local()
+_retries_lock = threading.Lock()
+
+
+def backoff_delay(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """
+    How long to wait before retrying after `attempt` failed attempts (counting
+    from 0): a random time up to an exponentially growing limit, so that
+    clients that failed together don't retry together.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def get_retry_budget():
+    """
+    The retry budget for the current work, or None if it has none. It's a
+    list holding the number of retries left, so that threads can share it.
+    """
+    return getattr(_retries, "budget", None)
+
+
+def set_retry_budget(budget):
+    _retries.budget = budget
+
+
+@contextmanager
+def retry_budget(retries=RETRY_BUDGET):
+    """
+    All the retries made with `backoff` in this block, and in threads that
+    it starts, share a budget of `retries` retries.
+    """
+    previous = get_retry_budget()
+    _retries.budget = [retries]
+    try:
+        yield
+    finally:
+        _retries.budget = previous
+
+
+@contextmanager
+def restore_retry_budget(budget):
+    previous = get_retry_budget()
+    _retries.budget = budget
+    try:
+        yield
+    finally:
+        _retries.budget = previous
+
+
+@register_context_propagator
+def capture_retry_budget():
+    budget = get_retry_budget()
+    if budget is None:
+        return None
+    return lambda: restore_retry_budget(budget)
+
+
+def backoff(attempt):
+    """
+    Wait before retrying something that failed `attempt` + 1 times. Returns
+    False, without waiting, if the retry budget is used up: the caller
+    should give up.
+    """
+    budget = get_retry_budget()
+    if budget is not None:
+        with _retries_lock:
+            if budget[0] <= 0:
+                print("Retry budget used up, not retrying", file=sys.stderr)
+                return False
+            budget[0] -= 1
+    metrics.retries.inc()
+    time.sleep(backoff_delay(attempt))
+    return True
+
+
+def truthy(value):
+    """
+    Interpret a form field or query string value as a boolean.
+    """
+    return (value or "").lower() in ("1", "true", "yes", "on")
 
 
 def to_unicode(s):
@@ -242,9 +837,14 @@ def studio_crowd_tokenkey(base_url="https://openedx.atlassian.net"):
     if not JIRA_USERNAME or not JIRA_PASSWORD:
         raise Exception("Missing required environment variables: JIRA_USERNAME, JIRA_PASSWORD")
 
+    # openedx_webhooks.upstream imports this module
+    from openedx_webhooks.upstream import timeouts_for
+
     login_url = URLObject(base_url).relative("/login")
     payload = {"username": JIRA_USERNAME, "password": JIRA_PASSWORD}
-    login_resp = requests.post(login_url, data=payload, allow_redirects=False)
+    login_resp = requests.post(
+        login_url, data=payload, allow_redirects=False, timeout=timeouts_for("jira"),
+    )
     if not login_resp.status_code in (200, 303):
         raise requests.exceptions.RequestException(login_resp.text)
     return login_resp.cookies["studio.crowd.tokenkey"]
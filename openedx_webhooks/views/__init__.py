@@ -2,10 +2,14 @@
 from __future__ import unicode_literals, print_function
 
 from openedx_webhooks import app
-from flask import render_template
+from openedx_webhooks.utils import caches
+from openedx_webhooks import metrics, upstream, warmup
+from flask import render_template, jsonify, Response
 
 from .github import github_pull_request, github_rescan, github_install
 from .jira import jira_issue_created, jira_rescan_issues, jira_rescan_users
+from .queue import dead_jobs, replay_job
+from .debug import traces, trace, profiles, profile
 
 from flask_dance.contrib.github import github as github_session
 from flask_dance.contrib.jira import jira as jira_session
@@ -28,3 +32,62 @@ def index():
     return render_template("main.html",
         github_username=github_username, jira_username=jira_username,
     )
+
+
+@app.route("/stats/caches")
+def cache_stats():
+    """
+    Hit and miss counts for our caches, to help tune their TTLs.
+    """
+    return jsonify({name: cache.stats() for name, cache in caches.items()})
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """
+    Metrics of every web and worker process, in the Prometheus text format.
+    """
+    metrics.flush(force=True)
+    return Response(
+        metrics.exposition(metrics.load_snapshots()),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+
+@app.errorhandler(upstream.CircuitOpen)
+def circuit_open(err):
+    """
+    Github or JIRA is having trouble, so we're not calling it for a while.
+    """
+    resp = jsonify(error="{}".format(err))
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "{:.0f}".format(err.retry_after)
+    return resp
+
+
+@app.route("/stats/upstreams")
+def upstream_stats():
+    """
+    How many requests to each upstream timed out, or were cut off by a
+    deadline, in this process.
+    """
+    return jsonify(upstream.stats())
+
+
+@app.route("/ready")
+def ready():
+    """
+    Has the warm-up finished? Returns 503 until it has. If no warm-up has
+    been started (for instance, when not running under gunicorn), this
+    starts one.
+    """
+    warmup.warm_up_in_background()
+    resp = jsonify(
+        ready=warmup.is_ready(),
+        started_at=warmup.status["started_at"],
+        finished_at=warmup.status["finished_at"],
+        errors=warmup.status["errors"],
+    )
+    if not warmup.is_ready():
+        resp.status_code = 503
+    return resp
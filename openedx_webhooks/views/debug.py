@@ -0,0 +1,83 @@
+# coding=utf-8
+"""
+These are the views for looking into what the bot has been doing.
+"""
+
+from __future__ import unicode_literals, print_function
+
+import os
+import pstats
+from StringIO import StringIO
+
+from flask import request, jsonify, abort, send_from_directory, Response
+from openedx_webhooks import app, profiling
+from openedx_webhooks.auth import check_admin_token
+from openedx_webhooks.tracing import load_traces, otel_json
+
+
+def traces_response(found):
+    """
+    The traces as JSON, or as OpenTelemetry (OTLP) JSON if the ``format``
+    query parameter is "otel".
+    """
+    if request.args.get("format") == "otel":
+        return jsonify(otel_json(found))
+    return jsonify(traces=found)
+
+
+@app.route("/debug/traces")
+def traces():
+    """
+    The most recent traces of web requests and jobs, with the calls they
+    made to Github and JIRA.
+    """
+    check_admin_token()
+    limit = request.args.get("limit", 50, type=int)
+    return traces_response(load_traces(limit=limit))
+
+
+@app.route("/debug/traces/<trace_id>")
+def trace(trace_id):
+    """
+    A webhook's trace, together with those of the jobs it queued.
+    """
+    check_admin_token()
+    found = load_traces(trace_id=trace_id, limit=100)
+    if not found:
+        abort(404)
+    # oldest first, so the webhook comes before its jobs
+    return traces_response(sorted(found, key=lambda t: t["started_at"]))
+
+
+@app.route("/debug/profiles")
+def profiles():
+    """
+    The saved profiles of this dyno, newest first.
+    """
+    profiling.check_token()
+    return jsonify(profiles=profiling.list_profiles())
+
+
+@app.route("/debug/profiles/<name>")
+def profile(name):
+    """
+    Download a profile, to load with ``pstats`` or a viewer like SnakeViz.
+    With ``format=text``, show the ``limit`` (default 50) slowest functions
+    instead, sorted by ``sort`` (default "cumulative").
+    """
+    profiling.check_token()
+    if not profiling.PROFILE_NAME_RE.match(name) or not os.path.exists(profiling.profile_path(name)):
+        abort(404)
+    if request.args.get("format") != "text":
+        return send_from_directory(
+            profiling.PROFILING_DIR, name,
+            as_attachment=True, mimetype="application/octet-stream",
+        )
+    out = StringIO()
+    stats = pstats.Stats(profiling.profile_path(name), stream=out)
+    try:
+        stats.sort_stats(request.args.get("sort", "cumulative"))
+    except KeyError:
+        abort(400)
+    stats.print_stats(request.args.get("limit", 50, type=int))
+    return Response(out.getvalue(), mimetype="text/plain")
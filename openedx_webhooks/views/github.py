@@ -5,28 +5,42 @@ These are the views that process webhook events coming from Github.
 
 from __future__ import unicode_literals, print_function
 
+import os
 import sys
 import json
 import re
-from datetime import date
+import time
 from collections import defaultdict
 
 import bugsnag
 import requests
-import yaml
 from iso8601 import parse_date
 from flask import request, render_template, make_response, url_for, jsonify
 from flask_dance.contrib.github import github
 from flask_dance.contrib.jira import jira
+from sqlalchemy.exc import IntegrityError
 from openedx_webhooks import app
-from openedx_webhooks.utils import memoize, paginated_get
-from openedx_webhooks.views.jira import get_jira_custom_fields
+from openedx_webhooks.cache import make_shared_cache
+from openedx_webhooks.deliveries import is_duplicate_delivery, duplicate_response
+from openedx_webhooks.jobs import task, enqueue, accepted
+from openedx_webhooks.locks import keyed_lock, pull_request_key
+from openedx_webhooks.models import db, PullRequestIssue, RescanWatermark
+from openedx_webhooks.people import (
+    INTERNAL, CONTRACTOR, get_people_index, classify_pull_request, pull_request_date,
+)
+from openedx_webhooks.ratelimit import background_priority
+from openedx_webhooks.remote_files import people_file, repos_file
+from openedx_webhooks.utils import cached, paginated_get, pool_map, run_async, truthy
+from openedx_webhooks.views.jira import (
+    get_jira_custom_fields, transition_cache_key, transition_issue,
+)
 
 
 @app.route("/github/pr", methods=("POST",))
 def github_pull_request():
     """
-    Process a `PullRequestEvent`_ from Github.
+    Process a `PullRequestEvent`_ from Github. The actual work is queued,
+    and done by ``manage.py worker``.
 
     .. _PullRequestEvent: https://developer.github.com/v3/activity/events/types/#pullrequestevent
     """
@@ -43,12 +57,15 @@ def github_pull_request():
         print("ping from {repo}".format(repo=repo), file=sys.stderr)
         return "PONG"
 
+    if is_duplicate_delivery("github"):
+        return duplicate_response("github")
+
     pr = event["pull_request"]
     repo = pr["base"]["repo"]["full_name"].decode('utf-8')
     if event["action"] == "opened":
-        return pr_opened(pr, bugsnag_context)
+        return accepted(enqueue(pr_opened, pr))
     if event["action"] == "closed":
-        return pr_closed(pr, bugsnag_context)
+        return accepted(enqueue(pr_closed, pr))
     if event["action"] == "labeled":
         return "Ignoring labeling events from github", 200
 
@@ -63,38 +80,146 @@ def github_pull_request():
     return "Don't know how to handle this.", 400
 
 
+RESCAN_CONCURRENCY = int(os.environ.get("RESCAN_CONCURRENCY", 8))
+
+
 @app.route("/github/rescan", methods=("GET", "POST"))
 def github_rescan():
     """
     Used to pick up PRs that might not have tickets associated with them.
+
+    Scans one repo, or every repo in repos.yaml if ``all`` is set. Up to
+    ``concurrency`` pull requests are processed at the same time. Only pull
+    requests updated since the last rescan of each repo are looked at,
+    unless ``full`` is set.
+
+    Rescanning many repos takes longer than a web request may, so the rescan
+    is queued as a job, see :func:`rescan_repos`.
     """
     if request.method == "GET":
         # just render the form
         return render_template("github_rescan.html")
-    repo = request.form.get("repo") or "edx/edx-platform"
-    bugsnag_context = {"repo": repo}
-    bugsnag.configure_request(meta_data=bugsnag_context)
-    url = "/repos/{repo}/pulls".format(repo=repo)
-    created = {}
+    try:
+        concurrency = int(request.form.get("concurrency") or RESCAN_CONCURRENCY)
+    except ValueError:
+        resp = jsonify({"error": "concurrency must be a number"})
+        resp.status_code = 400
+        return resp
+    if truthy(request.form.get("all")):
+        # the job reads repos.yaml when it runs
+        repos = None
+    else:
+        repos = [request.form.get("repo") or "edx/edx-platform"]
+    full = truthy(request.form.get("full"))
+    return accepted(enqueue(rescan_repos, repos, concurrency=concurrency, full=full))
 
-    for pull_request in paginated_get(url, session=github):
-        bugsnag_context["pull_request"] = pull_request
-        bugsnag.configure_request(meta_data=bugsnag_context)
-        if not get_jira_issue_key(pull_request) and not is_internal_pull_request(pull_request):
-            text = pr_opened(pull_request, bugsnag_context=bugsnag_context)
-            if "created" in text:
-                jira_key = text[8:]
-                created[pull_request["number"]] = jira_key
+
+# one rescan at a time: two at once would only get in each other's way
+@task(key=lambda *args, **kwargs: "github-rescan")
+def rescan_repos(repos=None, concurrency=RESCAN_CONCURRENCY, full=False):
+    """
+    The job that `github_rescan` queues: rescan these repos, or every repo
+    in repos.yaml if ``repos`` is None, as background work. Returns the
+    issues that were created, as JSON.
+    """
+    if repos is None:
+        repos = list(get_repos_file().keys())
+    bugsnag.configure_request(meta_data={"repos": repos, "full": full})
+    with background_priority():
+        created = rescan_repositories(repos, concurrency=concurrency, full=full)
+    return json.dumps(created)
+
+
+def rescan_repositories(repos, concurrency=RESCAN_CONCURRENCY, full=False):
+    """
+    Create JIRA issues for the open pull requests in these repos that don't
+    have one yet, processing up to ``concurrency`` pull requests at a time.
+    Returns a dict of repo to a dict of pull request number to the key of
+    the JIRA issue that was created for it.
+
+    Unless ``full`` is set, pull requests that haven't been updated since
+    the last rescan of their repo are skipped.
+    """
+    start = time.time()
+
+    def list_repo(repo):
+        since = None if full else RescanWatermark.get("github", repo)
+        return repo, open_pull_requests(repo, since=since)
+
+    listed = list(pool_map(list_repo, repos, concurrency))
+    pull_requests = [
+        pull_request
+        for repo, repo_pull_requests in listed
+        for pull_request in repo_pull_requests
+    ]
+    created = {repo: {} for repo in repos}
+    # how many of each repo's pull requests are still to be processed
+    remaining = {repo: len(repo_pull_requests) for repo, repo_pull_requests in listed}
+    listed = dict(listed)
+    results = pool_map(rescan_pull_request, pull_requests, concurrency)
+    for pull_request, issue_key in zip(pull_requests, results):
+        repo = pull_request["base"]["repo"]["full_name"].decode('utf-8')
+        if issue_key:
+            created.setdefault(repo, {})[pull_request["number"]] = issue_key
+        remaining[repo] -= 1
+        if not remaining[repo]:
+            # everything we listed in this repo has been processed, so move
+            # its watermark up now, in case a later repo doesn't finish
+            updated_at = max(
+                parse_date(repo_pull_request["updated_at"]).replace(tzinfo=None)
+                for repo_pull_request in listed[repo]
+            )
+            RescanWatermark.set("github", repo, updated_at)
 
     print(
-        "Created {num} JIRA issues. PRs are {prs}".format(
-            num=len(created), prs=created.keys(),
+        "Rescanned {num_prs} PRs in {num_repos} repos in {secs:.1f}s "
+        "(concurrency {concurrency}, {mode}). Created {num} JIRA issues: {created}".format(
+            num_prs=len(pull_requests), num_repos=len(repos),
+            secs=time.time() - start, concurrency=concurrency,
+            mode="full" if full else "incremental",
+            num=sum(len(issues) for issues in created.values()), created=created,
         ),
         file=sys.stderr
     )
-    resp = make_response(json.dumps(created), 200)
-    resp.headers["Content-Type"] = "application/json"
-    return resp
+    return created
+
+
+def open_pull_requests(repo, since=None):
+    """
+    Return the open pull requests in this repo. If ``since`` is given, only
+    return the ones that have been updated since then. Github can't filter
+    pull requests by date, but it can sort them by when they were updated,
+    so we stop paging once we get past ``since``.
+    """
+    url = "/repos/{repo}/pulls?sort=updated&direction=desc".format(repo=repo)
+    pull_requests = []
+    # an incremental rescan usually stops on the first page or two, so
+    # don't fetch the other pages ahead of time
+    for pull_request in paginated_get(url, session=github, sequential=bool(since)):
+        if since:
+            updated_at = parse_date(pull_request["updated_at"]).replace(tzinfo=None)
+            if updated_at < since:
+                break
+        pull_requests.append(pull_request)
+    return pull_requests
+
+
+def rescan_pull_request(pull_request):
+    """
+    Create a JIRA issue for this pull request if it needs one, and return
+    its key. Returns None if no issue was created.
+    """
+    bugsnag_context = {"pull_request": pull_request}
+    bugsnag.configure_request(meta_data=bugsnag_context)
+    if is_internal_pull_request(pull_request):
+        return None
+    with keyed_lock(pull_request_key(pull_request)):
+        if get_jira_issue_key(pull_request):
+            return None
+        text = pr_opened(pull_request, bugsnag_context=bugsnag_context)
+    if text.startswith("created "):
+        return text[len("created "):]
+    return None
 
 
 @app.route("/github/process_pr", methods=("GET", "POST"))
@@ -117,7 +242,9 @@ def github_process_pr():
         resp = jsonify({"error": pr_resp.text})
         resp.status_code = 400
         return resp
-    return pr_opened(pr_resp.json(), ignore_internal=False, check_contractor=False)
+    pr = pr_resp.json()
+    with keyed_lock(pull_request_key(pr)):
+        return pr_opened(pr, ignore_internal=False, check_contractor=False)
 
 
 @app.route("/github/install", methods=("GET", "POST"))
@@ -164,48 +291,27 @@ def github_install():
     return resp
 
 
-@memoize
+@cached(maxsize=1, ttl=60 * 60, shared=make_shared_cache("github"))
 def github_whoami():
     self_resp = github.get("/user")
-    rate_limit_info = {k: v for k, v in self_resp.headers.items() if "ratelimit" in k}
-    print("Rate limits: {}".format(rate_limit_info), file=sys.stderr)
     if not self_resp.ok:
         raise requests.exceptions.RequestException(self_resp.text)
     return self_resp.json()
 
 
-@memoize
 def get_people_file():
-    people_resp = requests.get("https://raw.githubusercontent.com/edx/repo-tools/master/people.yaml")
-    if not people_resp.ok:
-        raise requests.exceptions.RequestException(people_resp.text)
-    return yaml.safe_load(people_resp.text)
+    return people_file.get()
 
 
-@memoize
 def get_repos_file():
-    repo_resp = requests.get("https://raw.githubusercontent.com/edx/repo-tools/master/repos.yaml")
-    if not repo_resp.ok:
-        raise requests.exceptions.RequestException(repo_resp.text)
-    return yaml.safe_load(repo_resp.text)
+    return repos_file.get()
 
 
 def is_internal_pull_request(pull_request):
     """
     Was this pull request created by someone who works for edX?
     """
-    people = get_people_file()
-    author = pull_request["user"]["login"].decode('utf-8')
-    created_at = parse_date(pull_request["created_at"]).replace(tzinfo=None)
-    # Arbisoft doesn't do any Open edX work that is not paid for by edX,
-    # so we can just treat them as "internal" rather than as a contractor.
-    # This may change in the future.
-    internal_institutions = set(("edX", "Arbisoft"))
-    return (
-        author in people and
-        people[author].get("institution") in internal_institutions and
-        people[author].get("expires_on", date.max) > created_at.date()
-    )
+    return classify_pull_request(pull_request) == INTERNAL
 
 
 def is_contractor_pull_request(pull_request):
@@ -215,18 +321,12 @@ def is_contractor_pull_request(pull_request):
     falls under edX's contract, or if it should be treated as a pull request
     from the community.
     """
-    people = get_people_file()
-    author = pull_request["user"]["login"].decode('utf-8')
-    created_at = parse_date(pull_request["created_at"]).replace(tzinfo=None)
-    contracting_orgs = set(("BNOTIONS", "OpenCraft", "ExtensionEngine"))
-    return (
-        author in people and
-        people[author].get("institution") in contracting_orgs and
-        people[author].get("expires_on", date.max) > created_at.date()
-    )
+    return classify_pull_request(pull_request) == CONTRACTOR
 
 
-def pr_opened(pr, ignore_internal=True, check_contractor=True, bugsnag_context=None):
+@task(key=lambda pr, **kwargs: pull_request_key(pr), pass_attempt=True)
+def pr_opened(pr, ignore_internal=True, check_contractor=True, bugsnag_context=None,
+              attempt=1):
     bugsnag_context = bugsnag_context or {}
     user = pr["user"]["login"].decode('utf-8')
     repo = pr["base"]["repo"]["full_name"]
@@ -255,7 +355,18 @@ def pr_opened(pr, ignore_internal=True, check_contractor=True, bugsnag_context=N
         return "contractor pull request"
 
     issue_key = get_jira_issue_key(pr)
+    repo = pr["base"]["repo"]["full_name"].decode('utf-8')
+    people = get_people_index()
+    person = people.get(user)
     if issue_key:
+        indexed = PullRequestIssue.query.filter_by(repo=repo, number=num).first()
+        if indexed and not (indexed.commented and indexed.labeled):
+            # an earlier attempt created the issue, but didn't get to finish
+            in_authors_file = False
+            if person and person.name:
+                in_authors_file = is_in_authors_file(pr, person.name)
+            follow_up_new_issue(pr, issue_key, people, in_authors_file, resuming=True)
+            return "finished {key}".format(key=issue_key)
         msg = "Already created {key} for PR #{num} against {repo}".format(
             key=issue_key,
             num=pr["number"],
@@ -264,18 +375,13 @@ def pr_opened(pr, ignore_internal=True, check_contractor=True, bugsnag_context=N
         print(msg, file=sys.stderr)
         return msg
 
-    repo = pr["base"]["repo"]["full_name"].decode('utf-8')
-    people = get_people_file()
+    # these lookups don't depend on each other, so do them at the same time
+    user_name_call = None if person else run_async(github_user_name, pr["user"])
+    in_authors_call = None
+    if person and person.name:
+        in_authors_call = run_async(is_in_authors_file, pr, person.name)
     custom_fields = get_jira_custom_fields()
-
-    if user in people:
-        user_name = people[user].get("name", "")
-    else:
-        user_resp = github.get(pr["user"]["url"])
-        if user_resp.ok:
-            user_name = user_resp.json().get("name", user)
-        else:
-            user_name = user
+    user_name = person.name if person else user_name_call.get()
 
     # create an issue on JIRA!
     new_issue = {
@@ -294,35 +400,34 @@ def pr_opened(pr, ignore_internal=True, check_contractor=True, bugsnag_context=N
             custom_fields["Contributor Name"]: user_name,
         }
     }
-    institution = people.get(user, {}).get("institution", None)
-    if institution:
-        new_issue["fields"][custom_fields["Customer"]] = [institution]
+    if person and person.institution:
+        new_issue["fields"][custom_fields["Customer"]] = [person.institution]
     bugsnag_context["new_issue"] = new_issue
     bugsnag.configure_request(meta_data=bugsnag_context)
 
-    resp = jira.post("/rest/api/2/issue", json=new_issue)
-    if not resp.ok:
-        raise requests.exceptions.RequestException(resp.text)
-    new_issue_body = resp.json()
-    issue_key = new_issue_body["key"].decode('utf-8')
+    # an earlier attempt may have created the issue even though it failed,
+    # if its request timed out after JIRA got it; the search is slow, so
+    # only look when there was an earlier attempt
+    issue_key = find_jira_issue_for_pull_request(pr, custom_fields) if attempt > 1 else None
+    if issue_key:
+        print(
+            "Found {key} for PR #{num} against {repo}, created by an earlier attempt".format(
+                key=issue_key, num=pr["number"], repo=repo,
+            ),
+            file=sys.stderr
+        )
+    else:
+        resp = jira.post("/rest/api/2/issue", json=new_issue)
+        if not resp.ok:
+            raise requests.exceptions.RequestException(resp.text)
+        issue_key = resp.json()["key"].decode('utf-8')
     bugsnag_context["new_issue"]["key"] = issue_key
     bugsnag.configure_request(meta_data=bugsnag_context)
-    # add a comment to the Github pull request with a link to the JIRA issue
-    comment = {
-        "body": github_community_pr_comment(pr, new_issue_body, people),
-    }
-    url = "/repos/{repo}/issues/{num}/comments".format(
-        repo=repo, num=pr["number"],
+    save_jira_issue_key(repo, pr["number"], issue_key, commented=False, labeled=False)
+    follow_up_new_issue(
+        pr, issue_key, people,
+        in_authors_file=in_authors_call.get() if in_authors_call else False,
     )
-    comment_resp = github.post(url, json=comment)
-    if not comment_resp.ok:
-        raise requests.exceptions.RequestException(comment_resp.text)
-
-    # Add the "Needs Triage" label to the PR
-    issue_url = "/repos/{repo}/issues/{num}".format(repo=repo, num=pr["number"])
-    label_resp = github.patch(issue_url, data=json.dumps({"labels": ["needs triage"]}))
-    if not label_resp.ok:
-        raise requests.exceptions.RequestException(label_resp.text)
 
     print(
         "@{user} opened PR #{num} against {repo}, created {issue} to track it".format(
@@ -334,6 +439,84 @@ def pr_opened(pr, ignore_internal=True, check_contractor=True, bugsnag_context=N
     return "created {key}".format(key=issue_key)
 
 
+def find_jira_issue_for_pull_request(pull_request, custom_fields):
+    """
+    Search JIRA for an OSPR issue that tracks this pull request, and return
+    its key, or None.
+    """
+    repo = pull_request["base"]["repo"]["full_name"]
+    # JQL refers to custom fields as cf[12345]
+    pr_number_field = custom_fields["PR Number"].replace("customfield_", "")
+    jql = "project = OSPR AND cf[{field}] = {num}".format(
+        field=pr_number_field, num=pull_request["number"],
+    )
+    resp = jira.get("/rest/api/2/search", params={
+        "jql": jql, "fields": custom_fields["Repo"],
+    })
+    if not resp.ok:
+        raise requests.exceptions.RequestException(resp.text)
+    for issue in resp.json()["issues"]:
+        if issue["fields"].get(custom_fields["Repo"]) == repo:
+            return issue["key"].decode('utf-8')
+    return None
+
+
+def follow_up_new_issue(pull_request, issue_key, people, in_authors_file, resuming=False):
+    """
+    Comment on the pull request with a link to its new JIRA issue, and add
+    the "needs triage" label, unless the index says that has been done.
+    Each step is recorded in the index as soon as it has worked, so that a
+    retry only does what's missing. When ``resuming``, the comment is only
+    posted if the pull request doesn't have it yet: the earlier attempt may
+    have timed out after Github got it.
+    """
+    repo = pull_request["base"]["repo"]["full_name"].decode('utf-8')
+    num = pull_request["number"]
+    indexed = PullRequestIssue.query.filter_by(repo=repo, number=num).first()
+    commented, labeled = indexed.commented, indexed.labeled
+    if not commented and resuming and find_jira_issue_key_in_comments(pull_request) == issue_key:
+        commented = True
+
+    comment_call = None
+    if not commented:
+        comment = {
+            "body": github_community_pr_comment(
+                pull_request, {"key": issue_key}, people, in_authors_file=in_authors_file,
+            ),
+        }
+        url = "/repos/{repo}/issues/{num}/comments".format(repo=repo, num=num)
+        comment_call = run_async(github.post, url, json=comment)
+
+    # Add the "Needs Triage" label to the PR, while the comment is posted
+    errors = []
+    if not labeled:
+        issue_url = "/repos/{repo}/issues/{num}".format(repo=repo, num=num)
+        try:
+            label_resp = github.patch(issue_url, data=json.dumps({"labels": ["needs triage"]}))
+        except requests.exceptions.RequestException as err:
+            errors.append(err)
+        else:
+            labeled = label_resp.ok
+            if not label_resp.ok:
+                errors.append(requests.exceptions.RequestException(label_resp.text))
+    if comment_call:
+        try:
+            comment_resp = comment_call.get()
+        except requests.exceptions.RequestException as err:
+            errors.append(err)
+        else:
+            commented = comment_resp.ok
+            if not comment_resp.ok:
+                errors.append(requests.exceptions.RequestException(comment_resp.text))
+
+    # record what worked before giving up on what didn't
+    indexed.commented, indexed.labeled = commented, labeled
+    db.session.commit()
+    if errors:
+        raise errors[0]
+
+
+@task(key=lambda pr, **kwargs: pull_request_key(pr))
 def pr_closed(pr, bugsnag_context=None):
     bugsnag_context = bugsnag_context or {}
     repo = pr["base"]["repo"]["full_name"].decode('utf-8')
@@ -356,40 +539,36 @@ def pr_closed(pr, bugsnag_context=None):
         "/rest/api/2/issue/{key}/transitions"
         "?expand=transitions.fields".format(key=issue_key)
     )
-    transitions_resp = jira.get(transition_url)
-    if not transitions_resp.ok:
-        raise requests.exceptions.RequestException(transitions_resp.text)
+    transition_name = "Merged" if merged else "Rejected"
 
-    transitions = transitions_resp.json()["transitions"]
+    def choose(transitions):
+        for t in transitions:
+            if t["to"]["name"] == transition_name:
+                return t["id"]
+        return None
+
+    # the transitions it can make depend on its type and current status
+    issue_resp = jira.get("/rest/api/2/issue/{key}".format(key=issue_key))
+    if not issue_resp.ok:
+        raise requests.exceptions.RequestException(issue_resp.text)
+    issue = issue_resp.json()
+    bugsnag_context["jira_issue"] = issue
+    bugsnag.configure_request(meta_data=bugsnag_context)
+    current_status = issue["fields"]["status"]["name"].decode("utf-8")
+    if current_status == transition_name:
+        msg = "{key} is already in status {status}".format(
+            key=issue_key, status=transition_name
+        )
+        print(msg, file=sys.stderr)
+        return "nothing to do!"
 
+    transition_resp, transitions = transition_issue(
+        transition_url, transition_cache_key(issue), choose,
+    )
     bugsnag_context["transitions"] = transitions
     bugsnag.configure_request(meta_data=bugsnag_context)
 
-    transition_name = "Merged" if merged else "Rejected"
-    transition_id = None
-    for t in transitions:
-        if t["to"]["name"] == transition_name:
-            transition_id = t["id"]
-            break
-
-    if not transition_id:
-        # maybe the issue is *already* in the right status?
-        issue_url = "/rest/api/2/issue/{key}".format(key=issue_key)
-        issue_resp = jira.get(issue_url)
-        if not issue_resp.ok:
-            raise requests.exceptions.RequestException(issue_resp.text)
-        issue = issue_resp.json()
-        bugsnag_context["jira_issue"] = issue
-        bugsnag.configure_request(meta_data=bugsnag_context)
-        current_status = issue["fields"]["status"]["name"].decode("utf-8")
-        if current_status == transition_name:
-            msg = "{key} is already in status {status}".format(
-                key=issue_key, status=transition_name
-            )
-            print(msg, file=sys.stderr)
-            return "nothing to do!"
-
-        # nope, raise an error message
+    if transition_resp is None:
         fail_msg = (
             "{key} cannot be transitioned directly from status {curr_status} "
             "to status {new_status}. Valid status transitions are: {valid}".format(
@@ -400,11 +579,6 @@ def pr_closed(pr, bugsnag_context=None):
         )
         raise Exception(fail_msg)
 
-    transition_resp = jira.post(transition_url, json={
-        "transition": {
-            "id": transition_id,
-        }
-    })
     if not transition_resp.ok:
         raise requests.exceptions.RequestException(transition_resp.text)
     print(
@@ -418,13 +592,57 @@ def pr_closed(pr, bugsnag_context=None):
 
 
 def get_jira_issue_key(pull_request):
+    """
+    Return the key of the JIRA issue that tracks this pull request, or None.
+
+    The key is looked up in the :class:`~openedx_webhooks.models.PullRequestIssue`
+    index. Pull requests from before the index existed are found by searching
+    their comments, and then added to the index.
+    """
+    repo = pull_request["base"]["repo"]["full_name"].decode('utf-8')
+    num = pull_request["number"]
+    issue = PullRequestIssue.query.filter_by(repo=repo, number=num).first()
+    if issue:
+        return issue.issue_key
+    issue_key = find_jira_issue_key_in_comments(pull_request)
+    if issue_key:
+        save_jira_issue_key(repo, num, issue_key)
+    return issue_key
+
+
+def save_jira_issue_key(repo, num, issue_key, **values):
+    """
+    Record in the index that this JIRA issue tracks this pull request.
+    ``values`` sets other columns, like ``commented``.
+    """
+    issue = PullRequestIssue.query.filter_by(repo=repo, number=num).first()
+    if issue:
+        issue.issue_key = issue_key
+        for name, value in values.items():
+            setattr(issue, name, value)
+    else:
+        db.session.add(PullRequestIssue(repo=repo, number=num, issue_key=issue_key, **values))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # someone else indexed this pull request at the same time
+        db.session.rollback()
+
+
+def find_jira_issue_key_in_comments(pull_request):
+    """
+    Search the comments on this pull request for a JIRA issue key
+    mentioned by this bot. This is slow: it makes one API request for
+    every 100 comments.
+    """
     me = github_whoami()
     my_username = me["login"]
     comment_url = "/repos/{repo}/issues/{num}/comments".format(
         repo=pull_request["base"]["repo"]["full_name"].decode('utf-8'),
         num=pull_request["number"],
     )
-    for comment in paginated_get(comment_url, session=github):
+    # the bot's comment is usually on the first page
+    for comment in paginated_get(comment_url, session=github, sequential=True):
         # I only care about comments I made
         if comment["user"]["login"] != my_username:
             continue
@@ -435,7 +653,54 @@ def get_jira_issue_key(pull_request):
     return None
 
 
-def github_community_pr_comment(pull_request, jira_issue, people=None):
+def backfill_jira_issue_keys(repo, state="all"):
+    """
+    Add the existing pull requests in this repo to the pull request to JIRA
+    issue index, by searching their comments. Returns a dict of pull request
+    number to JIRA issue key, for the pull requests that were added.
+    """
+    indexed = {
+        issue.number
+        for issue in PullRequestIssue.query.filter_by(repo=repo)
+    }
+    url = "/repos/{repo}/pulls?state={state}".format(repo=repo, state=state)
+    found = {}
+    for pull_request in paginated_get(url, session=github):
+        if pull_request["number"] in indexed:
+            continue
+        issue_key = find_jira_issue_key_in_comments(pull_request)
+        if issue_key:
+            save_jira_issue_key(repo, pull_request["number"], issue_key)
+            found[pull_request["number"]] = issue_key
+    return found
+
+
+def github_user_name(user):
+    """
+    Return the name on this Github user's profile, or their username if
+    they don't have one.
+    """
+    login = user["login"].decode('utf-8')
+    user_resp = github.get(user["url"])
+    if user_resp.ok:
+        return user_resp.json().get("name", login)
+    return login
+
+
+def is_in_authors_file(pull_request, name):
+    """
+    Is this name in the AUTHORS file on the pull request's branch?
+    """
+    authors_url = "https://raw.githubusercontent.com/{repo}/{branch}/AUTHORS".format(
+        repo=pull_request["head"]["repo"]["full_name"].decode('utf-8'),
+        branch=pull_request["head"]["ref"].decode('utf-8'),
+    )
+    authors_resp = github.get(authors_url)
+    return authors_resp.ok and name in authors_resp.text
+
+
+def github_community_pr_comment(pull_request, jira_issue, people_index=None,
+                                in_authors_file=None):
     """
     For a newly-created pull request from an open source contributor,
     write a welcoming comment on the pull request. The comment should:
@@ -444,29 +709,18 @@ def github_community_pr_comment(pull_request, jira_issue, people=None):
     * check for contributor agreement
     * check for AUTHORS entry
     * contain a link to our process documentation
+
+    Pass ``in_authors_file`` if you have already checked the AUTHORS file.
     """
-    people = people or get_people_file()
-    people = {user.lower(): values for user, values in people.items()}
-    pr_author = pull_request["user"]["login"].decode('utf-8').lower()
-    created_at = parse_date(pull_request["created_at"]).replace(tzinfo=None)
+    people = people_index or get_people_index()
+    pr_author = pull_request["user"]["login"].decode('utf-8')
+    person = people.get(pr_author)
     # does the user have a valid, signed contributor agreement?
-    has_signed_agreement = (
-        pr_author in people and
-        people[pr_author].get("expires_on", date.max) > created_at.date()
-    )
+    has_signed_agreement = people.has_agreement(pr_author, pull_request_date(pull_request))
     # is the user in the AUTHORS file?
-    in_authors_file = False
-    name = people.get(pr_author, {}).get("name", "")
-    if name:
-        authors_url = "https://raw.githubusercontent.com/{repo}/{branch}/AUTHORS".format(
-            repo=pull_request["head"]["repo"]["full_name"].decode('utf-8'),
-            branch=pull_request["head"]["ref"].decode('utf-8'),
-        )
-        authors_resp = github.get(authors_url)
-        if authors_resp.ok:
-            authors_content = authors_resp.text
-            if name in authors_content:
-                in_authors_file = True
+    name = person.name if person else ""
+    if in_authors_file is None:
+        in_authors_file = bool(name) and is_in_authors_file(pull_request, name)
 
     doc_url = "http://edx-developer-guide.readthedocs.org/en/latest/process/overview.html"
     issue_key = jira_issue["key"].decode('utf-8')
@@ -559,18 +813,18 @@ def github_check_contributors():
     else:
         repos = get_repos_file().keys()
 
-    people = get_people_file()
-    people_lower = {username.lower() for username in people.keys()}
+    people = get_people_index()
 
     missing_contributors = defaultdict(set)
-    for repo in repos:
-        bugsnag_context = {"repo": repo}
-        bugsnag.configure_request(meta_data=bugsnag_context)
-        contributors_url = "/repos/{repo}/contributors".format(repo=repo)
-        contributors = paginated_get(contributors_url, session=github)
-        for contributor in contributors:
-            if contributor["login"].lower() not in people_lower:
-                missing_contributors[repo].add(contributor["login"])
+    with background_priority():
+        for repo in repos:
+            bugsnag_context = {"repo": repo}
+            bugsnag.configure_request(meta_data=bugsnag_context)
+            contributors_url = "/repos/{repo}/contributors".format(repo=repo)
+            contributors = paginated_get(contributors_url, session=github)
+            for contributor in contributors:
+                if not people.lists(contributor["login"]):
+                    missing_contributors[repo].add(contributor["login"])
 
     # convert sets to lists, so jsonify can handle them
     output = {
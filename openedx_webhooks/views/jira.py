@@ -5,26 +5,34 @@ These are the views that process webhook events coming from JIRA.
 
 from __future__ import unicode_literals, print_function
 
+import os
 import sys
 import json
+import math
 import re
+from datetime import datetime
 from collections import defaultdict
 
 import bugsnag
 import requests
 from urlobject import URLObject
-from flask import request, render_template, make_response, jsonify
+from flask import request, render_template, jsonify
 from flask_dance.contrib.jira import jira
 from flask_dance.contrib.github import github
 from openedx_webhooks import app
+from openedx_webhooks.deliveries import is_duplicate_delivery, duplicate_response
+from openedx_webhooks.jobs import task, enqueue, accepted
+from openedx_webhooks.locks import keyed_lock, jira_issue_key
+from openedx_webhooks.models import RescanWatermark
+from openedx_webhooks.cache import make_shared_cache
 from openedx_webhooks.oauth import jira_get
 from openedx_webhooks.utils import (
-    pop_dict_id, memoize, jira_paginated_get, to_unicode,
-    jira_users, jira_group_members
+    pop_dict_id, cached, paginated_get, jira_paginated_get, to_unicode, truthy,
+    jira_users, jira_group_members, TTLCache, shared_get, shared_set
 )
 
 
-@memoize
+@cached(maxsize=1, ttl=60 * 60, shared=make_shared_cache("jira"))
 def get_jira_custom_fields():
     """
     Return a name-to-id mapping for the custom fields on JIRA.
@@ -40,41 +48,92 @@ def get_jira_custom_fields():
     }
 
 
-@memoize
+@cached(maxsize=256, ttl=5 * 60, negative=None, negative_ttl=60)
 def get_jira_issue(key):
-    return jira_get("/rest/api/2/issue/{key}".format(key=key))
+    """
+    Return the JSON for the JIRA issue with this key, or None if it
+    doesn't exist.
+    """
+    issue_resp = jira_get("/rest/api/2/issue/{key}".format(key=key))
+    if issue_resp.status_code == 404:
+        return None
+    if not issue_resp.ok:
+        raise requests.exceptions.RequestException(issue_resp.text)
+    return issue_resp.json()
 
 
 @app.route("/jira/issue/rescan", methods=("GET", "POST"))
 def jira_rescan_issues():
+    """
+    Process the issues that match a JQL query, as if they had just been
+    created. Only issues updated since the last rescan with the same query
+    are processed, unless ``full`` is set. :func:`jira_rescan_users` makes
+    the next rescan a full one when it changes anyone's groups, since that
+    can change what should happen to issues that haven't been updated.
+
+    Rescanning many issues takes longer than a web request may, so the
+    rescan is queued as a job, see :func:`rescan_issues`.
+    """
     if request.method == "GET":
         # just render the form
         return render_template("jira_rescan_issues.html")
     jql = request.form.get("jql") or 'status = "Needs Triage" ORDER BY key'
-    bugsnag_context = {"jql": jql}
+    full = truthy(request.form.get("full"))
+    return accepted(enqueue(rescan_issues, jql, full=full))
+
+
+# one rescan at a time: two at once would only get in each other's way
+@task(key=lambda *args, **kwargs: "jira-rescan")
+def rescan_issues(jql, full=False):
+    """
+    The job that `jira_rescan_issues` queues. Returns what happened to each
+    issue, as JSON.
+    """
+    started_at = datetime.utcnow()
+    since = None if full else RescanWatermark.get("jira", jql)
+    search_jql = jql_updated_since(jql, since) if since else jql
+    bugsnag_context = {"jql": search_jql}
     bugsnag.configure_request(meta_data=bugsnag_context)
     issues = jira_paginated_get(
-        "/rest/api/2/search", jql=jql, obj_name="issues", session=jira,
+        "/rest/api/2/search", jql=search_jql, obj_name="issues", session=jira,
     )
     results = {}
 
     for issue in issues:
         issue_key = to_unicode(issue["key"])
-        results[issue_key] = issue_opened(issue)
+        with keyed_lock(jira_issue_key(issue)):
+            results[issue_key] = issue_opened(issue)
 
-    resp = make_response(json.dumps(results), 200)
-    resp.headers["Content-Type"] = "application/json"
-    return resp
+    RescanWatermark.set("jira", jql, started_at)
+    return json.dumps(results)
+
+
+def jql_updated_since(jql, since):
+    """
+    Restrict a JQL query to issues updated since the given UTC datetime.
+    JQL interprets absolute dates in the JIRA user's timezone, so we use a
+    relative date instead, rounded up to the next minute.
+    """
+    minutes = int(math.ceil((datetime.utcnow() - since).total_seconds() / 60)) + 1
+    updated = "updated >= -{minutes}m".format(minutes=minutes)
+    # the condition has to go before the ORDER BY clause, if there is one
+    match = re.search(r"\bORDER\s+BY\b", jql, flags=re.IGNORECASE)
+    if match:
+        where, order_by = jql[:match.start()].strip(), " " + jql[match.start():]
+    else:
+        where, order_by = jql.strip(), ""
+    if where:
+        return "({where}) AND {updated}{order_by}".format(
+            where=where, updated=updated, order_by=order_by,
+        )
+    return updated + order_by
 
 
 @app.route("/jira/issue/created", methods=("POST",))
 def jira_issue_created():
     """
     Received an "issue created" event from JIRA. See `JIRA's webhook docs`_.
-
-    Ideally, this should be handled in a task queue, but we want to stay within
-    Heroku's free plan, so it will be handled inline instead.
-    (A worker dyno costs money.)
+    The actual work is queued, and done by ``manage.py worker``.
 
     .. _JIRA's webhook docs: https://developer.atlassian.com/display/JIRADEV/JIRA+Webhooks+Overview
     """
@@ -99,7 +158,83 @@ def jira_issue_created():
         # If we don't have an "issue" key, it's junk.
         return "What is this shit!?", 400
 
-    return issue_opened(event["issue"], bugsnag_context)
+    if is_duplicate_delivery("jira"):
+        return duplicate_response("jira")
+
+    return accepted(enqueue(issue_opened, event["issue"]))
+
+
+# How long to remember which groups a user is in. The groups are kept in the
+# shared cache, so that the worker, which decides whether issues need triage,
+# sees the changes that `jira_rescan_users` makes in the web process. Each
+# process only keeps them itself for a minute, since it can't be told when
+# another process changes them.
+USER_GROUPS_TTL = int(os.environ.get("JIRA_USER_GROUPS_TTL", 60 * 60))
+USER_GROUPS_LOCAL_TTL = min(USER_GROUPS_TTL, 60)
+# username -> set of names of the groups the user is in
+USER_GROUPS_CACHE = TTLCache(
+    ttl=USER_GROUPS_LOCAL_TTL,
+    maxsize=1000,
+    name="jira_user_groups",
+)
+SHARED_USER_GROUPS_CACHE = make_shared_cache("jira_user_groups")
+
+
+def cached_user_groups(username):
+    """
+    Return the groups we remember this user being in, or None.
+    """
+    user_groups = USER_GROUPS_CACHE.get(username)
+    if user_groups is not None or SHARED_USER_GROUPS_CACHE is None:
+        return user_groups
+    group_names, remaining, found = shared_get(SHARED_USER_GROUPS_CACHE, username)
+    if not found:
+        return None
+    USER_GROUPS_CACHE.count("shared_hits")
+    user_groups = set(group_names)
+    USER_GROUPS_CACHE.set(username, user_groups, ttl=min(remaining, USER_GROUPS_LOCAL_TTL))
+    return user_groups
+
+
+def remember_user_groups(username, user_groups):
+    """
+    Remember the complete set of groups that this user is in.
+    """
+    USER_GROUPS_CACHE.set(username, set(user_groups))
+    if SHARED_USER_GROUPS_CACHE is not None:
+        shared_set(
+            SHARED_USER_GROUPS_CACHE, username, sorted(user_groups), ttl=USER_GROUPS_TTL,
+        )
+
+
+def get_user_groups(user):
+    """
+    Return the names of the JIRA groups that this user is in. ``user`` is
+    a user reference from an issue, like the creator.
+    """
+    username = to_unicode(user["name"])
+    user_groups = cached_user_groups(username)
+    if user_groups is not None:
+        return user_groups
+
+    user_url = URLObject(user["self"]).set_query_param("expand", "groups")
+    user_resp = jira_get(user_url)
+    if not user_resp.ok:
+        raise requests.exceptions.RequestException(user_resp.text)
+    user_groups = {g["name"] for g in user_resp.json()["groups"]["items"]}
+    remember_user_groups(username, user_groups)
+    return user_groups
+
+
+def user_added_to_group(username, groupname):
+    """
+    Add a group to the ones we remember this user being in. If we don't
+    remember any, there's nothing to add to: we only know this one group,
+    not all of them.
+    """
+    user_groups = cached_user_groups(username)
+    if user_groups is not None:
+        remember_user_groups(username, user_groups | {groupname})
 
 
 def should_transition(issue):
@@ -133,16 +268,7 @@ def should_transition(issue):
         )
         return False
 
-    user_url = URLObject(issue["fields"]["creator"]["self"])
-    user_url = user_url.set_query_param("expand", "groups")
-
-    user_resp = jira_get(user_url)
-    if not user_resp.ok:
-        raise requests.exceptions.RequestException(user_resp.text)
-
-    user = user_resp.json()
-    user_group_map = {g["name"]: g["self"] for g in user["groups"]["items"]}
-    user_groups = set(user_group_map)
+    user_groups = get_user_groups(issue["fields"]["creator"])
 
     exempt_groups = {
         # group name: set of projects that they can create non-triage issues
@@ -162,6 +288,88 @@ def should_transition(issue):
     return False
 
 
+# Which transitions an issue can make only depends on its workflow and its
+# current status, so we cache them by (project, issue type, status).
+TRANSITIONS_CACHE = TTLCache(ttl=24 * 60 * 60, maxsize=256, name="jira_transitions")
+
+
+def fetch_transitions(transitions_url):
+    transitions_resp = jira_get(transitions_url)
+    if not transitions_resp.ok:
+        raise requests.exceptions.RequestException(transitions_resp.text)
+    return transitions_resp.json()["transitions"]
+
+
+def transition_cache_key(issue):
+    """
+    The key for the transitions that this issue can make, in TRANSITIONS_CACHE.
+    """
+    return (
+        to_unicode(issue["fields"]["project"]["key"]),
+        to_unicode(issue["fields"]["issuetype"]["name"]),
+        to_unicode(issue["fields"]["status"]["name"]),
+    )
+
+
+def is_invalid_transition(resp):
+    """
+    Did JIRA refuse a transition because the issue can't make it? JIRA says
+    so either as an error for the "transition" field, or as an error message
+    about the workflow.
+    """
+    if resp.status_code != 400:
+        return False
+    try:
+        errors = resp.json()
+    except ValueError:
+        return False
+    if not isinstance(errors, dict):
+        return False
+    if "transition" in (errors.get("errors") or {}):
+        return True
+    return any(
+        "workflow operation" in message
+        for message in errors.get("errorMessages") or ()
+    )
+
+
+def transition_issue(transitions_url, cache_key, choose):
+    """
+    Move an issue through a workflow transition. ``choose`` is called with
+    the list of transitions the issue can make, and returns the ID of the
+    one to make, or None if there isn't a suitable one.
+
+    The transitions are looked up in TRANSITIONS_CACHE under ``cache_key``
+    first, so that usually this is a single POST. If JIRA refuses the cached
+    transition, the cache entry is dropped and the real transitions are
+    fetched.
+
+    Returns the response to the POST (or None if ``choose`` didn't find a
+    transition), and the transitions that ``choose`` was given.
+    """
+    transitions = TRANSITIONS_CACHE.get(cache_key)
+    if transitions is not None:
+        transition_id = choose(transitions)
+        if transition_id:
+            transition_resp = jira.post(transitions_url, json={
+                "transition": {"id": transition_id},
+            })
+            if not is_invalid_transition(transition_resp):
+                return transition_resp, transitions
+        TRANSITIONS_CACHE.delete(cache_key)
+
+    transitions = fetch_transitions(transitions_url)
+    TRANSITIONS_CACHE.set(cache_key, transitions)
+    transition_id = choose(transitions)
+    if not transition_id:
+        return None, transitions
+    transition_resp = jira.post(transitions_url, json={
+        "transition": {"id": transition_id},
+    })
+    return transition_resp, transitions
+
+
+@task(key=lambda issue, **kwargs: jira_issue_key(issue))
 def issue_opened(issue, bugsnag_context=None):
     bugsnag_context = bugsnag_context or {}
     bugsnag_context = {"issue": issue}
@@ -173,23 +381,20 @@ def issue_opened(issue, bugsnag_context=None):
     transitioned = False
     if should_transition(issue):
         transitions_url = issue_url.with_path(issue_url.path + "/transitions")
-        transitions_resp = jira_get(transitions_url)
-        if not transitions_resp.ok:
-            raise requests.exceptions.RequestException(transitions_resp.text)
-        transitions = {t["name"]: t["id"] for t in transitions_resp.json()["transitions"]}
-        if "Open" in transitions:
-            new_status = "Open"
-        elif "Design Backlog" in transitions:
-            new_status = "Design Backlog"
-        else:
-            raise ValueError("No valid transition! Possibilities are {}".format(transitions.keys()))
-
-        body = {
-            "transition": {
-                "id": transitions[new_status],
-            }
-        }
-        transition_resp = jira.post(transitions_url, json=body)
+        cache_key = transition_cache_key(issue)
+
+        def choose(transitions):
+            transition_ids = {t["name"]: t["id"] for t in transitions}
+            for new_status in ("Open", "Design Backlog"):
+                if new_status in transition_ids:
+                    return transition_ids[new_status]
+            return None
+
+        transition_resp, transitions = transition_issue(transitions_url, cache_key, choose)
+        if transition_resp is None:
+            raise ValueError("No valid transition! Possibilities are {}".format(
+                [t["name"] for t in transitions]
+            ))
         if not transition_resp.ok:
             raise requests.exceptions.RequestException(transition_resp.text)
         transitioned = True
@@ -214,7 +419,8 @@ def github_pr_repo(issue):
     parent_ref = parent_ref = issue["fields"].get("parent")
     if not pr_repo and parent_ref:
         parent = get_jira_issue(parent_ref["key"])
-        pr_repo = parent["fields"].get(custom_fields["Repo"])
+        if parent:
+            pr_repo = parent["fields"].get(custom_fields["Repo"])
     return pr_repo
 
 
@@ -224,7 +430,8 @@ def github_pr_num(issue):
     parent_ref = parent_ref = issue["fields"].get("parent")
     if not pr_num and parent_ref:
         parent = get_jira_issue(parent_ref["key"])
-        pr_num = parent["fields"].get(custom_fields["PR Number"])
+        if parent:
+            pr_num = parent["fields"].get(custom_fields["PR Number"])
     try:
         return int(pr_num)
     except:
@@ -249,6 +456,7 @@ def github_pr_url(issue):
 def jira_issue_updated():
     """
     Received an "issue updated" event from JIRA. See `JIRA's webhook docs`_.
+    The actual work is queued, and done by ``manage.py worker``.
 
     .. _JIRA's webhook docs: https://developer.atlassian.com/display/JIRADEV/JIRA+Webhooks+Overview
     """
@@ -273,6 +481,20 @@ def jira_issue_updated():
         # If we don't have an "issue" key, it's junk.
         return "What is this shit!?", 400
 
+    if is_duplicate_delivery("jira"):
+        return duplicate_response("jira")
+
+    return accepted(enqueue(issue_updated, event))
+
+
+@task(key=lambda event, **kwargs: jira_issue_key(event["issue"]), pass_attempt=True)
+def issue_updated(event, attempt=1):
+    """
+    Handle an "issue updated" event queued by :func:`jira_issue_updated`.
+    """
+    bugsnag_context = {"event": event}
+    bugsnag.configure_request(meta_data=bugsnag_context)
+
     # is this a comment?
     comment = event.get("comment")
     if comment:
@@ -315,7 +537,7 @@ def jira_issue_updated():
 
     changes = []
     if new_status == "Rejected":
-        change = jira_issue_rejected(event["issue"], bugsnag_context)
+        change = jira_issue_rejected(event["issue"], bugsnag_context, resuming=attempt > 1)
         changes.append(change)
 
     if new_status.lower() in repo_labels_lower:
@@ -328,7 +550,14 @@ def jira_issue_updated():
         return "no change necessary"
 
 
-def jira_issue_rejected(issue, bugsnag_context=None):
+def jira_issue_rejected(issue, bugsnag_context=None, resuming=False):
+    """
+    Explain on the pull request that it was rejected, and close it. The pull
+    request is only closed once the comment is posted, so that a retry knows
+    to do both until it's closed. When ``resuming``, the comment is only
+    posted if the pull request doesn't have it yet: the earlier attempt may
+    have timed out after Github got it.
+    """
     bugsnag_context = bugsnag_context or {}
     issue_key = to_unicode(issue["key"])
 
@@ -357,24 +586,36 @@ def jira_issue_rejected(issue, bugsnag_context=None):
         "review of your submission at this time. Please see the "
         "associated JIRA ticket for more explanation.".format(username=username)
     )}
-    comment_resp = github.post(issue_url + "/comments", json=comment)
+    if not (resuming and has_comment(issue_url, comment["body"])):
+        comment_resp = github.post(issue_url + "/comments", json=comment)
+        if not comment_resp.ok:
+            raise_for_github_response(
+                comment_resp, "Failed to comment on the PR; ", bugsnag_context,
+            )
 
     # close the pull request on Github
     close_resp = github.patch(pr_url, json={"state": "closed"})
-    if not close_resp.ok or not comment_resp.ok:
-        bugsnag_context['request_headers'] = close_resp.request.headers
-        bugsnag_context['request_url'] = close_resp.request.url
-        bugsnag_context['request_method'] = close_resp.request.method
-        bugsnag.configure_request(meta_data=bugsnag_context)
-        bug_text = ''
-        if not close_resp.ok:
-            bug_text += "Failed to close; " + close_resp.text
-        if not comment_resp.ok:
-            bug_text += "Failed to comment on the PR; " + comment_resp.text
-        raise requests.exceptions.RequestException(bug_text)
+    if not close_resp.ok:
+        raise_for_github_response(close_resp, "Failed to close; ", bugsnag_context)
     return "Closed PR #{num}".format(num=pr_num)
 
 
+def has_comment(issue_url, body):
+    """
+    Does this Github issue or pull request have a comment with this body?
+    """
+    comments = paginated_get(issue_url + "/comments", session=github, sequential=True)
+    return any(comment["body"] == body for comment in comments)
+
+
+def raise_for_github_response(resp, bug_text, bugsnag_context):
+    bugsnag_context['request_headers'] = resp.request.headers
+    bugsnag_context['request_url'] = resp.request.url
+    bugsnag_context['request_method'] = resp.request.method
+    bugsnag.configure_request(meta_data=bugsnag_context)
+    raise requests.exceptions.RequestException(bug_text + resp.text)
+
+
 def jira_issue_status_changed(issue, changelog, bugsnag_context=None):
     bugsnag_context = bugsnag_context or {}
     pr_num = github_pr_num(issue)
@@ -512,6 +753,7 @@ def jira_rescan_users():
         return render_template("jira_rescan_users.html", domain_groups=domain_groups)
 
     failures = defaultdict(dict)
+    groups_changed = False
 
     requested_group = request.form.get("group")
     if requested_group:
@@ -524,7 +766,7 @@ def jira_rescan_users():
         requested_groups = domain_groups
 
     for groupname, domain in requested_groups.items():
-        users_in_group = jira_group_members(groupname, session=jira, debug=True)
+        users_in_group = jira_group_members(groupname, session=jira, debug=True, ordered=False)
         usernames_in_group = set(u["name"] for u in users_in_group)
         bugsnag_context = {
             "groupname": groupname,
@@ -542,9 +784,16 @@ def jira_rescan_users():
                     "/rest/api/2/group/user?groupname={}".format(groupname),
                     json={"name": username},
                 )
-                if not resp.ok:
+                if resp.ok:
+                    user_added_to_group(username, groupname)
+                    groups_changed = True
+                else:
                     failures[groupname][username] = resp.text
 
+    if groups_changed:
+        # issues that haven't been updated may need to be transitioned now
+        RescanWatermark.clear("jira")
+
     resp = jsonify(failures)
     resp.status_code = 502 if failures else 200
     return resp
@@ -0,0 +1,55 @@
+# coding=utf-8
+"""
+These are the views for looking after the job queue.
+"""
+
+from __future__ import unicode_literals, print_function
+
+from flask import request, jsonify, abort
+from openedx_webhooks import app
+from openedx_webhooks.auth import check_admin_token
+from openedx_webhooks.jobs import replay_dead_job, accepted
+from openedx_webhooks.models import DeadJob
+
+
+def dead_job_json(dead_job):
+    return {
+        "id": dead_job.id,
+        "job_id": dead_job.job_id,
+        "task": dead_job.task,
+        "key": dead_job.key,
+        "payload": dead_job.payload,
+        "attempts": dead_job.attempts,
+        "error": dead_job.error,
+        "created_at": dead_job.created_at.isoformat(),
+        "failed_at": dead_job.failed_at.isoformat(),
+        "replay_job_id": dead_job.replay_job_id,
+        "replayed_at": dead_job.replayed_at.isoformat() if dead_job.replayed_at else None,
+    }
+
+
+@app.route("/jobs/dead")
+def dead_jobs():
+    """
+    List the jobs that failed for good, most recent first. Jobs that have
+    been replayed are left out, unless ``all`` is set.
+    """
+    check_admin_token()
+    query = DeadJob.query
+    if not request.args.get("all"):
+        query = query.filter(DeadJob.replayed_at == None)
+    limit = request.args.get("limit", 100, type=int)
+    dead = query.order_by(DeadJob.failed_at.desc()).limit(limit)
+    return jsonify(jobs=[dead_job_json(dead_job) for dead_job in dead])
+
+
+@app.route("/jobs/dead/<int:dead_job_id>/replay", methods=("POST",))
+def replay_job(dead_job_id):
+    """
+    Queue a dead job again.
+    """
+    check_admin_token()
+    dead_job = DeadJob.query.get(dead_job_id)
+    if not dead_job:
+        abort(404)
+    return accepted(replay_dead_job(dead_job))
@@ -0,0 +1,108 @@
+# coding=utf-8
+"""
+Fill the caches that the first webhooks after a deploy would otherwise have
+to fill. Under gunicorn, this runs once in the master process before it forks
+the workers (see ``gunicorn_config.py``), so every worker starts out with the
+results.
+"""
+from __future__ import unicode_literals, print_function
+
+import sys
+import time
+import threading
+
+import bugsnag
+from openedx_webhooks.jobs import request_context
+from openedx_webhooks.models import db
+from openedx_webhooks.oauth import github_bp, jira_bp
+from openedx_webhooks.people import get_people_index
+from openedx_webhooks.remote_files import repos_file
+from openedx_webhooks.upstream import close_connections
+from openedx_webhooks.utils import pool_map
+from openedx_webhooks.views.github import github_whoami
+from openedx_webhooks.views.jira import get_jira_custom_fields
+
+
+# name -> function that fills a cache
+WARM_UP_TASKS = {
+    "jira_custom_fields": get_jira_custom_fields,
+    "github_whoami": github_whoami,
+    "people": get_people_index,
+    "repos": repos_file.get,
+}
+
+status = {
+    "started_at": None,
+    "finished_at": None,
+    # task name -> None if it worked, or the error
+    "errors": {},
+}
+_lock = threading.Lock()
+
+
+def warm_up(base_url=None):
+    """
+    Run the warm-up tasks in parallel. Failures are reported, but don't stop
+    anything: whatever failed is just fetched when it is first needed.
+    """
+    with _lock:
+        if status["started_at"] is not None:
+            return
+        status["started_at"] = time.time()
+
+    def run(name):
+        start = time.time()
+        try:
+            WARM_UP_TASKS[name]()
+        except Exception as err:
+            bugsnag.notify(err, meta_data={"warm_up": name})
+            return name, "{}".format(err), time.time() - start
+        return name, None, time.time() - start
+
+    try:
+        with request_context(base_url):
+            results = pool_map(run, sorted(WARM_UP_TASKS), concurrency=len(WARM_UP_TASKS))
+            for name, error, secs in results:
+                status["errors"][name] = error
+                print(
+                    "Warm-up {name}: {outcome} in {secs:.2f}s".format(
+                        name=name, outcome="failed ({})".format(error) if error else "done",
+                        secs=secs,
+                    ),
+                    file=sys.stderr,
+                )
+            # don't hand database connections down to forked processes
+            db.session.remove()
+            db.engine.dispose()
+            close_http_connections()
+    except Exception as err:
+        print("Warm-up failed: {err}".format(err=err), file=sys.stderr)
+        bugsnag.notify(err)
+    status["finished_at"] = time.time()
+    print(
+        "Warm-up finished in {secs:.2f}s".format(secs=status["finished_at"] - status["started_at"]),
+        file=sys.stderr,
+    )
+
+
+def close_http_connections():
+    """
+    Close the connections to Github and JIRA. Forked processes that shared
+    a kept-alive TLS connection would garble each other's requests.
+    """
+    close_connections(github_bp.session, jira_bp.session)
+
+
+def warm_up_in_background():
+    """
+    Start the warm-up in a separate thread, if it hasn't started yet.
+    """
+    if status["started_at"] is not None:
+        return
+    thread = threading.Thread(target=warm_up, name="warm-up")
+    thread.daemon = True
+    thread.start()
+
+
+def is_ready():
+    return status["finished_at"] is not None
@@ -0,0 +1,120 @@
+# coding=utf-8
+"""
+What the tests share: the environment that the app needs before it can be
+imported, and fake Github and JIRA sessions to run jobs against. Import
+this before anything from ``openedx_webhooks``.
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import json
+import tempfile
+import unittest
+
+_, DATABASE = tempfile.mkstemp(suffix=".db")
+for name, value in [
+        ("DATABASE_URL", "sqlite:///" + DATABASE), ("GITHUB_CLIENT_ID", "x"),
+        ("GITHUB_CLIENT_SECRET", "x"), ("JIRA_CONSUMER_KEY", "x"), ("JIRA_RSA_KEY", "x"),
+        ("SHARED_CACHE_BACKEND", "none"), ("TRACE_BACKEND", "memory")]:
+    os.environ.setdefault(name, value)
+
+from openedx_webhooks import app, jobs
+from openedx_webhooks.models import db, Job
+import openedx_webhooks.views.github as github_views
+import openedx_webhooks.views.jira as jira_views
+
+CUSTOM_FIELDS = ["URL", "PR Number", "Repo", "Contributor Name", "Customer"]
+
+
+class FakeRequest(object):
+    headers = {}
+    url = ""
+    method = ""
+
+
+class FakeResponse(object):
+    def __init__(self, data, status_code=200):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._data = data
+        self.text = json.dumps(data)
+        self.links = {}
+        self.url = ""
+        self.headers = {}
+        self.request = FakeRequest()
+
+    def json(self):
+        return self._data
+
+
+class FakeUpstream(object):
+    """
+    Github and JIRA in one. It knows JIRA's custom fields, and says yes to
+    everything else; tests override what they care about.
+    """
+    def field(self, name):
+        return "customfield_{}".format(CUSTOM_FIELDS.index(name))
+
+    def get(self, url, **kwargs):
+        if url.endswith("/field"):
+            return FakeResponse([
+                {"id": self.field(name), "name": name, "custom": True} for name in CUSTOM_FIELDS
+            ])
+        if url.endswith("/user"):
+            return FakeResponse({"login": "bot"})
+        if "/comments" in url:
+            return FakeResponse([])
+        return FakeResponse({"name": "Some One"})
+
+    def post(self, url, **kwargs):
+        return FakeResponse({}, status_code=201)
+
+    def patch(self, url, **kwargs):
+        return FakeResponse({})
+
+
+class JobTestCase(unittest.TestCase):
+    """
+    Runs queued jobs against ``upstream_class``, which replaces the views'
+    Github and JIRA sessions, with an empty database.
+    """
+    upstream_class = FakeUpstream
+
+    def setUp(self):
+        self.upstream = self.upstream_class()
+        self.patched = [
+            (module, name, getattr(module, name))
+            for module in (github_views, jira_views)
+            for name in ("github", "jira")
+        ]
+        for module, name, _ in self.patched:
+            setattr(module, name, self.upstream)
+        jira_views.get_jira_custom_fields.cache.clear()
+        github_views.github_whoami.cache.clear()
+        self.context = app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        self.context.pop()
+        for module, name, value in self.patched:
+            setattr(module, name, value)
+
+    def queue(self, func, *args, **kwargs):
+        with jobs.request_context():
+            return jobs.enqueue(func, *args, **kwargs).id
+
+    def run_attempt(self, job_id):
+        """
+        Run this job once, and return it as it is afterwards.
+        """
+        # what `claim_job` does, which needs Postgres
+        db.session.query(Job).filter_by(id=job_id).update({
+            "status": "running", "attempts": Job.attempts + 1,
+        })
+        db.session.commit()
+        jobs.run_job(job_id)
+        db.session.expire_all()
+        return Job.query.get(job_id)
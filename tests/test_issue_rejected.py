@@ -0,0 +1,84 @@
+# coding=utf-8
+"""
+Retrying a rejected OSPR issue's job after the pull request failed to close
+doesn't post the comment again.
+
+    $ python -m unittest discover tests
+"""
+from __future__ import unicode_literals, print_function
+
+import unittest
+
+from tests.helpers import FakeResponse, FakeUpstream, JobTestCase
+
+import openedx_webhooks.views.jira as jira_views
+
+
+class FakeGithub(FakeUpstream):
+    """
+    Github keeps the comments that are posted, and can be told to fail to
+    close the pull request.
+    """
+    def __init__(self):
+        self.comments = []
+        self.closed = False
+        self.fail_closing = False
+
+    def get(self, url, **kwargs):
+        if url.endswith("/labels"):
+            return FakeResponse([])
+        if "/comments" in url:
+            return FakeResponse(self.comments)
+        if "/issues/" in url:
+            return FakeResponse({
+                "state": "closed" if self.closed else "open",
+                "user": {"login": "stranger"},
+            })
+        return super(FakeGithub, self).get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        if url.endswith("/comments"):
+            self.comments.append({"user": {"login": "bot"}, "body": kwargs["json"]["body"]})
+        return super(FakeGithub, self).post(url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        if self.fail_closing:
+            return FakeResponse({"message": "Server Error"}, status_code=502)
+        self.closed = True
+        return super(FakeGithub, self).patch(url, **kwargs)
+
+
+class IssueRejectedRetryTest(JobTestCase):
+    upstream_class = FakeGithub
+
+    def rejection(self):
+        return {
+            "issue": {"key": "OSPR-1", "fields": {
+                "project": {"key": "OSPR"},
+                "issuetype": {"subtask": False},
+                self.upstream.field("Repo"): "edx/edx-platform",
+                self.upstream.field("PR Number"): "1",
+            }},
+            "changelog": {"items": [
+                {"field": "status", "fromString": "Needs Triage", "toString": "Rejected"},
+            ]},
+        }
+
+    def test_retry_does_not_comment_again(self):
+        job_id = self.queue(jira_views.issue_updated, self.rejection())
+        self.upstream.fail_closing = True
+        job = self.run_attempt(job_id)
+        self.assertEqual(job.status, "queued")
+        self.assertEqual(len(self.upstream.comments), 1)
+        self.assertFalse(self.upstream.closed)
+
+        self.upstream.fail_closing = False
+        job = self.run_attempt(job_id)
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.result, "Closed PR #1")
+        self.assertEqual(len(self.upstream.comments), 1)
+        self.assertTrue(self.upstream.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
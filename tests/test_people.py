@@ -0,0 +1,56 @@
+# coding=utf-8
+"""
+Github usernames in people.yaml match exactly, except for the contributor
+agreement check and the check for contributors missing from people.yaml.
+
+    $ python -m unittest discover tests
+"""
+from __future__ import unicode_literals, print_function
+
+import unittest
+from datetime import date
+
+# sets up the environment that the app needs to be imported
+from tests import helpers
+
+from openedx_webhooks.people import PeopleIndex, INTERNAL, CONTRACTOR, COMMUNITY
+
+PEOPLE = {
+    "JDoe": {"name": "Jane Doe", "institution": "edX"},
+    "OpenCrafter": {"name": "Olive Crafter", "institution": "OpenCraft"},
+    "Volunteer": {"name": "Val Unteer", "expires_on": date(2015, 1, 1)},
+}
+ON_DATE = date(2014, 6, 15)
+
+
+class PeopleIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.people = PeopleIndex(PEOPLE)
+
+    def test_exact_case(self):
+        self.assertEqual(self.people.classify("JDoe", ON_DATE), INTERNAL)
+        self.assertEqual(self.people.classify("OpenCrafter", ON_DATE), CONTRACTOR)
+        self.assertEqual(self.people.get("JDoe").name, "Jane Doe")
+        self.assertIn("Volunteer", self.people)
+
+    def test_mixed_case_is_not_internal_or_contractor(self):
+        self.assertEqual(self.people.classify("jdoe", ON_DATE), COMMUNITY)
+        self.assertEqual(self.people.classify("OPENCRAFTER", ON_DATE), COMMUNITY)
+        self.assertIsNone(self.people.get("jdoe"))
+        self.assertNotIn("volunteer", self.people)
+
+    def test_agreement_ignores_case(self):
+        self.assertTrue(self.people.has_agreement("volunteer", ON_DATE))
+        self.assertTrue(self.people.has_agreement("VOLUNTEER", ON_DATE))
+        self.assertFalse(self.people.has_agreement("volunteer", date(2015, 6, 15)))
+        self.assertFalse(self.people.has_agreement("stranger", ON_DATE))
+
+    def test_listed_ignores_case(self):
+        self.assertTrue(self.people.lists("JDoe"))
+        self.assertTrue(self.people.lists("jdoe"))
+        self.assertTrue(self.people.lists("oPENcRAFTER"))
+        self.assertFalse(self.people.lists("stranger"))
+
+
+if __name__ == "__main__":
+    unittest.main()
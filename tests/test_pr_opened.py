@@ -0,0 +1,97 @@
+# coding=utf-8
+"""
+Retrying ``pr_opened`` after a partial run doesn't create a second issue.
+
+    $ python -m unittest discover tests
+"""
+from __future__ import unicode_literals, print_function
+
+import time
+import unittest
+
+from tests.helpers import FakeResponse, FakeUpstream, JobTestCase
+
+import requests
+from openedx_webhooks.models import PullRequestIssue
+from openedx_webhooks.remote_files import people_file
+import openedx_webhooks.views.github as github_views
+
+
+class FakeJira(FakeUpstream):
+    """
+    JIRA keeps the issues that are created, and can be told to time out
+    after creating one, like a slow JIRA would.
+    """
+    def __init__(self):
+        self.issues = []
+        self.time_out_creating = False
+        self.searches = 0
+
+    def get(self, url, **kwargs):
+        if url.endswith("/search"):
+            self.searches += 1
+            return FakeResponse({"issues": self.issues})
+        return super(FakeJira, self).get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        if url.endswith("/rest/api/2/issue"):
+            key = "OSPR-{}".format(len(self.issues) + 1)
+            fields = kwargs["json"]["fields"]
+            self.issues.append({"key": key, "fields": {
+                self.field("Repo"): fields[self.field("Repo")],
+            }})
+            if self.time_out_creating:
+                raise requests.exceptions.ReadTimeout("JIRA took too long")
+            return FakeResponse({"key": key}, status_code=201)
+        return super(FakeJira, self).post(url, **kwargs)
+
+
+def pull_request(number):
+    return {
+        "user": {"login": "stranger", "url": "https://api.github.com/users/stranger"},
+        "base": {"repo": {"full_name": "edx/edx-platform"}},
+        "head": {"repo": {"full_name": "stranger/edx-platform"}, "ref": "patch-1"},
+        "number": number,
+        "title": "Fix a bug",
+        "body": "This fixes a bug.",
+        "html_url": "https://github.com/edx/edx-platform/pull/{}".format(number),
+        "created_at": "2015-01-01T00:00:00Z",
+        "merged": False,
+    }
+
+
+class PrOpenedRetryTest(JobTestCase):
+    upstream_class = FakeJira
+
+    def setUp(self):
+        super(PrOpenedRetryTest, self).setUp()
+        people_file.value = {}
+        people_file.fetched_at = time.time() + 60 * 60
+
+    def test_first_attempt_does_not_search(self):
+        job = self.run_attempt(self.queue(github_views.pr_opened, pull_request(1)))
+        self.assertEqual(job.status, "done")
+        self.assertEqual(self.upstream.searches, 0)
+        self.assertEqual(len(self.upstream.issues), 1)
+
+    def test_retry_does_not_create_a_duplicate_issue(self):
+        job_id = self.queue(github_views.pr_opened, pull_request(2))
+        # JIRA creates the issue, but the response never gets back to us
+        self.upstream.time_out_creating = True
+        job = self.run_attempt(job_id)
+        self.assertEqual(job.status, "queued")
+        self.assertEqual(len(self.upstream.issues), 1)
+
+        self.upstream.time_out_creating = False
+        job = self.run_attempt(job_id)
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.result, "created OSPR-1")
+        self.assertEqual(self.upstream.searches, 1)
+        self.assertEqual(len(self.upstream.issues), 1)
+        indexed = PullRequestIssue.query.filter_by(number=2).one()
+        self.assertEqual(indexed.issue_key, "OSPR-1")
+        self.assertTrue(indexed.commented and indexed.labeled)
+
+
+if __name__ == "__main__":
+    unittest.main()